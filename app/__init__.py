@@ -1,32 +1,110 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from dotenv import load_dotenv
+import multiprocessing
 import os
 from datetime import datetime
 
+from app.cache import ResultCache
+from app.database import configure_engine, engine_options
+from app.http_cache import HttpCache
+from app.instrumentation import Instrumentation
+from app.jobs import JobQueue
+
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 login_manager = LoginManager()
+job_queue = JobQueue()
+result_cache = ResultCache()
+http_cache = HttpCache()
+instrumentation = Instrumentation()
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     
-    # Configure the SQLite database
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///students.db'
+    # Settings can be provided in a .env file
+    load_dotenv()
+    
+    # Configure the database (relative SQLite paths live in the instance folder)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///students.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SECRET_KEY'] = os.urandom(24)
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 30000))  # milliseconds
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    # Set SECRET_KEY when running several workers so they accept each other's sessions
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(24)
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'uploads')
     
     # File upload configurations
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-    app.config['UPLOAD_EXTENSIONS'] = ['.xlsx', '.xls']
+    app.config['UPLOAD_EXTENSIONS'] = ['.xlsx', '.xlsm', '.xls', '.xlsb', '.csv']
     app.config['MAX_UPLOAD_TIME'] = 300  # 5 minutes timeout
+    # Uncompressed size of the files in the zip archives of a batch upload
+    app.config['MAX_EXTRACT_SIZE'] = int(os.environ.get('MAX_EXTRACT_SIZE', 256 * 1024 * 1024))
+    app.config['UPLOAD_WORKERS'] = int(os.environ.get('UPLOAD_WORKERS', 2))  # Background import threads
+    app.config['JOB_RETENTION'] = int(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))  # Seconds jobs are kept
+    app.config['IMPORT_PROCESSES'] = int(os.environ.get('IMPORT_PROCESSES', os.cpu_count() or 1))  # Batch parsers
+    # Interpreter of the batch parsers when sys.executable is not Python (mod_wsgi, uWSGI)
+    app.config['IMPORT_PYTHON'] = os.environ.get('IMPORT_PYTHON')
+    
+    # Dashboard result cache: memory, filesystem, sqlite or null
+    app.config['RESULT_CACHE_BACKEND'] = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    app.config['RESULT_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 256))
+    app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', 3600))  # seconds
+    
+    # Request/SQL metrics for /api/metrics and Server-Timing, and sampled cProfile runs
+    app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['SLOW_STATEMENTS'] = int(os.environ.get('SLOW_STATEMENTS', 10))
+    if os.environ.get('PROFILE_DIR'):
+        app.config['PROFILE_DIR'] = os.environ['PROFILE_DIR']
+    
+    # Keep career/course ids between imports and session users for USER_CACHE_TTL seconds
+    app.config['LOOKUP_CACHE'] = os.environ.get('LOOKUP_CACHE', '1').lower() in ('1', 'true', 'yes')
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+    
+    # Answer the dashboard from a memory-mapped columnar snapshot (app/snapshot.py)
+    app.config['ANALYTICS_SNAPSHOT'] = os.environ.get('ANALYTICS_SNAPSHOT', '1').lower() in ('1', 'true', 'yes')
+    if os.environ.get('SNAPSHOT_DIR'):
+        app.config['SNAPSHOT_DIR'] = os.environ['SNAPSHOT_DIR']
+    
+    # Compress HTML, JSON, CSS and JavaScript bodies (brotli when installed, else gzip)
+    app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1').lower() in ('1', 'true', 'yes')
+    app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 500))
+    
+    # Create or upgrade the database at startup when it needs it
+    app.config['AUTO_INIT_DB'] = os.environ.get('AUTO_INIT_DB', '1').lower() in ('1', 'true', 'yes')
+    
+    # Overrides, e.g. a temporary database for benchmarks
+    if config:
+        app.config.update(config)
+    
+    if app.config['IMPORT_PYTHON']:
+        multiprocessing.set_executable(app.config['IMPORT_PYTHON'])
     
     # Ensure the upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Initialize the database with the app
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
     db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+        instrumentation.init_app(app)
+    
+    # Run uploads in the background
+    job_queue.init_app(app)
+    
+    # Cache dashboard statistics between data changes
+    result_cache.init_app(app)
+    
+    # ETags, hashed static URLs and response compression
+    http_cache.init_app(app)
     
     # Initialize login manager
     login_manager.init_app(app)
@@ -35,8 +113,8 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(id):
-        from app.models import User
-        return User.query.get(int(id))
+        from app.lookups import load_user
+        return load_user(int(id))
     
     with app.app_context():
         # Import routes after db initialization to avoid circular imports
@@ -46,11 +124,20 @@ def create_app():
         app.register_blueprint(main)
         app.register_blueprint(api_bp)
         
-        # Create database tables and initialize default data
-        db.create_all()
-        from app.models import Status, User
-        Status.initialize_default_statuses()
-        User.initialize_default_admin()
+        # Create tables and default data unless the database is up to date;
+        # 'flask schema init' does it explicitly when AUTO_INIT_DB is off
+        from app.migrations import ensure_database, schema_cli
+        from app.query_plans import check_plans_command
+        if app.config['AUTO_INIT_DB']:
+            ensure_database()
+        schema_cli.add_command(check_plans_command)
+        app.cli.add_command(schema_cli)
+        
+        from app.summaries import summaries_cli
+        app.cli.add_command(summaries_cli)
+        
+        from app.maintenance import maintenance_cli
+        app.cli.add_command(maintenance_cli)
     
     # Add template context processor for current year
     @app.context_processor
@@ -0,0 +1,25 @@
+"""
+Helpers for set-based writes shared by the importer and the summary tables.
+"""
+from app import db
+
+# Number of rows sent to the database per executemany batch
+BATCH_SIZE = 500
+
+
+def get_insert(table):
+    """Return a dialect specific INSERT construct supporting ON CONFLICT"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Bulk ingestion is not supported on {dialect}")
+    return insert(table)
+
+
+def batched(rows, size=BATCH_SIZE):
+    """Yield successive slices of ``rows`` holding at most ``size`` items"""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
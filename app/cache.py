@@ -0,0 +1,379 @@
+"""
+Versioned result cache for dashboard statistics.
+
+Dashboard data only changes when an import, ``clear_data`` or
+``fix_duplicates`` runs. Each of them bumps a data version counter stored in
+the database (``AppState``) in the same transaction as its changes, and cached
+results are keyed by (endpoint, parameters, data version). A new version
+therefore makes every older entry unreachable; those entries are evicted by
+the backend's LRU/TTL policy.
+
+Backends, selected with ``RESULT_CACHE_BACKEND``:
+
+``memory``
+    In-process LRU dict (default). Each gunicorn worker has its own.
+``filesystem``
+    One JSON file per entry in ``RESULT_CACHE_DIR``, shared by the workers of
+    a host.
+``sqlite``
+    A table in the SQLite file ``RESULT_CACHE_PATH``, shared by the workers of
+    a host.
+``null``
+    Disables caching.
+
+Hit and miss counters are kept per app and process and reported by
+``stats()``.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import update
+
+DATA_VERSION = 'data_version'
+# Unix time of the last data version bump, the Last-Modified of API responses
+DATA_CHANGED_AT = 'data_changed_at'
+
+
+def data_version():
+    """Current data version, 0 if nothing was ever changed"""
+    from app import db
+    from app.models import AppState
+
+    value = db.session.query(AppState.value).filter_by(name=DATA_VERSION).scalar()
+    return value or 0
+
+
+def data_state():
+    """(data version, unix time it was reached or None) in one lookup"""
+    from app import db
+    from app.models import AppState
+
+    values = dict(db.session.query(AppState.name, AppState.value)
+                  .filter(AppState.name.in_([DATA_VERSION, DATA_CHANGED_AT])))
+    return values.get(DATA_VERSION) or 0, values.get(DATA_CHANGED_AT)
+
+
+def _set_state(name, value):
+    """Insert or update one ``AppState`` counter"""
+    from app import db
+    from app.models import AppState
+
+    result = db.session.execute(update(AppState).where(AppState.name == name).values(value=value))
+    if result.rowcount == 0:
+        db.session.add(AppState(name=name, value=value))
+
+
+def bump_data_version():
+    """
+    Invalidate cached results. Runs in the caller's transaction, so the new
+    version becomes visible together with the data it describes.
+    """
+    from app import db
+    from app.models import AppState
+
+    result = db.session.execute(
+        update(AppState).where(AppState.name == DATA_VERSION).values(value=AppState.value + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(AppState(name=DATA_VERSION, value=1))
+    _set_state(DATA_CHANGED_AT, int(time.time()))
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryBackend:
+    """
+    LRU dict with a per-entry time to live. Values are kept as JSON, like in
+    the other backends, so callers changing a result do not change the
+    cached one.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def set(self, key, value):
+        value = json.dumps(value)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileSystemBackend:
+    """
+    One JSON file per entry. Reads touch the file so its modification time
+    tracks the last use; the least recently used files are removed when the
+    directory holds more than ``max_entries``.
+    """
+
+    def __init__(self, directory, max_entries, ttl):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry['key'] != key:
+            return None
+        if entry['expires_at'] < time.time():
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry['value']
+
+    def set(self, key, value):
+        path = self._path(key)
+        # Write then rename so concurrent readers never see a partial file
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'expires_at': time.time() + self.ttl, 'value': value}, f)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        files = self._files()
+        if len(files) <= self.max_entries:
+            return
+        by_age = []
+        for path in files:
+            try:
+                by_age.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        by_age.sort()
+        for _, path in by_age[:len(by_age) - self.max_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for path in self._files():
+            self._remove(path)
+
+    def __len__(self):
+        return len(self._files())
+
+
+class SQLiteBackend:
+    """Entries in a SQLite table, with the last access time driving the LRU"""
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS result_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_result_cache_accessed_at ON result_cache (accessed_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A connection per call: backends are shared by request threads
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT value, expires_at FROM result_cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[1] < now:
+                    conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE result_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now + self.ttl, now)
+                )
+                conn.execute("DELETE FROM result_cache WHERE expires_at < ?", (now,))
+                conn.execute("""
+                    DELETE FROM result_cache WHERE key IN (
+                        SELECT key FROM result_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM result_cache")
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class AppResultCache:
+    """The backend and counters of one app"""
+
+    def __init__(self, app):
+        config = app.config
+        name = config.setdefault('RESULT_CACHE_BACKEND', 'memory')
+        max_entries = config.setdefault('RESULT_CACHE_MAX_ENTRIES', 256)
+        ttl = config.setdefault('RESULT_CACHE_TTL', 3600)
+        if name == 'memory':
+            self.backend = MemoryBackend(max_entries, ttl)
+        elif name == 'filesystem':
+            directory = config.setdefault('RESULT_CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+            self.backend = FileSystemBackend(directory, max_entries, ttl)
+        elif name == 'sqlite':
+            path = config.setdefault('RESULT_CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+            self.backend = SQLiteBackend(path, max_entries, ttl)
+        elif name == 'null':
+            self.backend = NullBackend()
+        else:
+            raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {name}")
+        self.backend_name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cached(self, endpoint, params, compute):
+        key = json.dumps([endpoint, params, data_version()])
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = compute()
+            self.backend.set(key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend_name,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'data_version': data_version()
+        }
+
+
+class ResultCache:
+    """
+    Flask extension caching JSON-serializable results per data version. Every
+    app gets its own backend (``app.extensions['result_cache']``); the methods
+    use the one of the current app.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['result_cache'] = AppResultCache(app)
+
+    def _cache(self):
+        return current_app.extensions['result_cache']
+
+    def cached(self, endpoint, params, compute):
+        """
+        Return the cached result of ``compute()`` for ``endpoint`` and
+        ``params`` at the current data version, computing and storing it on a
+        miss.
+        """
+        return self._cache().cached(endpoint, params, compute)
+
+    def clear(self):
+        self._cache().clear()
+
+    def stats(self):
+        return self._cache().stats()
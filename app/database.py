@@ -0,0 +1,56 @@
+"""
+Database engine settings.
+
+The database URL and pool limits come from the app config (filled from the
+environment in ``create_app``). PostgreSQL gets a sized QueuePool with
+pre-ping, so connections dropped by the server are replaced transparently.
+Every SQLite connection gets WAL journaling, so readers are not blocked by an
+import holding the write lock, plus a busy timeout so concurrent writers
+(e.g. several gunicorn workers) wait for each other instead of failing with
+"database is locked".
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        # The driver waits this long for a lock before raising
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True
+    }
+
+
+def sqlite_pragmas(config):
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        # Negative values are KiB rather than pages
+        'cache_size': -config['SQLITE_CACHE_SIZE_KB'],
+        'temp_store': 'MEMORY'
+    }
+
+
+def configure_engine(engine, config):
+    """Set the SQLite pragmas on every new connection of ``engine``"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
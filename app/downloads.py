@@ -0,0 +1,291 @@
+"""
+Streaming downloads of the student list and the dashboard statistics.
+
+Students are read with ``yield_per`` in batches of ``BATCH_SIZE``; the
+statuses, careers and courses of each batch come from three ``IN`` queries.
+Each batch is encoded and sent before the next one is read, so memory use
+does not grow with the number of students. CSV and Parquet bytes go out as
+soon as a batch is encoded; the sheet of an XLSX file is compressed into its
+zip package batch by batch, and the package bytes sent as they come out.
+Parquet needs the optional pyarrow package.
+"""
+import csv
+import io
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+from app import db
+from app.models import Student, Status, Career, Course, student_career, student_course, student_status
+from app.search import student_filters
+from app.stats import STATUS_GROUPS
+
+# Students read per batch, also the rows per Parquet row group
+BATCH_SIZE = 1000
+
+# The parts of an XLSX file besides its single sheet; style 1 formats dates
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+XLSX_SHEET_HEAD = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                   b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+XLSX_SHEET_TAIL = b'</sheetData></worksheet>'
+
+DOWNLOAD_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# (column, type) of each download; types are text, date and int
+STUDENT_COLUMNS = [
+    ('legajo', 'text'), ('apellido', 'text'), ('nombre', 'text'), ('tipo_documento', 'text'),
+    ('documento', 'text'), ('nacionalidad', 'text'), ('fecha_nacimiento', 'date'), ('domicilio', 'text'),
+    ('domicilio_origen', 'text'), ('telefono', 'text'), ('correo', 'text'), ('cuil', 'text'), ('sexo', 'text'),
+    ('source_file', 'text'), ('statuses', 'text'), ('careers', 'text'), ('courses', 'text')
+]
+
+STATS_COLUMNS = [('section', 'text'), ('group', 'text'), ('name', 'text'), ('students', 'int')]
+
+# Separator of the statuses, careers and courses listed in one cell
+LIST_SEPARATOR = '; '
+
+
+def _grouped(rows):
+    grouped = defaultdict(list)
+    for student_id, value in rows:
+        grouped[student_id].append(value)
+    return {student_id: LIST_SEPARATOR.join(sorted(values)) for student_id, values in grouped.items()}
+
+
+def student_batches(search=None, status=None, career=None, batch_size=BATCH_SIZE):
+    """Yield lists of ``STUDENT_COLUMNS`` rows of the filtered students, by legajo"""
+    fields = [getattr(Student, name) for name, _ in STUDENT_COLUMNS[:-3]]
+    query = db.select(Student.id, *fields).where(*student_filters(search, status, career)) \
+        .order_by(Student.legajo, Student.id)
+    result = db.session.execute(query, execution_options={'yield_per': batch_size})
+    for partition in result.partitions():
+        ids = [row[0] for row in partition]
+        statuses = _grouped(db.session.execute(
+            db.select(student_status.c.student_id, Status.name).join(Status)
+            .where(student_status.c.student_id.in_(ids))
+        ))
+        careers = _grouped(
+            (student_id, f"{name} ({plan})") for student_id, name, plan in db.session.execute(
+                db.select(student_career.c.student_id, Career.name, Career.plan).join(Career)
+                .where(student_career.c.student_id.in_(ids))
+            )
+        )
+        courses = _grouped(
+            (student_id, f"{name} [{career_name}]") for student_id, name, career_name in db.session.execute(
+                db.select(student_course.c.student_id, Course.name, Career.name)
+                .join(Course, Course.id == student_course.c.course_id).join(Career)
+                .where(student_course.c.student_id.in_(ids))
+            )
+        )
+        yield [tuple(row[1:]) + (statuses.get(row[0], ''), careers.get(row[0], ''), courses.get(row[0], ''))
+               for row in partition]
+
+
+def stats_rows(stats, status=None):
+    """
+    Flatten a /api/student-stats payload into ``STATS_COLUMNS`` rows, keeping
+    only those about ``status`` when given
+    """
+    rows = []
+    for group, counts in stats['status_counts'].items():
+        rows += [('status', group, name, count) for name, count in counts.items() if status in (None, name)]
+    for section in ('course', 'career'):
+        for name, counts in stats[f'{section}_distribution'].items():
+            if status in (None, name):
+                rows += [(section, name, key, count) for key, count in counts.items()]
+    for group, counts in stats['gender_distribution'].items():
+        if status is None or status in STATUS_GROUPS.get(group, []):
+            rows += [('gender', group, sexo, count) for sexo, count in counts.items()]
+    return rows
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return value
+
+
+def _csv_chunks(columns, batches):
+    buffer = io.StringIO()
+    # The byte order mark makes Excel read the file as UTF-8
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for rows in batches:
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file collecting the bytes written since the last ``drain``"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _xlsx_cell(reference, value, kind):
+    if value is None or value == '':
+        return ''
+    if kind == 'date':
+        return f'<c r="{reference}" s="1"><v>{to_excel(value)}</v></c>'
+    if kind == 'int':
+        return f'<c r="{reference}"><v>{int(value)}</v></c>'
+    value = ILLEGAL_CHARACTERS_RE.sub('', str(value))
+    return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+
+
+def _xlsx_rows(rows, kinds, first):
+    letters = [get_column_letter(i + 1) for i in range(len(kinds))]
+    return ''.join(
+        f'<row r="{number}">'
+        + ''.join(_xlsx_cell(f'{letter}{number}', value, kind) for letter, value, kind in zip(letters, row, kinds))
+        + '</row>'
+        for number, row in enumerate(rows, first)
+    ).encode()
+
+
+def _xlsx_chunks(columns, batches):
+    # openpyxl's write-only workbook keeps the rows until it is saved, so the
+    # sheet is written here: a zip written to a _Sink, its entries sent with
+    # data descriptors as each batch is compressed
+    kinds = [kind for _, kind in columns]
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, content in XLSX_PARTS.items():
+            package.writestr(name, content)
+        with package.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(XLSX_SHEET_HEAD)
+            sheet.write(_xlsx_rows([[name for name, _ in columns]], ['text'] * len(columns), 1))
+            number = 2
+            for rows in batches:
+                sheet.write(_xlsx_rows(rows, kinds, number))
+                number += len(rows)
+                yield sink.drain()
+            sheet.write(XLSX_SHEET_TAIL)
+    yield sink.drain()
+
+
+def _parquet_chunks(columns, batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'text': pa.string(), 'date': pa.date32(), 'int': pa.int64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in batches:
+            values = list(zip(*rows)) or [[] for _ in columns]
+            arrays = [pa.array([value.date() if isinstance(value, datetime) else value for value in column]
+                               if kind == 'date' else column, type=types[kind])
+                      for column, (_, kind) in zip(values, columns)]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _check_format(fmt):
+    if fmt not in DOWNLOAD_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet downloads require the pyarrow package")
+
+
+WRITERS = {'csv': _csv_chunks, 'xlsx': _xlsx_chunks, 'parquet': _parquet_chunks}
+
+
+def download_response(name, columns, batches, fmt):
+    """
+    A streamed attachment ``<name>-<date>.<fmt>`` of the rows in ``batches``.
+    Raises ValueError for an unknown or unavailable format.
+    """
+    _check_format(fmt)
+    chunks = WRITERS[fmt](columns, batches)
+    return Response(stream_with_context(chunks), mimetype=DOWNLOAD_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename={name}-{date.today().isoformat()}.{fmt}',
+        # Let proxies pass the chunks on as they come
+        'X-Accel-Buffering': 'no'
+    })
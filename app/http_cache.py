@@ -0,0 +1,231 @@
+"""
+HTTP caching and compression.
+
+Responses of the views decorated with ``versioned`` depend only on the data
+version (app/cache.py) and the request arguments. They carry a weak ETag made
+of the data version, the time it was reached and the release of the code, and
+that time as Last-Modified. ``Cache-Control: no-cache`` has browsers
+revalidate on every use, and a client whose copy is current gets a 304 after
+a single ``app_state`` lookup, before the view or any statistics query runs.
+Imports, ``clear_data`` and ``fix_duplicates`` bump the version, and a
+deployment changes the release, so neither leaves clients with stale copies.
+
+``url_for('static', ...)`` adds a hash of the file's content (``v``) to the
+URL. Requests carrying the current hash are answered with a year-long
+``immutable`` Cache-Control, so browsers do not ask again until the file, and
+with it its URL, changes.
+
+With ``COMPRESS_RESPONSES`` (the default) HTML, JSON, CSS and JavaScript
+bodies of at least ``COMPRESS_MIN_BYTES`` are sent brotli-compressed to
+clients that accept it when the optional brotli package is installed, and
+gzip-compressed otherwise. The compressed bodies of static files and of
+versioned responses, which are the same for every client until the file or
+the ETag changes, are kept in a small LRU. Streamed downloads are sent as
+they are.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+from werkzeug.http import is_resource_modified
+
+from app.cache import data_state
+
+COMPRESSIBLE_TYPES = {'text/html', 'application/json', 'text/css', 'text/javascript', 'application/javascript',
+                      'text/plain'}
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Cache lifetime of static files requested with their current content hash
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Compressed bodies kept for reuse
+COMPRESSED_BODIES = 64
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class AppHttpCache:
+    """The static file hashes and compressed bodies of one app"""
+
+    def __init__(self):
+        # filename -> (mtime_ns, size, content hash)
+        self._static_hashes = {}
+        # (static file content hash or ETag, path, encoding) -> compressed bytes
+        self._bodies = OrderedDict()
+        self._release = None
+        self._lock = threading.Lock()
+
+    def release(self):
+        """Token changing with the application's code, computed once per app and process"""
+        if self._release is None:
+            root = current_app.root_path
+            digest = hashlib.sha1()
+            for directory, subdirectories, files in os.walk(root):
+                subdirectories[:] = sorted(name for name in subdirectories
+                                           if name not in ('__pycache__', 'uploads', 'static'))
+                for name in sorted(files):
+                    if name.endswith(('.py', '.html')):
+                        stat = os.stat(os.path.join(directory, name))
+                        digest.update(f'{directory}/{name}:{stat.st_mtime_ns}:{stat.st_size};'.encode())
+            self._release = digest.hexdigest()[:8]
+        return self._release
+
+    def static_hash(self, filename):
+        """Content hash of a static file, or None when it does not exist"""
+        path = os.path.join(current_app.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._static_hashes.get(filename)
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open(path, 'rb') as f:
+                entry = (stat.st_mtime_ns, stat.st_size, hashlib.sha256(f.read()).hexdigest()[:12])
+            with self._lock:
+                self._static_hashes[filename] = entry
+        return entry[2]
+
+    def _hash_static_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            content_hash = self.static_hash(values['filename'])
+            if content_hash:
+                values['v'] = content_hash
+
+    def _after_request(self, response):
+        if request.endpoint == 'static' and response.status_code in (200, 304):
+            filename = request.view_args.get('filename') if request.view_args else None
+            if filename and request.args.get('v') == self.static_hash(filename):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+        if current_app.config['COMPRESS_RESPONSES']:
+            self._compress(response)
+        return response
+
+    def _encoding(self):
+        if _brotli() is not None and request.accept_encodings['br']:
+            return 'br'
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def _compress(self, response):
+        if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_TYPES \
+                or 'Content-Encoding' in response.headers:
+            return
+        static = request.endpoint == 'static'
+        # Streamed downloads go out as produced; static files are read whole
+        if response.is_streamed and not static:
+            return
+        response.vary.add('Accept-Encoding')
+        encoding = self._encoding()
+        if encoding is None:
+            return
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_BYTES']:
+            return
+
+        # The content hash of static files is kept by mtime and size; don't hash the body again
+        version = self.static_hash(request.view_args['filename']) if static else g.get('versioned_etag')
+        body = self._compressed(data, encoding, (version, request.full_path, encoding) if version else None)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity ones the tag was made for
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    def _compressed(self, data, encoding, key):
+        """``data`` compressed, reusing the bytes stored under ``key`` unless it is None"""
+        if key is not None:
+            with self._lock:
+                body = self._bodies.get(key)
+                if body is not None:
+                    self._bodies.move_to_end(key)
+                    return body
+        if encoding == 'br':
+            body = _brotli().compress(data, quality=BROTLI_QUALITY)
+        else:
+            body = gzip.compress(data, compresslevel=GZIP_LEVEL)
+        if key is not None:
+            with self._lock:
+                self._bodies[key] = body
+                while len(self._bodies) > COMPRESSED_BODIES:
+                    self._bodies.popitem(last=False)
+        return body
+
+
+
+class HttpCache:
+    """
+    Flask extension adding validators, hashed static URLs and compression.
+    Every app gets its own hashes and bodies (``app.extensions['http_cache']``);
+    the methods use the ones of the current app.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_RESPONSES', True)
+        app.config.setdefault('COMPRESS_MIN_BYTES', 500)
+        cache = app.extensions['http_cache'] = AppHttpCache()
+        app.url_defaults(cache._hash_static_url)
+        app.after_request(cache._after_request)
+
+    def _cache(self):
+        return current_app.extensions['http_cache']
+
+    def release(self):
+        """Token changing with the application's code"""
+        return self._cache().release()
+
+    def static_hash(self, filename):
+        """Content hash of a static file, or None when it does not exist"""
+        return self._cache().static_hash(filename)
+
+
+def versioned(view):
+    """
+    Answer 304 without running ``view`` when the client's copy is of the
+    current data version, and tag the view's response otherwise
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from app import http_cache
+
+        version, changed_at = data_state()
+        etag = f'{version}-{changed_at or 0}-{http_cache.release()}'
+        last_modified = datetime.fromtimestamp(changed_at, timezone.utc) if changed_at else None
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            # The body is the same for every request of this URL and tag
+            g.versioned_etag = etag
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.vary.add('Accept-Encoding')
+        return response
+    return wrapper
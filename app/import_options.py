@@ -0,0 +1,50 @@
+"""
+Import settings shared by the upload routes and the ingestion engine.
+
+Kept free of pandas and openpyxl so the web process loads without them; the
+ingestion modules are imported when an import actually runs.
+"""
+import re
+import threading
+
+READABLE_EXTENSIONS = {'xlsx', 'xlsm', 'xls', 'xlsb', 'csv'}
+
+# Map file types to status
+STATUS_MAPPING = {
+    'active': 'active',
+    'inactive': 'inactive',
+    'reregistered': 're-enrolled',
+    'incoming': 'incoming'
+}
+
+# File types recognized in the names of batch-uploaded files, checked in order
+FILE_TYPE_PATTERNS = [
+    ('inactive', re.compile(r'inactiv', re.IGNORECASE)),
+    ('reregistered', re.compile(r're-?inscrip|reregist|re-?enrol', re.IGNORECASE)),
+    ('incoming', re.compile(r'ingres|incoming', re.IGNORECASE)),
+    ('active', re.compile(r'activ', re.IGNORECASE)),
+]
+
+# merge: add and update the file's students; delta: only write changed
+# students and remove the status from students missing from the file;
+# replace: write every student of the file, which becomes the status' whole
+# student set, swapped in by one short transaction
+IMPORT_MODES = ['merge', 'delta', 'replace']
+
+# Modes of process_batch, which stages every file before writing anyway
+BATCH_MODES = ['merge', 'replace']
+
+# What an import does with rows that fail validation (app/validation.py)
+ERROR_POLICIES = ['reject', 'skip']
+
+# Imports parse concurrently but write one at a time: SQLite allows a single
+# writer and interleaved imports would race on career/course creation
+WRITE_LOCK = threading.Lock()
+
+
+def infer_file_type(filename):
+    """The file type a SIU export's name refers to, or None"""
+    for file_type, pattern in FILE_TYPE_PATTERNS:
+        if pattern.search(filename):
+            return file_type
+    return None
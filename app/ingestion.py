@@ -0,0 +1,656 @@
+"""
+Set-based ingestion engine for SIU student exports.
+
+The importer used to walk the spreadsheet row by row, issuing several lookups
+and commits per row. This module normalizes whole columns at once, resolves
+student/career/course identities from maps kept between imports (see
+app/lookups.py) and writes every table with batched ``INSERT ... ON
+CONFLICT`` statements inside a single transaction.
+
+Every import also stores a digest of each student's normalized row per
+status, with the career and course that row gave it (``ImportDigest``). A
+delta import compares the whole file against them and only writes the
+students that are new or changed, then drops the status from students
+missing from the file. Reading the file still takes most of the time of an
+import (see benchmarks/delta_import.py); what a delta import of a weekly
+export with a few changed rows saves is the writes, and with them most of
+the time ``WRITE_LOCK`` is held. A skipped student keeps its stored personal
+data even if another status file rewrote it since.
+"""
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.spawn
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from sqlalchemy import text
+
+from app import db
+from app.bulk import batched, get_insert
+from app.cache import bump_data_version
+from app.import_options import BATCH_MODES, IMPORT_MODES, STATUS_MAPPING, WRITE_LOCK
+from app.lookups import identity_maps, remember_identity_maps, stamp_identity_maps
+from app.models import (Student, Career, Course, Status, ImportDigest, student_career, student_course,
+                        student_status)
+from app.normalization import STUDENT_FIELDS, normalize_frame
+from app.readers import iter_chunks
+from app.search import refresh_search
+from app.status_masks import add_status_bit, remove_status_bit
+from app.summaries import SummaryDelta, maintain_summaries, mark_summaries_fresh
+from app.validation import FileValidator, ImportValidationError
+
+logger = logging.getLogger(__name__)
+
+# Temporary table holding the student set of a status snapshot
+SNAPSHOT_TABLE = 'status_snapshot'
+
+# Columns covered by the row digests; a renamed file alone does not count as a change
+DIGEST_STUDENT_FIELDS = [name for name in STUDENT_FIELDS if name != 'source_file']
+DIGEST_ENROLLMENT_FIELDS = ['career_name', 'plan', 'version', 'course_name']
+
+
+class ImportProgress:
+    """Receives progress updates from an import; this base class ignores them"""
+
+    def set_phase(self, phase, **counts):
+        """Called when the import enters ``phase`` (parsing, validating, writing, summarizing, done)"""
+
+    def add_written(self, count):
+        """Called after each batch with the number of database rows it wrote"""
+
+    def add_issues(self, issues):
+        """Called with the validation issues (dicts of ``REPORT_FIELDS``) found in each chunk"""
+
+
+def get_or_create_status(name):
+    """Get existing status or create a new one"""
+    status = Status.query.filter_by(name=name).first()
+    if not status:
+        status = Status(name=name)
+        db.session.add(status)
+        db.session.flush()
+    return status
+
+
+def _student_ids():
+    return dict(db.session.query(Student.legajo, Student.id))
+
+
+def _load_student_ids(legajos):
+    """Map the given legajos to student ids"""
+    ids = {}
+    for chunk in batched(list(legajos)):
+        rows = db.session.query(Student.legajo, Student.id).filter(Student.legajo.in_(chunk))
+        ids.update(dict(rows))
+    return ids
+
+
+def _load_career_ids(careers):
+    """Ids of the given careers (dicts of name, plan and version) by natural key"""
+    keys = {(career['name'], career['plan'], career['version']) for career in careers}
+    ids = {}
+    for chunk in batched(list({name for name, _, _ in keys})):
+        rows = db.session.query(Career.id, Career.name, Career.plan, Career.version).filter(Career.name.in_(chunk))
+        ids.update(((name, plan, version), id) for id, name, plan, version in rows if (name, plan, version) in keys)
+    return ids
+
+
+def _load_course_ids(courses):
+    """Ids of the given courses (dicts of name and career_id) by natural key"""
+    keys = {(course['name'], course['career_id']) for course in courses}
+    ids = {}
+    for chunk in batched(list({career_id for _, career_id in keys})):
+        rows = db.session.query(Course.id, Course.name, Course.career_id).filter(Course.career_id.in_(chunk))
+        ids.update(((name, career_id), id) for id, name, career_id in rows if (name, career_id) in keys)
+    return ids
+
+
+def _execute_batches(stmt, rows, progress):
+    for chunk in batched(rows):
+        db.session.execute(stmt, chunk)
+        progress.add_written(len(chunk))
+
+
+def _insert_ignore(table, rows, progress):
+    """Insert rows, skipping those that collide with an existing key"""
+    if rows:
+        _execute_batches(get_insert(table).on_conflict_do_nothing(), rows, progress)
+
+
+def write_students(students, student_ids, progress):
+    """Upsert student rows by legajo, adding new students to ``student_ids``"""
+    records = students.to_dict('records')
+    if records:
+        stmt = get_insert(Student.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['legajo'],
+            set_={name: stmt.excluded[name] for name in STUDENT_FIELDS + ['updated_at'] if name != 'legajo'}
+        )
+        _execute_batches(stmt, records, progress)
+    student_ids.update(_load_student_ids(set(students['legajo']) - student_ids.keys()))
+    return student_ids
+
+
+def write_enrollments(enrollments, student_ids, career_ids, course_ids, status, progress):
+    """
+    Resolve careers and courses, then link them and ``status`` to students.
+
+    ``career_ids`` and ``course_ids`` are updated in place with the careers
+    and courses created along the way. Returns the (career id, course id or
+    None) of each student's enrollment, by student id.
+    """
+    # New careers and courses get their ids in order of first appearance
+    career_keys = dict.fromkeys(zip(enrollments['career_name'], enrollments['plan'], enrollments['version']))
+    new_careers = [{'name': name, 'plan': plan, 'version': version}
+                   for name, plan, version in career_keys if (name, plan, version) not in career_ids]
+    if new_careers:
+        # The unique (name, plan, version) index absorbs careers created by
+        # another process since the map was loaded
+        _insert_ignore(Career.__table__, new_careers, progress)
+        career_ids.update(_load_career_ids(new_careers))
+
+    enrollment_careers = [career_ids[key] for key in
+                          zip(enrollments['career_name'], enrollments['plan'], enrollments['version'])]
+    enrollment_students = [student_ids[legajo] for legajo in enrollments['legajo']]
+
+    course_rows = [(name, career_id) for name, career_id
+                   in zip(enrollments['course_name'], enrollment_careers) if isinstance(name, str)]
+    new_courses = [{'name': name, 'career_id': career_id}
+                   for name, career_id in dict.fromkeys(course_rows) if (name, career_id) not in course_ids]
+    if new_courses:
+        _insert_ignore(Course.__table__, new_courses, progress)
+        course_ids.update(_load_course_ids(new_courses))
+
+    _insert_ignore(student_career, [
+        {'student_id': student_id, 'career_id': career_id}
+        for student_id, career_id in sorted(set(zip(enrollment_students, enrollment_careers)))
+    ], progress)
+    _insert_ignore(student_course, [
+        {'student_id': student_id, 'course_id': course_ids[(name, career_id)]}
+        for student_id, name, career_id in sorted(set(
+            (student_id, name, career_id) for student_id, name, career_id
+            in zip(enrollment_students, enrollments['course_name'], enrollment_careers)
+            if isinstance(name, str)
+        ))
+    ], progress)
+    _insert_ignore(student_status, [
+        {'student_id': student_id, 'status_id': status.id}
+        for student_id in sorted(set(enrollment_students))
+    ], progress)
+    add_status_bit(enrollment_students, status.name)
+    return {
+        student_id: (career_id, course_ids[(name, career_id)] if isinstance(name, str) else None)
+        for student_id, name, career_id in zip(enrollment_students, enrollments['course_name'], enrollment_careers)
+    }
+
+
+def normalized_chunks(filepath, validator, progress, seen_legajos):
+    """
+    Yield (rows read, students, enrollments) for each chunk of an export,
+    leaving out the rows ``validator`` rejects. Once the file as a whole is
+    rejected the remaining chunks are only validated, for the report, and
+    yield no students.
+    """
+    source_file = os.path.basename(filepath)
+    for chunk in iter_chunks(filepath):
+        issues, bad = validator.check(chunk)
+        if issues:
+            progress.add_issues(issues)
+        if validator.fatal:
+            break
+        if validator.rejected:
+            yield len(chunk), None, None
+            continue
+        yield (len(chunk), *normalize_frame(chunk[~bad] if bad.any() else chunk, source_file, seen_legajos))
+
+
+def _joined(frame, columns):
+    return ['\x1f'.join(map(str, values)) for values in zip(*(frame[name] for name in columns))]
+
+
+def _digest(student_text, enrollment_text):
+    # The leading empty part keeps the digests stored by earlier versions valid
+    return hashlib.blake2b('\x1e'.join(['', student_text, enrollment_text]).encode(), digest_size=16).hexdigest()
+
+
+class FileDigests:
+    """
+    Digests of the students of a file, fed its normalized chunks: the
+    personal data of a student's last row and the enrollment of its first,
+    so a student split across chunks gets the digest it has in one.
+    """
+
+    def __init__(self):
+        self.student_texts = {}
+        self.enrollment_texts = {}
+
+    def add(self, students, enrollments):
+        self.student_texts.update(zip(students['legajo'], _joined(students, DIGEST_STUDENT_FIELDS)))
+        self.enrollment_texts.update(zip(enrollments['legajo'], _joined(enrollments, DIGEST_ENROLLMENT_FIELDS)))
+
+    def digests(self):
+        """{legajo: digest} of the students added so far"""
+        return {legajo: _digest(text, self.enrollment_texts.get(legajo, ''))
+                for legajo, text in self.student_texts.items()}
+
+
+def _stored_digests(status):
+    """(digest, career id, course id) of the students that still hold ``status``, by student id"""
+    rows = db.session.query(ImportDigest.student_id, ImportDigest.digest, ImportDigest.career_id,
+                            ImportDigest.course_id) \
+        .join(student_status, (student_status.c.student_id == ImportDigest.student_id)
+              & (student_status.c.status_id == ImportDigest.status_id)) \
+        .filter(ImportDigest.status_id == status.id)
+    return {student_id: (digest, career_id, course_id) for student_id, digest, career_id, course_id in rows}
+
+
+def write_digests(digests, enrolled, status, progress):
+    """
+    Store the digests ({student_id: digest}) of students written for
+    ``status`` with their enrollment (``write_enrollments``)
+    """
+    stmt = get_insert(ImportDigest.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['status_id', 'student_id'],
+                                      set_={name: stmt.excluded[name] for name in ('digest', 'career_id', 'course_id')})
+    rows = []
+    for student_id, digest in sorted(digests.items()):
+        career_id, course_id = enrolled.get(student_id, (None, None))
+        rows.append({'status_id': status.id, 'student_id': student_id, 'digest': digest,
+                     'career_id': career_id, 'course_id': course_id})
+    _execute_batches(stmt, rows, progress)
+
+
+def drop_replaced_enrollments(stored, enrolled, status, progress):
+    """
+    Unlink the career and course the previous row of ``status`` gave a
+    student when its new enrollment (``enrolled``, as returned by
+    ``write_enrollments``) differs, unless the file of another status gave
+    the student the same ones. ``stored`` is ``_stored_digests(status)``;
+    digests stored before their enrollment was recorded leave the links
+    alone. Returns the number of links removed.
+    """
+    dropped = {'career_id': [], 'course_id': []}
+    for student_id, (career_id, course_id) in enrolled.items():
+        _, old_career, old_course = stored.get(student_id, (None, None, None))
+        if old_career is not None and old_career != career_id:
+            dropped['career_id'].append((student_id, old_career))
+        if old_course is not None and old_course != course_id:
+            dropped['course_id'].append((student_id, old_course))
+    students = sorted({student_id for pairs in dropped.values() for student_id, _ in pairs})
+    if not students:
+        return 0
+
+    held = set()
+    for chunk in batched(students):
+        rows = db.session.query(ImportDigest.student_id, ImportDigest.career_id, ImportDigest.course_id) \
+            .filter(ImportDigest.student_id.in_(chunk), ImportDigest.status_id != status.id)
+        for student_id, career_id, course_id in rows:
+            held.update([('career_id', student_id, career_id), ('course_id', student_id, course_id)])
+
+    removed = 0
+    for table, column in ((student_career.name, 'career_id'), (student_course.name, 'course_id')):
+        rows = [{'student_id': student_id, 'linked_id': linked_id} for student_id, linked_id in dropped[column]
+                if (column, student_id, linked_id) not in held]
+        if rows:
+            _execute_batches(text(f"DELETE FROM {table} WHERE student_id = :student_id AND {column} = :linked_id"),
+                             rows, progress)
+            removed += len(rows)
+    return removed
+
+
+def replace_status_students(student_ids, status, summary, progress):
+    """
+    Make ``student_ids`` the whole student set of ``status``: the status and
+    its digests are removed set-wise from every other student. Returns the
+    number of students removed from the status.
+    """
+    db.session.execute(text(f"CREATE TEMPORARY TABLE IF NOT EXISTS {SNAPSHOT_TABLE} "
+                            f"(student_id INTEGER PRIMARY KEY)"))
+    db.session.execute(text(f"DELETE FROM {SNAPSHOT_TABLE}"))
+    for chunk in batched([{'student_id': student_id} for student_id in sorted(student_ids)]):
+        db.session.execute(text(f"INSERT INTO {SNAPSHOT_TABLE} (student_id) VALUES (:student_id)"), chunk)
+
+    outside = f"status_id = :status_id AND student_id NOT IN (SELECT student_id FROM {SNAPSHOT_TABLE})"
+    params = {'status_id': status.id}
+    removed = [student_id for student_id, in
+               db.session.execute(text(f"SELECT student_id FROM student_status WHERE {outside}"), params)]
+    if removed:
+        if summary:
+            summary.remove(removed)
+        db.session.execute(text(f"DELETE FROM student_status WHERE {outside}"), params)
+        remove_status_bit(removed, status.name)
+        db.session.execute(text(f"DELETE FROM import_digest WHERE {outside}"), params)
+        progress.add_written(len(removed))
+        if summary:
+            summary.touch(removed)
+    return len(removed)
+
+
+def process_file(filepath, file_type, progress=None, mode='merge', on_error='reject'):
+    """
+    Import a SIU export of the given ``file_type`` in a single transaction.
+
+    A merge import streams the file in chunks, so memory use stays bounded
+    whatever its size, and holds ``WRITE_LOCK`` throughout. Delta and
+    replace imports instead read and validate the whole file first and only
+    then take the lock, so their transaction lasts just the writes. Both make
+    the file the status' whole student set: students missing from it lose
+    the status, and a student whose row now names another career or course
+    loses the one its previous row gave it (see
+    ``drop_replaced_enrollments``). A delta import then only writes the
+    students whose digest changed.
+
+    Every chunk is validated before it is written (see app/validation.py).
+    With ``on_error='reject'`` a file with errors is rolled back as a whole
+    and ``ImportValidationError`` raised once all of it has been checked;
+    with ``'skip'`` its bad rows are left out. The issues found go to
+    ``progress.add_issues``.
+
+    Returns a dict with the number of rows read, students in the file, rows
+    skipped and warnings; delta and replace imports add the number of
+    students removed from the status, delta imports the number of students
+    added, changed and unchanged (skipped).
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode: {mode}")
+    progress = progress or ImportProgress()
+    status_name = STATUS_MAPPING.get(file_type, 'unknown')
+    source_file = os.path.basename(filepath)
+    total_rows = 0
+    seen_legajos = set()
+    file_digests = FileDigests()
+    counts = {'added': 0, 'changed': 0, 'unchanged': 0}
+
+    progress.set_phase('parsing')
+    validator = FileValidator(source_file, on_error)
+    normalized = normalized_chunks(filepath, validator, progress, seen_legajos)
+    if mode != 'merge':
+        staged = []
+        for chunk in normalized:
+            staged.append(chunk)
+            total_rows += chunk[0]
+            if chunk[1] is not None:
+                file_digests.add(chunk[1], chunk[2])
+            progress.set_phase('validating', rows_parsed=total_rows)
+        validator.raise_if_rejected()
+        normalized = staged
+    total_rows = 0
+
+    with WRITE_LOCK:
+        try:
+            status = get_or_create_status(status_name)
+            student_ids = _student_ids()
+            maps = identity_maps()
+            # Summaries are only maintained when they serve the dashboard and were up to date
+            summary = SummaryDelta() if maintain_summaries() else None
+            stored_digests = _stored_digests(status) if mode != 'merge' else {}
+
+            changed = None
+            if mode == 'delta':
+                changed = set()
+                for legajo, digest in file_digests.digests().items():
+                    stored = stored_digests.get(student_ids.get(legajo))
+                    if stored is not None and stored[0] == digest:
+                        counts['unchanged'] += 1
+                    else:
+                        counts['added' if stored is None else 'changed'] += 1
+                        changed.add(legajo)
+
+            written = set()
+            enrolled = {}
+            for rows, students, enrollments in normalized:
+                total_rows += rows
+                if students is None:
+                    # Rejected: the rest of the file is only checked for the report
+                    progress.set_phase('validating', rows_parsed=total_rows)
+                    continue
+                progress.set_phase('writing', rows_parsed=total_rows)
+                if mode == 'merge':
+                    file_digests.add(students, enrollments)
+                if changed is not None:
+                    students = students[students['legajo'].isin(changed)]
+                    enrollments = enrollments[enrollments['legajo'].isin(changed)]
+                if summary:
+                    summary.remove(student_ids[legajo] for legajo in students['legajo'] if legajo in student_ids)
+                write_students(students, student_ids, progress)
+                written_ids = [student_ids[legajo] for legajo in students['legajo']]
+                written.update(written_ids)
+                refresh_search(written_ids)
+                if summary:
+                    summary.touch(written_ids)
+                enrolled.update(write_enrollments(enrollments, student_ids, maps.careers, maps.courses, status,
+                                                  progress))
+            validator.raise_if_rejected()
+
+            if mode != 'merge':
+                drop_replaced_enrollments(stored_digests, enrolled, status, progress)
+            # Written once the whole file is read: a student split across chunks has a single digest
+            write_digests({student_ids[legajo]: digest for legajo, digest in file_digests.digests().items()
+                           if student_ids[legajo] in written}, enrolled, status, progress)
+
+            if mode != 'merge':
+                counts['removed'] = replace_status_students(
+                    {student_ids[legajo] for legajo in seen_legajos}, status, summary, progress)
+
+            # Raw count from the Excel file (excluding header)
+            status.source_row_count = total_rows
+            if summary:
+                progress.set_phase('summarizing')
+                summary.apply()
+            bump_data_version()
+            stamp_identity_maps(maps)
+            if summary:
+                mark_summaries_fresh()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        remember_identity_maps(maps)
+
+    progress.set_phase('done')
+    result = {'rows': total_rows, 'students': len(seen_legajos), 'skipped': validator.skipped,
+              'warnings': validator.warnings}
+    if mode == 'delta':
+        result.update(counts)
+    elif mode == 'replace':
+        result['removed'] = counts['removed']
+    return result
+
+
+class IssueList(ImportProgress):
+    """Collects the validation issues of an import"""
+
+    def __init__(self):
+        self.issues = []
+
+    def add_issues(self, issues):
+        self.issues.extend(issues)
+
+
+def parse_file(filepath, file_type, on_error='reject'):
+    """
+    Validate, read and normalize a whole export, computing its row digests.
+    Runs in a worker process for batch imports, so it touches no database and
+    returns its validation issues instead of raising.
+    """
+    seen_legajos = set()
+    file_digests = FileDigests()
+    rows = 0
+    student_frames, enrollment_frames = [], []
+    validator = FileValidator(os.path.basename(filepath), on_error)
+    collector = IssueList()
+    for chunk_rows, students, enrollments in normalized_chunks(filepath, validator, collector, seen_legajos):
+        rows += chunk_rows
+        if students is None:
+            continue
+        file_digests.add(students, enrollments)
+        student_frames.append(students)
+        enrollment_frames.append(enrollments)
+    result = {
+        'filepath': filepath,
+        'file_type': file_type,
+        'rows': rows,
+        'issues': collector.issues,
+        'rejection': validator.rejection(),
+        'skipped': validator.skipped,
+        'warnings': validator.warnings
+    }
+    if not student_frames or result['rejection']:
+        result.update(digests={}, students=pd.DataFrame(columns=STUDENT_FIELDS),
+                      enrollments=pd.DataFrame(columns=['legajo'] + DIGEST_ENROLLMENT_FIELDS))
+        return result
+    students = pd.concat(student_frames, ignore_index=True)
+    result.update(
+        # A student split across chunks keeps the data of its last row
+        students=students[~students['legajo'].duplicated(keep='last')],
+        enrollments=pd.concat(enrollment_frames, ignore_index=True),
+        digests=file_digests.digests()
+    )
+    return result
+
+
+def merge_students(frames):
+    """
+    Merge the students of several files: each student keeps the data of the
+    last file listing it, in the order of its first appearance, so new
+    students get the ids importing the files one by one would give them.
+    """
+    students = pd.concat(frames, ignore_index=True)
+    first_seen = students['legajo'][~students['legajo'].duplicated(keep='first')]
+    latest = students[~students['legajo'].duplicated(keep='last')].set_index('legajo', drop=False)
+    return latest.loc[first_seen].reset_index(drop=True)
+
+
+def _spawn_context():
+    """
+    The context of the parse worker processes, or None when this process
+    cannot start them: under mod_wsgi or uWSGI ``sys.executable`` is the
+    server, not a Python interpreter, unless IMPORT_PYTHON names one.
+    """
+    executable = os.path.basename(os.fsdecode(multiprocessing.spawn.get_executable() or '')).lower()
+    if not executable.startswith(('python', 'pypy')):
+        return None
+    # Spawned rather than forked: the web process runs threads holding locks
+    return multiprocessing.get_context('spawn')
+
+
+def _parse_files(files, processes, on_error):
+    """
+    parse_file every (filepath, file_type), in a process pool when
+    ``processes`` > 1 and workers can be spawned, else in this process
+    """
+    context = _spawn_context() if processes > 1 else None
+    if context is not None:
+        filepaths, file_types = zip(*files)
+        try:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+                return list(pool.map(parse_file, filepaths, file_types, [on_error] * len(files)))
+        except (BrokenProcessPool, OSError) as e:
+            # A worker that could not start or died; errors of parse_file itself recur below
+            logger.warning(f"Parse workers failed ({e!r}), parsing in this process")
+    return [parse_file(filepath, file_type, on_error) for filepath, file_type in files]
+
+
+def process_batch(files, progress=None, mode='merge', processes=None, on_error='reject'):
+    """
+    Import several SIU exports, given as (filepath, file_type), in a single
+    transaction.
+
+    Files are parsed and validated in parallel worker processes before
+    anything is written (in this process when they cannot be spawned, see
+    ``_spawn_context``); a file rejected by validation (see ``process_file``
+    for ``on_error``) fails the whole batch. Students listed
+    by several files are written once, with the data of the last file listing
+    them, and student/career/course identities are resolved once for the
+    batch. Each status' ``source_row_count`` is the row count of its files.
+    With ``mode='replace'`` the files of each status become its whole student
+    set, as with ``process_file``. Returns the per-file and overall row and
+    student counts.
+    """
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Unknown batch import mode: {mode}")
+    progress = progress or ImportProgress()
+    processes = min(len(files), processes or os.cpu_count() or 1)
+
+    progress.set_phase('parsing')
+    parsed = _parse_files(files, processes, on_error)
+    total_rows = sum(result['rows'] for result in parsed)
+    progress.set_phase('validating', rows_parsed=total_rows)
+    for result in parsed:
+        if result['issues']:
+            progress.add_issues(result['issues'])
+    rejections = [result['rejection'] for result in parsed if result['rejection']]
+    if rejections:
+        raise ImportValidationError('; '.join(rejections))
+    students = merge_students([result['students'] for result in parsed])
+
+    with WRITE_LOCK:
+        try:
+            statuses = {}
+            for result in parsed:
+                status = get_or_create_status(STATUS_MAPPING.get(result['file_type'], 'unknown'))
+                statuses[result['file_type']] = status
+            student_ids = _student_ids()
+            maps = identity_maps()
+            summary = SummaryDelta() if maintain_summaries() else None
+            stored_digests = {status: _stored_digests(status) for status in statuses.values()} \
+                if mode == 'replace' else {}
+
+            progress.set_phase('writing', rows_parsed=total_rows)
+            if summary:
+                summary.remove(student_ids[legajo] for legajo in students['legajo'] if legajo in student_ids)
+            write_students(students, student_ids, progress)
+            written_ids = [student_ids[legajo] for legajo in students['legajo']]
+            refresh_search(written_ids)
+            if summary:
+                summary.touch(written_ids)
+
+            status_rows = dict.fromkeys(statuses.values(), 0)
+            status_students = {status: set() for status in statuses.values()}
+            status_enrolled = {status: {} for status in statuses.values()}
+            for result in parsed:
+                status = statuses[result['file_type']]
+                enrolled = write_enrollments(result['enrollments'], student_ids, maps.careers, maps.courses, status,
+                                             progress)
+                write_digests({student_ids[legajo]: digest for legajo, digest in result['digests'].items()},
+                              enrolled, status, progress)
+                status_enrolled[status].update(enrolled)
+                status_rows[status] += result['rows']
+                status_students[status].update(student_ids[legajo] for legajo in result['digests'])
+
+            removed = 0
+            for status, rows in status_rows.items():
+                status.source_row_count = rows
+                if mode == 'replace':
+                    drop_replaced_enrollments(stored_digests[status], status_enrolled[status], status, progress)
+                    removed += replace_status_students(status_students[status], status, summary, progress)
+
+            if summary:
+                progress.set_phase('summarizing')
+                summary.apply()
+            bump_data_version()
+            stamp_identity_maps(maps)
+            if summary:
+                mark_summaries_fresh()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        remember_identity_maps(maps)
+
+    progress.set_phase('done')
+    result = {
+        'files': [{'filename': os.path.basename(result['filepath']), 'file_type': result['file_type'],
+                   'rows': result['rows'], 'students': len(result['digests']), 'skipped': result['skipped'],
+                   'warnings': result['warnings']} for result in parsed],
+        'rows': total_rows,
+        'students': len(students),
+        'skipped': sum(result['skipped'] for result in parsed),
+        'warnings': sum(result['warnings'] for result in parsed)
+    }
+    if mode == 'replace':
+        result['removed'] = removed
+    return result
@@ -0,0 +1,209 @@
+"""
+Opt-in request and SQL instrumentation.
+
+With ``INSTRUMENTATION`` enabled every request records its wall time, the
+number of SQL statements it ran, their total time and its slowest statement,
+using SQLAlchemy's ``before/after_cursor_execute`` events and Flask's request
+signals. Each response gets a ``Server-Timing`` header with those figures and
+the per-endpoint totals, plus the slowest statements seen, are served in the
+Prometheus text format by ``/api/metrics``. Metrics are kept per app and
+process.
+
+``PROFILE_SAMPLE_RATE`` (0 to 1) runs that share of requests under cProfile
+and writes their stats to ``PROFILE_DIR``, for ``python -m pstats`` or
+snakeviz.
+"""
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request, request_finished, request_started
+from sqlalchemy import event
+
+# Longest statement text kept in the slow statement list
+STATEMENT_LENGTH = 200
+
+
+def _normalize(statement):
+    statement = ' '.join(statement.split())
+    if len(statement) > STATEMENT_LENGTH:
+        statement = statement[:STATEMENT_LENGTH - 3] + '...'
+    return statement
+
+
+def _label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestMetrics:
+    """SQL activity and timing of the current request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = (0.0, None)
+        self.profiler = None
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+
+class EndpointTotals:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+class AppInstrumentation:
+    """The settings and metrics of one app"""
+
+    def __init__(self, app):
+        config = app.config
+        self.enabled = config.setdefault('INSTRUMENTATION', False)
+        self.sample_rate = config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_dir = config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        self.slow_statements = config.setdefault('SLOW_STATEMENTS', 10)
+        self.endpoints = {}
+        self._slowest = {}
+        self._lock = threading.Lock()
+        if not self.enabled:
+            return
+
+        from app import db
+        event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        app.teardown_request(self._teardown_request)
+
+    # SQL events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        # Statements of background imports run outside any request
+        metrics = g.get('request_metrics') if has_request_context() else None
+        if metrics is not None:
+            metrics.add_query(statement, seconds)
+
+    # Request signals
+
+    def _request_started(self, sender, **extra):
+        metrics = g.request_metrics = RequestMetrics()
+        if self.sample_rate and random.random() < self.sample_rate:
+            metrics.profiler = cProfile.Profile()
+            metrics.profiler.enable()
+
+    def _request_finished(self, sender, response, **extra):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return
+        seconds = time.perf_counter() - metrics.start
+        if metrics.profiler is not None:
+            metrics.profiler.disable()
+            self._save_profile(metrics.profiler)
+
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            totals = self.endpoints.setdefault(endpoint, EndpointTotals())
+            totals.requests += 1
+            totals.errors += response.status_code >= 500
+            totals.seconds += seconds
+            totals.queries += metrics.queries
+            totals.sql_seconds += metrics.sql_seconds
+            slowest, statement = metrics.slowest
+            if statement is not None:
+                # One series per endpoint and statement, holding its worst time
+                key = (endpoint, _normalize(statement))
+                self._slowest[key] = max(slowest, self._slowest.get(key, 0.0))
+                if len(self._slowest) > self.slow_statements:
+                    del self._slowest[min(self._slowest, key=self._slowest.get)]
+
+        response.headers.add('Server-Timing', f'sql;dur={metrics.sql_seconds * 1000:.1f};'
+                                              f'desc="{metrics.queries} queries"')
+        response.headers.add('Server-Timing', f'sql-max;dur={slowest * 1000:.1f}')
+        response.headers.add('Server-Timing', f'total;dur={seconds * 1000:.1f}')
+
+    def _teardown_request(self, exc):
+        # The request failed before request_finished: stop its profiler
+        metrics = g.pop('request_metrics', None)
+        if metrics is not None and metrics.profiler is not None:
+            metrics.profiler.disable()
+
+    def _save_profile(self, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        endpoint = re.sub(r'[^\w.-]', '_', request.endpoint or 'unknown')
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        profiler.dump_stats(os.path.join(self.profile_dir, f'{stamp}-{endpoint}.prof'))
+
+    # Exposition
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            slowest = sorted(self._slowest.items(), key=lambda item: item[1], reverse=True)
+
+        families = [
+            ('app_requests_total', 'counter', 'Requests handled', lambda t: t.requests),
+            ('app_request_errors_total', 'counter', 'Requests answered with a 5xx status', lambda t: t.errors),
+            ('app_request_duration_seconds_total', 'counter', 'Wall time spent handling requests',
+             lambda t: round(t.seconds, 6)),
+            ('app_sql_queries_total', 'counter', 'SQL statements run by requests', lambda t: t.queries),
+            ('app_sql_duration_seconds_total', 'counter', 'Time requests spent in SQL statements',
+             lambda t: round(t.sql_seconds, 6)),
+        ]
+        lines = []
+        for name, kind, description, value in families:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for endpoint, totals in endpoints:
+                lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {value(totals)}')
+
+        lines.append('# HELP app_slow_statement_seconds Worst time of the slowest SQL statements seen')
+        lines.append('# TYPE app_slow_statement_seconds gauge')
+        for (endpoint, statement), seconds in slowest:
+            lines.append(f'app_slow_statement_seconds{{endpoint="{_label(endpoint)}",'
+                         f'statement="{_label(statement)}"}} {round(seconds, 6)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Instrumentation:
+    """
+    Flask extension recording per-request SQL and timing metrics. Every app
+    gets its own metrics (``app.extensions['instrumentation']``); the
+    attributes answer for the current app.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Hook the app's signals and engine; call within an app context"""
+        app.extensions['instrumentation'] = AppInstrumentation(app)
+
+    def _metrics(self):
+        return current_app.extensions['instrumentation']
+
+    @property
+    def enabled(self):
+        return self._metrics().enabled
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        return self._metrics().render()
@@ -0,0 +1,281 @@
+"""
+Background import jobs for /upload.
+
+Uploads are queued to a local thread pool so the request returns a job id
+straight away. Job state is mirrored to small JSON files in ``JOBS_FOLDER`` so
+that any worker process can answer ``/api/jobs/<id>``, not only the one that
+accepted the upload. Validation issues are appended to a CSV report next to
+the uploaded files, which are deleted once the job finishes. The state files
+and reports of jobs finished more than ``JOB_RETENTION`` seconds ago are
+swept when new jobs are created.
+
+Every app gets its own pool and folders (``app.extensions['job_queue']``);
+``job_queue`` answers for the app of the current context.
+"""
+import contextlib
+import csv
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+# Issues kept in the job state for display; all of them go to the report
+ISSUE_SAMPLE = 20
+
+# Written rows alone save the job state at most this often; phase and status
+# changes always save it
+PROGRESS_SAVE_SECONDS = 1.0
+PROGRESS_SAVE_ROWS = 10000
+
+# Kept in the upload directory of a job once its uploaded files are deleted
+REPORT_NAME = 'validation-report.csv'
+
+# Old jobs are looked for at most this often per app and process
+SWEEP_SECONDS = 3600
+
+
+class ImportJob:
+    """
+    State of a queued import. Implements the ``ImportProgress`` hooks so the
+    ingestion engine updates it as it runs.
+    """
+
+    def __init__(self, queue, filename, file_type, mode='merge', on_error='reject', job_id=None):
+        self.queue = queue
+        self.id = job_id or uuid.uuid4().hex
+        self.filename = filename
+        self.file_type = file_type
+        self.mode = mode
+        self.on_error = on_error
+        self.status = 'queued'
+        self.phase = 'queued'
+        self.rows_parsed = 0
+        self.rows_written = 0
+        self.errors = []
+        self.issues = []
+        self.issue_counts = {'error': 0, 'warning': 0}
+        self.result = None
+        self.created_at = datetime.utcnow().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        # When and at which rows_written the state was last saved
+        self.saved_at = 0.0
+        self.saved_rows = 0
+
+    def set_phase(self, phase, **counts):
+        self.phase = phase
+        for name, value in counts.items():
+            setattr(self, name, value)
+        self.queue.save(self)
+
+    def add_written(self, count):
+        self.rows_written += count
+        if time.monotonic() - self.saved_at >= PROGRESS_SAVE_SECONDS \
+                or self.rows_written - self.saved_rows >= PROGRESS_SAVE_ROWS:
+            self.queue.save(self)
+
+    def add_issues(self, issues):
+        from app.validation import REPORT_FIELDS
+        path = self.queue.report_path(self.id)
+        header = not os.path.exists(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            if header:
+                writer.writeheader()
+            writer.writerows(issues)
+        for issue in issues:
+            self.issue_counts[issue['severity']] += 1
+        self.issues.extend(issues[:max(ISSUE_SAMPLE - len(self.issues), 0)])
+        self.queue.save(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'file_type': self.file_type,
+            'mode': self.mode,
+            'on_error': self.on_error,
+            'status': self.status,
+            'phase': self.phase,
+            'rows_parsed': self.rows_parsed,
+            'rows_written': self.rows_written,
+            'errors': self.errors,
+            'issues': self.issues,
+            'issue_counts': self.issue_counts,
+            'report': sum(self.issue_counts.values()) > 0,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class AppJobQueue:
+    """The worker pool and job folders of one app"""
+
+    def __init__(self, app):
+        self.app = app
+        self.folder = app.config.setdefault('JOBS_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+        self.retention = app.config.setdefault('JOB_RETENTION', 7 * 24 * 3600)
+        os.makedirs(self.folder, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=app.config.setdefault('UPLOAD_WORKERS', 2),
+                                           thread_name_prefix='import')
+        self.swept_at = None
+        self._lock = threading.Lock()
+
+    def upload_path(self, job_id, filename):
+        """Path where the uploaded file of a job is stored"""
+        directory = os.path.join(self.app.config['UPLOAD_FOLDER'], job_id)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def discard_uploads(self, job_id):
+        """Delete the uploaded files of a finished job, keeping its validation report"""
+        directory = os.path.join(self.app.config['UPLOAD_FOLDER'], job_id)
+        for entry in os.scandir(directory):
+            if entry.name != REPORT_NAME:
+                os.remove(entry.path)
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+    def report_path(self, job_id):
+        """Path of the validation report of a job"""
+        return self.upload_path(job_id, REPORT_NAME)
+
+    def sweep(self, now=None):
+        """
+        Delete the state files and reports of the jobs last saved more than
+        ``retention`` seconds ago: finished, or left unfinished by a process
+        that died, as running jobs save their state every few seconds.
+        Returns how many jobs.
+        """
+        cutoff = (now or time.time()) - self.retention
+        swept = 0
+        for entry in os.scandir(self.folder):
+            job_id, extension = os.path.splitext(entry.name)
+            if extension != '.json' or not job_id.isalnum():
+                continue
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            shutil.rmtree(os.path.join(self.app.config['UPLOAD_FOLDER'], job_id), ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+            swept += 1
+        return swept
+
+    def new_job(self, filename, file_type, mode='merge', on_error='reject'):
+        now = time.monotonic()
+        if self.swept_at is None or now - self.swept_at >= SWEEP_SECONDS:
+            self.swept_at = now
+            try:
+                self.sweep()
+            except OSError:
+                self.app.logger.error(traceback.format_exc())
+        job = ImportJob(self, filename, file_type, mode, on_error)
+        self.save(job)
+        return job
+
+    def submit(self, job, filepath):
+        """Queue the import of ``filepath`` for ``job``"""
+        def run():
+            from app.ingestion import process_file
+            return process_file(filepath, job.file_type, progress=job, mode=job.mode,
+                                on_error=job.on_error)
+        self.executor.submit(self._run, job, run)
+        return job
+
+    def submit_batch(self, job, files):
+        """Queue the import of several (filepath, file_type) in one transaction for ``job``"""
+        def run():
+            from app.ingestion import process_batch
+            return process_batch(files, progress=job, mode=job.mode,
+                                 processes=self.app.config.get('IMPORT_PROCESSES'), on_error=job.on_error)
+        self.executor.submit(self._run, job, run)
+        return job
+
+    def save(self, job):
+        path = os.path.join(self.folder, f'{job.id}.json')
+        with self._lock:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(path + '.tmp', path)
+        job.saved_at = time.monotonic()
+        job.saved_rows = job.rows_written
+
+    def get(self, job_id):
+        """Return the state of a job as a dict, or None if it is unknown"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.folder, f'{job_id}.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _run(self, job, run):
+        job.status = 'running'
+        job.started_at = datetime.utcnow().isoformat()
+        self.save(job)
+        with self.app.app_context():
+            try:
+                job.result = run()
+                job.status = 'finished'
+            except Exception as e:
+                job.status = 'failed'
+                job.errors.append(str(e))
+                self.app.logger.error(traceback.format_exc())
+            if job.status == 'finished' and self.app.config.get('ANALYTICS_SNAPSHOT'):
+                # Export the new data for the dashboard before reporting the job done
+                try:
+                    from app.snapshot import refresh_snapshot
+                    refresh_snapshot()
+                except Exception:
+                    self.app.logger.error(traceback.format_exc())
+        try:
+            self.discard_uploads(job.id)
+        except OSError:
+            self.app.logger.error(traceback.format_exc())
+        job.finished_at = datetime.utcnow().isoformat()
+        self.save(job)
+
+
+class JobQueue:
+    """Flask extension running uploads on a worker pool per app"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['job_queue'] = AppJobQueue(app)
+
+    def _queue(self):
+        return current_app.extensions['job_queue']
+
+    def upload_path(self, job_id, filename):
+        return self._queue().upload_path(job_id, filename)
+
+    def report_path(self, job_id):
+        return self._queue().report_path(job_id)
+
+    def sweep(self, now=None):
+        return self._queue().sweep(now)
+
+    def new_job(self, filename, file_type, mode='merge', on_error='reject'):
+        return self._queue().new_job(filename, file_type, mode, on_error)
+
+    def submit(self, job, filepath):
+        return job.queue.submit(job, filepath)
+
+    def submit_batch(self, job, files):
+        return job.queue.submit_batch(job, files)
+
+    def get(self, job_id):
+        return self._queue().get(job_id)
@@ -0,0 +1,122 @@
+"""
+Process-wide caches of the small lookup tables.
+
+Imports resolve the career and course of every enrollment to an id. A
+database holds a few dozen careers and a few hundred courses, so each
+import works on ``IdentityMaps``, dicts of their ids by natural key, and
+resolving a row is a dict hit. The maps are also kept between imports:
+careers and courses only change through an import, ``clear_data`` or
+``fix_duplicates``, which all bump the data version (app/cache.py), so the
+cached maps are reused while the data version is still the one they were
+stored with. An import stores its maps, including the ids it created, under
+the version it committed; each import gets its own copy, so one that rolls
+back leaves the cache as it was. ``LOOKUP_CACHE=false`` loads the maps for
+every import.
+
+``load_user`` keeps the column values of the users of authenticated
+sessions for ``USER_CACHE_TTL`` seconds instead of querying ``User`` on
+every request, and builds a new ``User`` from them for each request, so no
+instance is shared between requests or threads. A process forgets a user as
+soon as it writes the row; users are not versioned, so a removed account or
+changed admin flag takes effect on other workers after at most that long.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+
+from app import db
+from app.cache import data_version
+from app.models import Career, Course, User
+
+USER_COLUMNS = [column.name for column in User.__table__.columns]
+
+# engine URL -> IdentityMaps of the last committed import
+_identity_maps = {}
+# (engine URL, user id) -> (expiry, tuple of the user's ``USER_COLUMNS``)
+_users = {}
+_lock = threading.Lock()
+
+
+class IdentityMaps:
+    """Career and course ids by natural key, as of data version ``version``"""
+
+    def __init__(self, careers, courses, version=None):
+        # (name, plan, version) -> id
+        self.careers = careers
+        # (name, career_id) -> id
+        self.courses = courses
+        self.version = version
+
+    def copy(self):
+        return IdentityMaps(dict(self.careers), dict(self.courses), self.version)
+
+
+def load_identity_maps():
+    """Read every career and course id from the database"""
+    careers = {(name, plan, version): id for id, name, plan, version
+               in db.session.query(Career.id, Career.name, Career.plan, Career.version)}
+    courses = {(name, career_id): id for id, name, career_id
+               in db.session.query(Course.id, Course.name, Course.career_id)}
+    return IdentityMaps(careers, courses)
+
+
+def identity_maps():
+    """Maps for an import: a copy of the cached ones while current, else loaded"""
+    if current_app.config['LOOKUP_CACHE']:
+        version = data_version()
+        with _lock:
+            cached = _identity_maps.get(str(db.engine.url))
+        if cached is not None and cached.version == version:
+            return cached.copy()
+    return load_identity_maps()
+
+
+def stamp_identity_maps(maps):
+    """Record the data version an import is about to commit, after bumping it"""
+    maps.version = data_version()
+
+
+def remember_identity_maps(maps):
+    """Cache the maps of a committed import for the next ones"""
+    if current_app.config['LOOKUP_CACHE'] and maps.version is not None:
+        with _lock:
+            _identity_maps[str(db.engine.url)] = maps
+
+
+def clear_lookups():
+    """Drop the cached maps and users of the current database"""
+    url = str(db.engine.url)
+    with _lock:
+        _identity_maps.pop(url, None)
+        for key in [key for key in _users if key[0] == url]:
+            del _users[key]
+
+
+def load_user(user_id):
+    """A new ``User`` with ``user_id``, from its values cached for ``USER_CACHE_TTL``"""
+    ttl = current_app.config['USER_CACHE_TTL']
+    key = (str(db.engine.url), user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(key)
+    if entry is None or entry[0] <= now:
+        row = db.session.query(*(User.__table__.c[name] for name in USER_COLUMNS)) \
+            .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        entry = (now + ttl, tuple(row))
+        if ttl > 0:
+            with _lock:
+                _users[key] = entry
+    return User(**dict(zip(USER_COLUMNS, entry[1])))
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_user(mapper, connection, user):
+    """Drop a user written by this process from the cache"""
+    with _lock:
+        _users.pop((str(connection.engine.url), user.id), None)
@@ -0,0 +1,186 @@
+"""
+Database repair jobs, run from /fix-duplicates or ``flask maintenance``.
+
+``fix_duplicates`` repairs the association tables with a handful of
+set-based statements per phase instead of a round trip per offending row:
+
+1. duplicate student/status, student/course and student/career rows
+   (possible in databases created without the composite primary keys) are
+   reduced to one row each;
+2. course enrollments outside the student's careers are dropped when the
+   student has a course of the same name in one of their careers, otherwise
+   the course's career is added to the student;
+3. courses without a career are deleted with their enrollments;
+4. student status masks that drifted from the student's statuses are
+   recomputed.
+
+The import digests of the enrollments deleted in 2 and 3 forget their
+course in the same transaction, so a later delta or replace import does not
+act on a link that is gone.
+
+A dry run performs the same statements and rolls them back, so the counts it
+reports are exactly what a real run would change.
+"""
+import time
+from functools import partial
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from app import db
+from app.cache import bump_data_version
+from app.import_options import WRITE_LOCK
+from app.status_masks import refresh_status_masks
+from app.summaries import maintain_summaries, mark_summaries_fresh, rebuild_summaries
+
+# Association tables and their key columns
+ASSOCIATIONS = [
+    ('student_status', 'student_id', 'status_id'),
+    ('student_course', 'student_id', 'course_id'),
+    ('student_career', 'student_id', 'career_id')
+]
+
+
+def _delete_duplicate_rows(table, first, second):
+    """Keep one row of each (first, second) pair of ``table``"""
+    if db.engine.dialect.name == 'postgresql':
+        sql = f"""
+            DELETE FROM {table} a USING {table} b
+            WHERE a.{first} = b.{first} AND a.{second} = b.{second} AND a.ctid > b.ctid
+        """
+    else:
+        sql = f"""
+            DELETE FROM {table}
+            WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {first}, {second})
+        """
+    return db.session.execute(text(sql)).rowcount
+
+
+def _temporary(name):
+    """``name`` qualified with the schema of temporary tables, so a permanent table of that name is never touched"""
+    return f"{'pg_temp' if db.engine.dialect.name == 'postgresql' else 'temp'}.{name}"
+
+
+def _forget_digest_courses(condition):
+    """Clear the course of the import digests matching ``condition`` on import_digest, as that enrollment is gone"""
+    db.session.execute(text(f"UPDATE import_digest SET course_id = NULL WHERE {condition}"))
+
+
+def _fix_misassigned_courses():
+    """Resolve enrollments in courses of careers the student is not in"""
+    db.session.execute(text(f"DROP TABLE IF EXISTS {_temporary('misassigned_course')}"))
+    # Decide every row against the careers as they were before the fix
+    db.session.execute(text("""
+        CREATE TEMPORARY TABLE misassigned_course AS
+        SELECT sc.student_id, sc.course_id, c.career_id,
+               CASE WHEN EXISTS (
+                   SELECT 1
+                   FROM course alt
+                   JOIN student_career own ON own.career_id = alt.career_id
+                   WHERE own.student_id = sc.student_id AND alt.name = c.name
+               ) THEN 1 ELSE 0 END AS has_alternate
+        FROM student_course sc
+        JOIN course c ON sc.course_id = c.id
+        JOIN career ca ON c.career_id = ca.id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM student_career sca
+            WHERE sca.student_id = sc.student_id AND sca.career_id = c.career_id
+        )
+    """))
+    _forget_digest_courses("""
+        EXISTS (
+            SELECT 1 FROM misassigned_course m
+            WHERE m.has_alternate = 1 AND m.student_id = import_digest.student_id
+              AND m.course_id = import_digest.course_id
+        )
+    """)
+    deleted = db.session.execute(text("""
+        DELETE FROM student_course
+        WHERE EXISTS (
+            SELECT 1 FROM misassigned_course m
+            WHERE m.has_alternate = 1 AND m.student_id = student_course.student_id
+              AND m.course_id = student_course.course_id
+        )
+    """)).rowcount
+    inserted = db.session.execute(text("""
+        INSERT INTO student_career (student_id, career_id)
+        SELECT DISTINCT student_id, career_id FROM misassigned_course WHERE has_alternate = 0
+    """)).rowcount
+    db.session.execute(text(f"DROP TABLE {_temporary('misassigned_course')}"))
+    return deleted + inserted
+
+
+def _delete_orphan_courses():
+    """Delete courses without a career, and their enrollments"""
+    _forget_digest_courses("course_id IN (SELECT id FROM course WHERE career_id IS NULL)")
+    enrollments = db.session.execute(text(
+        "DELETE FROM student_course WHERE course_id IN (SELECT id FROM course WHERE career_id IS NULL)"
+    )).rowcount
+    courses = db.session.execute(text("DELETE FROM course WHERE career_id IS NULL")).rowcount
+    return enrollments + courses
+
+
+def fix_duplicates(dry_run=False):
+    """
+    Repair the association tables. Returns a report with the rows changed and
+    the time taken by each phase; with ``dry_run`` nothing is committed.
+    """
+    phases = [(f'{table}_duplicates', partial(_delete_duplicate_rows, table, first, second))
+              for table, first, second in ASSOCIATIONS]
+    phases += [
+        ('misassigned_courses', _fix_misassigned_courses),
+        ('orphan_courses', _delete_orphan_courses),
+        ('status_masks', refresh_status_masks)
+    ]
+
+    report = {'dry_run': dry_run, 'phases': [], 'rows': 0}
+    with WRITE_LOCK:
+        try:
+            for name, phase in phases:
+                start = time.perf_counter()
+                rows = phase()
+                report['phases'].append({'name': name, 'rows': rows,
+                                         'seconds': round(time.perf_counter() - start, 3)})
+                report['rows'] += rows
+
+            if dry_run:
+                db.session.rollback()
+            elif report['rows'] and maintain_summaries():
+                # Associations changed all over the place: recount from scratch
+                start = time.perf_counter()
+                rebuild_summaries()
+                bump_data_version()
+                mark_summaries_fresh()
+                db.session.commit()
+                report['phases'].append({'name': 'summaries', 'rows': None,
+                                         'seconds': round(time.perf_counter() - start, 3)})
+            elif report['rows']:
+                bump_data_version()
+                db.session.commit()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    report['seconds'] = round(sum(phase['seconds'] for phase in report['phases']), 3)
+    return report
+
+
+maintenance_cli = AppGroup('maintenance', help='Repair the student database.')
+
+
+@maintenance_cli.command('fix-duplicates')
+@click.option('--dry-run', is_flag=True, help='Report what would change without changing anything.')
+def fix_duplicates_command(dry_run):
+    """Remove duplicate associations and fix courses outside the student's careers."""
+    report = fix_duplicates(dry_run=dry_run)
+    if not dry_run and current_app.config['ANALYTICS_SNAPSHOT']:
+        from app.snapshot import refresh_snapshot
+        refresh_snapshot()
+    for phase in report['phases']:
+        rows = '' if phase['rows'] is None else phase['rows']
+        click.echo(f"{phase['name']:<28} {rows:>8} {phase['seconds']:>9.3f}s")
+    verb = 'would change' if dry_run else 'changed'
+    click.echo(f"{report['rows']} rows {verb} in {report['seconds']:.3f}s")
@@ -0,0 +1,276 @@
+"""
+Schema migrations for existing databases.
+
+``db.create_all()`` creates missing tables but never alters existing ones,
+so changes to tables that already exist in deployed ``students.db`` files are
+applied here. Each migration runs once, in order, and the last applied one is
+recorded in the ``schema_version`` state. Migrations are idempotent so a
+database created from the current models, which already has their indexes,
+goes through them unchanged.
+
+``init_database`` creates the tables, applies the migrations and adds the
+default statuses, admin user and database id; ``flask schema init`` runs it.
+At startup ``create_app`` only checks, with two cheap queries, that every
+table exists and no migration is pending, and runs ``init_database`` under a
+file lock otherwise (``AUTO_INIT_DB``), so booting a worker against an
+initialized database does no schema work. ``flask schema upgrade`` applies pending
+migrations alone.
+"""
+import logging
+import os
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+
+from app import db
+from app.models import AppState
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 'schema_version'
+
+
+def _create_indexes(names):
+    """Create the indexes declared on the models with the given names"""
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=db.session.connection(), checkfirst=True)
+
+
+def _merge_duplicates(table, key_columns, references):
+    """
+    Merge rows of ``table`` sharing ``key_columns`` into the one with the
+    lowest id, repointing ``references``: (table, column, other key column)
+    of association tables, or (table, column, None) for plain foreign keys.
+    Returns the number of rows merged away.
+    """
+    merge_table = f'{table}_merge'
+    key_match = ' AND '.join(f'dup.{column} = keep.{column}' for column in key_columns)
+    db.session.execute(text(f"DROP TABLE IF EXISTS {merge_table}"))
+    db.session.execute(text(f"""
+        CREATE TEMPORARY TABLE {merge_table} AS
+        SELECT dup.id AS old_id, keep.keep_id AS keep_id
+        FROM {table} dup
+        JOIN (
+            SELECT {', '.join(key_columns)}, MIN(id) AS keep_id
+            FROM {table}
+            GROUP BY {', '.join(key_columns)}
+            HAVING COUNT(*) > 1
+        ) keep ON {key_match}
+        WHERE dup.id <> keep.keep_id
+    """))
+    merged = db.session.execute(text(f"SELECT COUNT(*) FROM {merge_table}")).scalar()
+    if merged:
+        for ref_table, column, other in references:
+            if other:
+                # Link the kept row unless the association already exists
+                db.session.execute(text(f"""
+                    INSERT INTO {ref_table} ({other}, {column})
+                    SELECT DISTINCT r.{other}, m.keep_id
+                    FROM {ref_table} r
+                    JOIN {merge_table} m ON m.old_id = r.{column}
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {ref_table} e WHERE e.{other} = r.{other} AND e.{column} = m.keep_id
+                    )
+                """))
+                db.session.execute(text(
+                    f"DELETE FROM {ref_table} WHERE {column} IN (SELECT old_id FROM {merge_table})"
+                ))
+            else:
+                db.session.execute(text(f"""
+                    UPDATE {ref_table}
+                    SET {column} = (SELECT keep_id FROM {merge_table} WHERE old_id = {ref_table}.{column})
+                    WHERE {column} IN (SELECT old_id FROM {merge_table})
+                """))
+        db.session.execute(text(f"DELETE FROM {table} WHERE id IN (SELECT old_id FROM {merge_table})"))
+    db.session.execute(text(f"DROP TABLE {merge_table}"))
+    return merged
+
+
+def add_indexes():
+    """Secondary indexes, and unique career/course identities after merging duplicates"""
+    careers = _merge_duplicates('career', ['name', 'plan', 'version'], [
+        ('student_career', 'career_id', 'student_id'),
+        ('course', 'career_id', None)
+    ])
+    # Merging careers can turn courses into duplicates, so courses go second
+    courses = _merge_duplicates('course', ['name', 'career_id'], [
+        ('student_course', 'course_id', 'student_id')
+    ])
+    if careers or courses:
+        from app.cache import bump_data_version
+        from app.summaries import mark_summaries_fresh, rebuild_summaries
+
+        logger.warning(f"Merged {careers} duplicate careers and {courses} duplicate courses")
+        rebuild_summaries()
+        bump_data_version()
+        mark_summaries_fresh()
+
+    _create_indexes([
+        'ux_career_name_plan_version',
+        'ux_course_name_career_id',
+        'ix_course_career_id',
+        'ix_student_documento',
+        'ix_student_sexo',
+        'ix_student_apellido_nombre',
+        'ix_student_career_career_id',
+        'ix_student_course_course_id',
+        'ix_student_status_status_id'
+    ])
+
+
+def add_search():
+    """Full-text student search table, for databases that predate it"""
+    from app.search import init_search
+    init_search()
+
+
+def add_status_masks():
+    """Student status bitmask, filled from student_status, replacing the overlap summary"""
+    from app.status_masks import refresh_status_masks
+
+    columns = {column['name'] for column in inspect(db.session.connection()).get_columns('student')}
+    if 'status_mask' not in columns:
+        db.session.execute(text("ALTER TABLE student ADD COLUMN status_mask INTEGER NOT NULL DEFAULT 0"))
+    _create_indexes(['ix_student_status_mask'])
+    refresh_status_masks()
+    db.session.execute(text("DROP TABLE IF EXISTS summary_overlap_count"))
+
+
+def add_digest_enrollments():
+    """Career and course of each import digest; NULL for digests written before"""
+    columns = {column['name'] for column in inspect(db.session.connection()).get_columns('import_digest')}
+    for name in ('career_id', 'course_id'):
+        if name not in columns:
+            db.session.execute(text(f"ALTER TABLE import_digest ADD COLUMN {name} INTEGER"))
+
+
+def add_summary_version():
+    """
+    Summary tables of databases upgraded with data in them, which
+    ``init_summaries`` leaves stale: imports only maintain fresh summaries
+    """
+    from app.models import Student
+    from app.summaries import mark_summaries_fresh, rebuild_summaries, summaries_fresh
+
+    if not summaries_fresh() and db.session.query(Student.id).first():
+        rebuild_summaries()
+        mark_summaries_fresh()
+
+
+# (version, description, migration), applied in order
+MIGRATIONS = [
+    (1, 'Secondary indexes and unique career/course identities', add_indexes),
+    (2, 'Student search table', add_search),
+    (3, 'Student status bitmask', add_status_masks),
+    (4, 'Enrollment of each import digest', add_digest_enrollments),
+    (5, 'Summary tables of upgraded databases', add_summary_version),
+]
+
+
+def schema_version():
+    value = db.session.query(AppState.value).filter_by(name=SCHEMA_VERSION).scalar()
+    return value or 0
+
+
+def run_migrations():
+    """Apply pending migrations, each in its own transaction; returns the versions applied"""
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= schema_version():
+            continue
+        logger.info(f"Applying schema migration {version}: {description}")
+        try:
+            migration()
+            state = db.session.get(AppState, SCHEMA_VERSION)
+            if state is None:
+                db.session.add(AppState(name=SCHEMA_VERSION, value=version))
+            else:
+                state.value = version
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def init_database():
+    """Create missing tables, apply pending migrations and add the default rows"""
+    from app.lookups import clear_lookups
+    from app.models import Status, User
+    from app.snapshot import init_database_id
+    from app.summaries import init_summaries
+
+    # A database recreated at the same URL starts its data versions over
+    clear_lookups()
+    db.create_all()
+    run_migrations()
+    Status.initialize_default_statuses()
+    User.initialize_default_admin()
+    init_summaries()
+    init_database_id()
+
+
+def database_ready():
+    """True when every model table exists and no migration is pending"""
+    tables = set(inspect(db.engine).get_table_names())
+    if not set(db.metadata.tables) <= tables:
+        return False
+    return schema_version() >= MIGRATIONS[-1][0]
+
+
+@contextmanager
+def _init_lock():
+    """Serialize init_database across the processes sharing the instance folder"""
+    try:
+        import fcntl
+    except ImportError:
+        # No flock on Windows, where a single process serves the app
+        fcntl = None
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    with open(os.path.join(current_app.instance_path, 'init.lock'), 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def ensure_database():
+    """Run init_database once if the database needs it; returns whether it ran"""
+    if database_ready():
+        return False
+    with _init_lock():
+        # Another worker may have initialized it while we waited
+        if database_ready():
+            return False
+        init_database()
+    return True
+
+
+schema_cli = AppGroup('schema', help='Manage the database schema.')
+
+
+@schema_cli.command('init')
+def init_command():
+    """Create the tables, apply migrations and add the default statuses and admin."""
+    init_database()
+    click.echo(f"Database initialized, schema version {schema_version()}")
+
+
+@schema_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending schema migrations."""
+    applied = run_migrations()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}")
+    click.echo(f"Schema version {schema_version()}")
+
+
+@schema_cli.command('version')
+def version_command():
+    """Show the schema version of the database."""
+    pending = [version for version, _, _ in MIGRATIONS if version > schema_version()]
+    click.echo(f"Schema version {schema_version()}, pending: {pending or 'none'}")
@@ -20,6 +20,11 @@ student_status = db.Table('student_status',
     db.Column('status_id', db.Integer, db.ForeignKey('status.id'), primary_key=True)
 )
 
+# Reverse lookups of the association tables (the primary keys lead with student_id)
+db.Index('ix_student_career_career_id', student_career.c.career_id, student_career.c.student_id)
+db.Index('ix_student_course_course_id', student_course.c.course_id, student_course.c.student_id)
+db.Index('ix_student_status_status_id', student_status.c.status_id, student_status.c.student_id)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -71,6 +76,16 @@ class Student(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     source_file = db.Column(db.String(100))
     
+    # Bits of the statuses held, kept in sync with student_status (app/status_masks.py)
+    status_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    __table_args__ = (
+        db.Index('ix_student_status_mask', 'status_mask'),
+        db.Index('ix_student_documento', 'documento'),
+        db.Index('ix_student_sexo', 'sexo'),
+        db.Index('ix_student_apellido_nombre', 'apellido', 'nombre'),
+    )
+    
     def __repr__(self):
         return f'<Student {self.legajo}: {self.apellido}, {self.nombre}>'
 
@@ -115,6 +130,11 @@ class Career(db.Model):
     plan = db.Column(db.String(20))
     version = db.Column(db.String(20))
     
+    # Identity of a career for the importer
+    __table_args__ = (
+        db.Index('ux_career_name_plan_version', 'name', 'plan', 'version', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Career {self.name} - Plan: {self.plan}>'
 
@@ -124,5 +144,55 @@ class Course(db.Model):
     career_id = db.Column(db.Integer, db.ForeignKey('career.id'))
     career = db.relationship('Career', backref=db.backref('courses', lazy=True))
     
+    # Identity of a course for the importer
+    __table_args__ = (
+        db.Index('ux_course_name_career_id', 'name', 'career_id', unique=True),
+        db.Index('ix_course_career_id', 'career_id'),
+    )
+    
+    def __repr__(self):
+        return f'<Course {self.name}>'
+
+class AppState(db.Model):
+    """Named counters shared by every worker process, e.g. the data version"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
     def __repr__(self):
-        return f'<Course {self.name}>'
\ No newline at end of file
+        return f'<AppState {self.name}={self.value}>'
+
+class ImportDigest(db.Model):
+    """Digest of the row a status file last wrote for a student (see delta imports)"""
+    status_id = db.Column(db.Integer, db.ForeignKey('status.id'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    digest = db.Column(db.String(32), nullable=False)
+    # The enrollment that row gave the student; plain ids, cleared by
+    # maintenance when it deletes the enrollment (app/maintenance.py)
+    career_id = db.Column(db.Integer)
+    course_id = db.Column(db.Integer)
+    
+    __table_args__ = (
+        db.Index('ix_import_digest_student_id', 'student_id'),
+    )
+
+# Summary tables maintained by the importer (see app/summaries.py). A career
+# of '*' holds the counts over all careers.
+class SummaryStatusCount(db.Model):
+    """Students per status, overall and per career name"""
+    status = db.Column(db.String(20), primary_key=True)
+    career = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class SummaryCourseCount(db.Model):
+    """Students per (status, course)"""
+    status = db.Column(db.String(20), primary_key=True)
+    course_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class SummaryGenderCount(db.Model):
+    """Students per (status group, sexo), overall and per career name"""
+    status_group = db.Column(db.String(20), primary_key=True)
+    sexo = db.Column(db.String(10), primary_key=True)
+    career = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
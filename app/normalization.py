@@ -0,0 +1,184 @@
+"""
+Column-wise normalization of SIU export rows.
+
+The original importer normalized each row in Python: ``str()`` of a dozen
+cells, the literal 'nan' blanked, ``pd.to_datetime`` on the birth date and a
+search of the row's labels for the 'Materia' column. This module does the
+same once per column of a chunk, on the rows that are kept: the last row of
+each legajo for student data and its first row for the enrollment.
+tests/test_normalization.py checks it against the per-row semantics, and
+``benchmarks/normalization.py`` measures both.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Header variants found in SIU exports, mapped to the name the importer uses
+HEADER_ALIASES = {
+    'Tipo documento': 'Tipo Documento',
+    'Domicilio Origen': 'Domicilio origen'
+}
+
+# Student columns read with row['...'] by the original importer
+REQUIRED_COLUMNS = ['Legajo', 'Nombre', 'Documento', 'Nacionalidad', 'Domicilio',
+                    'Telefono', 'Correo', 'Cuil', 'Sexo']
+
+STUDENT_FIELDS = ['legajo', 'nombre', 'apellido', 'tipo_documento', 'documento', 'nacionalidad',
+                  'fecha_nacimiento', 'domicilio', 'domicilio_origen', 'telefono', 'correo',
+                  'cuil', 'sexo', 'source_file']
+
+# Student fields taken verbatim (as text) from a column, optional ones may be absent
+TEXT_COLUMNS = [
+    ('nombre', 'Nombre', True), ('apellido', 'Apellido', False), ('tipo_documento', 'Tipo Documento', False),
+    ('documento', 'Documento', True), ('nacionalidad', 'Nacionalidad', True), ('domicilio', 'Domicilio', True),
+    ('domicilio_origen', 'Domicilio origen', False), ('telefono', 'Telefono', True), ('correo', 'Correo', True),
+    ('cuil', 'Cuil', True), ('sexo', 'Sexo', True)
+]
+
+
+def normalize_header(names):
+    """
+    Resolve header aliases and strip the 'Materia' column name.
+
+    When both a name and its alias are present the canonical column wins and
+    the alias column is dropped (renamed to None).
+    """
+    names = [str(name) if name is not None else f'Unnamed: {i}' for i, name in enumerate(names)]
+    present = set(names)
+    resolved = []
+    for name in names:
+        if name.strip() == 'Materia':
+            name = 'Materia'
+        elif name in HEADER_ALIASES:
+            name = None if HEADER_ALIASES[name] in present else HEADER_ALIASES[name]
+        resolved.append(name)
+    return resolved
+
+
+def column(df, name):
+    """A column of ``df``, or NaN when it is absent"""
+    return df[name] if name in df.columns else pd.Series(float('nan'), index=df.index)
+
+
+def present(series):
+    """Mask of cells that are neither NaN nor the text 'nan' in any casing"""
+    return series.notna() & (series.map(str).str.lower() != 'nan')
+
+
+def text(series):
+    """Column-wise equivalent of ``str(value)`` with the literal 'nan' blanked"""
+    values = series.map(str)
+    return values.mask(values == 'nan', '')
+
+
+def optional_text(df, name):
+    """Text of an optional column, or empty strings when it is absent"""
+    if name in df.columns:
+        return text(df[name])
+    return pd.Series('', index=df.index, dtype=object)
+
+
+def stripped(df, name):
+    """``str(value).strip()`` of a column with any casing of 'nan' blanked"""
+    if name not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    values = df[name].map(str).str.strip()
+    return values.mask(values.str.lower() == 'nan', '')
+
+
+def parse_birth_dates(series):
+    """Parse birth dates in one pass; those that fail or fall outside 1900..now are NaT"""
+    parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+    years = parsed.dt.year
+    return parsed.where((years >= 1900) & (years <= datetime.now().year))
+
+
+def birth_dates(df):
+    """'Fecha Nacimiento' as datetimes, None where missing or invalid"""
+    # Built from object arrays: a Series(None) column would turn into NaN
+    if 'Fecha Nacimiento' not in df.columns:
+        return pd.Series(np.full(len(df), None, dtype=object), index=df.index, dtype=object)
+    parsed = parse_birth_dates(df['Fecha Nacimiento'])
+    values = np.where(parsed.notna().to_numpy(), parsed.array.to_pydatetime(), None)
+    return pd.Series(values, index=df.index, dtype=object)
+
+
+def _row_error(df, position, message, with_data=False):
+    """Build the exception the per-row importer raised for a failing row"""
+    row = df.iloc[position]
+    legajo = row.get('Legajo', 'Unknown')
+    if with_data:
+        return Exception(f"Error processing student {legajo}: {message}\nData: {row.to_dict()}")
+    return Exception(f"Error processing student {legajo}: {message}")
+
+
+def normalize_frame(df, source_file, seen_legajos=None):
+    """
+    Normalize a chunk of an export into the columns written by the importer.
+
+    Returns the students (``STUDENT_FIELDS``, the last row of each legajo)
+    and the enrollments (legajo, career_name, plan, version, course_name,
+    the first row of each legajo not in ``seen_legajos``). ``seen_legajos``
+    holds the legajos of earlier chunks of the same file and is updated in
+    place. Raises the same errors, for the same first failing row, as the
+    original row-by-row importer.
+    """
+    if seen_legajos is None:
+        seen_legajos = set()
+
+    legajo = column(df, 'Legajo')
+    missing_required = (legajo.isna() | column(df, 'Nombre').isna()).to_numpy()
+
+    if missing_required.any():
+        first_missing = int(missing_required.argmax())
+    else:
+        first_missing = len(df)
+
+    missing_columns = [name for name in REQUIRED_COLUMNS if name not in df.columns]
+    if missing_columns and len(df):
+        if first_missing == 0:
+            raise _row_error(df, 0, "Missing required student data (Legajo or Nombre) for row")
+        raise _row_error(df, 0, str(KeyError(missing_columns[0])), with_data=True)
+
+    legajos = legajo.map(str)
+
+    # Only the first row of each student in the file carries its career and
+    # course, later rows just refresh the student's personal data
+    first_rows = ~legajos.duplicated(keep='first') & ~legajos.isin(seen_legajos)
+    career_missing = (first_rows & ~present(column(df, 'Carrera'))).to_numpy()
+    if career_missing.any():
+        first_bad_career = int(career_missing.argmax())
+    else:
+        first_bad_career = len(df)
+
+    if first_missing < len(df) and first_missing <= first_bad_career:
+        raise _row_error(df, first_missing, "Missing required student data (Legajo or Nombre) for row")
+    if first_bad_career < len(df):
+        bad_legajo = df.iloc[first_bad_career]['Legajo']
+        raise _row_error(df, first_bad_career, f"Missing or invalid career name for student {bad_legajo}")
+
+    # A legajo appearing several times keeps the data of its last row
+    last_rows = ~legajos.duplicated(keep='last')
+    last = df[last_rows]
+    students = pd.DataFrame({'legajo': legajos[last_rows]}, index=last.index)
+    for field, name, required in TEXT_COLUMNS:
+        students[field] = text(last[name]) if required else optional_text(last, name)
+    students['fecha_nacimiento'] = birth_dates(last)
+    students['source_file'] = source_file
+    students = students[STUDENT_FIELDS]
+
+    first = df[first_rows]
+    enrollments = pd.DataFrame({
+        'legajo': legajos[first_rows],
+        'career_name': stripped(first, 'Carrera'),
+        'plan': stripped(first, 'Plan'),
+        'version': stripped(first, 'Version'),
+    }, index=first.index)
+    if 'Materia' in first.columns:
+        enrollments['course_name'] = first['Materia'].map(str).str.strip().where(present(first['Materia']))
+    else:
+        enrollments['course_name'] = None
+    seen_legajos.update(enrollments['legajo'])
+
+    return students, enrollments
@@ -0,0 +1,181 @@
+"""
+Check that the queries issued by the web routes are index-backed.
+
+``flask schema check-plans`` copies the SQLite database to a scratch file
+with SQLite's backup API, requests every page and API endpoint of ``main``
+and ``api`` against the copy (including the mutating POST routes) while
+recording the SELECT statements they run, and reports each statement whose
+``EXPLAIN QUERY PLAN`` scans a table without an index (see ``full_scans``).
+"""
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from app import db
+
+# Tables small enough that a full scan is the right plan
+SMALL_TABLES = {'status', 'app_state', 'user', 'summary_status_count', 'summary_course_count',
+                'summary_gender_count'}
+
+# Statements that read a whole table on purpose, and that table: the
+# snapshot export (app/snapshot.py) reads every student and enrollment
+DELIBERATE_SCANS = {
+    ('SELECT id, status_mask, sexo FROM student ORDER BY id', 'student'),
+    ('SELECT student_id, course_id FROM student_course', 'student_course'),
+}
+
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+SQL_KEYWORDS = {'on', 'join', 'where', 'group', 'order', 'left', 'inner', 'cross', 'limit', 'union', 'using'}
+
+# Requests exercising the routes, in order; the POSTs run last as they change data
+REQUESTS = [
+    ('GET', '/', {}),
+    ('GET', '/dashboard', {}),
+    ('GET', '/students', {}),
+    ('GET', '/upload', {}),
+    ('GET', '/api/student-stats', {}),
+    ('GET', '/api/student-stats', {'career': '{career}'}),
+    ('GET', '/api/student-stats/cube', {}),
+    ('GET', '/api/student-stats/courses', {'status': 're-enrolled'}),
+    ('GET', '/api/status-overlap', {}),
+    ('GET', '/api/students', {}),
+    ('GET', '/api/students', {'sort': 'apellido', 'order': 'desc'}),
+    ('GET', '/api/students', {'sort': 'documento'}),
+    ('GET', '/api/students', {'q': 'abc'}),
+    ('GET', '/api/students', {'q': 'ab'}),
+    ('GET', '/api/students', {'status': 'active', 'career': '{career}'}),
+    ('GET', '/api/cache-stats', {}),
+    ('GET', '/api/jobs/unknown', {}),
+    ('POST', '/fix-duplicates', {}),
+    ('POST', '/clear-data', {}),
+]
+
+
+def _tables_by_alias(sql):
+    """Map the names used in ``sql`` (aliases or table names) to table names"""
+    tables = set(db.metadata.tables)
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        if table in tables:
+            aliases[table] = table
+            if alias and alias.lower() not in SQL_KEYWORDS:
+                aliases[alias] = table
+    return aliases
+
+
+def full_scans(sql, params):
+    """
+    Table scans without an index in the plan of ``sql``, wherever they are in
+    the plan: ``SMALL_TABLES`` and ``DELIBERATE_SCANS`` excepted, an
+    unindexed scan means an index is missing or not used.
+    """
+    aliases = _tables_by_alias(sql)
+    statement = ' '.join(sql.split())
+    scans = []
+    # Statements were recorded with DB-API parameters, so bypass SQLAlchemy's binding
+    for _, _, _, detail in db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params or ()):
+        match = re.match(r'SCAN (\w+)', detail)
+        if not match or 'INDEX' in detail:
+            continue
+        table = aliases.get(match.group(1))
+        if table and table not in SMALL_TABLES and (statement, table) not in DELIBERATE_SCANS:
+            scans.append(detail)
+    return scans
+
+
+def copy_database(database_path, copy):
+    """
+    Copy a SQLite database with the backup API, which includes the pages
+    still in its write-ahead log and does not block its writers
+    """
+    source = sqlite3.connect(database_path)
+    try:
+        target = sqlite3.connect(copy)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def _record_statements(engine, statements):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and not executemany:
+            statements.append((statement, parameters))
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def check_route_plans(database_path):
+    """
+    Run ``REQUESTS`` against a copy of ``database_path`` and return
+    (statement, scans) for every recorded statement with a full scan.
+    """
+    from app import create_app
+    from app.models import Career, User
+
+    workdir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(workdir, 'plans.db')
+        copy_database(database_path, copy)
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{copy}',
+            'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+            'RESULT_CACHE_BACKEND': 'null',
+            # The copy has the database's id: its snapshots must not replace the live ones
+            'SNAPSHOT_DIR': os.path.join(workdir, 'snapshot')
+        })
+        with app.app_context():
+            career = db.session.query(Career.name).order_by(Career.id).limit(1).scalar() or ''
+            admin = User.query.filter_by(is_admin=True).first()
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        statements = []
+        with app.app_context():
+            stop = _record_statements(db.engine, statements)
+            try:
+                for method, path, args in REQUESTS:
+                    args = {name: value.format(career=career) for name, value in args.items()}
+                    client.open(path, method=method, query_string=args)
+            finally:
+                stop()
+
+            problems = []
+            seen = set()
+            for statement, params in statements:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                scans = full_scans(statement, params)
+                if scans:
+                    problems.append((statement, scans))
+        return problems
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@click.command('check-plans')
+@with_appcontext
+def check_plans_command():
+    """Verify with EXPLAIN QUERY PLAN that route queries use indexes."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("The query plan check only supports SQLite databases")
+    problems = check_route_plans(db.engine.url.database)
+    for statement, scans in problems:
+        click.echo(' '.join(statement.split()), err=True)
+        for scan in scans:
+            click.echo(f"    {scan}", err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo("All route queries are index-backed")
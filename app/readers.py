@@ -0,0 +1,221 @@
+"""
+Streaming readers for student exports.
+
+``iter_chunks`` yields the rows of an export as DataFrames of at most
+``CHUNK_SIZE`` rows, so the importer's memory use does not grow with the size
+of the file. Excel workbooks are read with openpyxl's read-only mode, CSV
+files with pandas' chunked reader and XLSB workbooks with pyxlsb when it is
+installed.
+
+pandas infers the type of a column from all of its cells: a column of
+numbers, or of text that parses as numbers, is converted to numbers, and
+floats if a cell is missing or fractional. So '007' reads as 7 and the
+numbers of a numeric column with blanks read '1.0' once converted to text.
+Workbooks are therefore scanned once with openpyxl's rows for such columns
+before their rows are handed out, so chunks convert the same way as a
+whole-file read.
+"""
+import os
+
+import pandas as pd
+
+from app.normalization import normalize_header
+
+# Rows per chunk handed to the importer
+CHUNK_SIZE = 5000
+
+# Cell texts pandas reads as missing values by default
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+
+def _cell(value):
+    """Convert a raw cell value the way pandas' openpyxl reader does"""
+    if value is None:
+        return float('nan')
+    if isinstance(value, str):
+        return float('nan') if value in NA_STRINGS else value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _blank(row):
+    return all(value is None or value == '' for value in row)
+
+
+def _numeric_columns(header, rows, block_size=CHUNK_SIZE):
+    """
+    {position: dtype} of the columns pandas converts to numbers: only numbers
+    or text that parses as one, with some text or else a missing value or a
+    fractional number in the file. They read as float64 if any cell is
+    missing or not a whole number, else as int64.
+    """
+    width = len(header)
+    numeric = [True] * width
+    floats = [False] * width
+    strings = [False] * width
+
+    def check(block):
+        for i in range(width):
+            if not numeric[i]:
+                continue
+            values = [_cell(row[i]) for row in block]
+            texts = []
+            for value in values:
+                if isinstance(value, str):
+                    texts.append(value)
+                elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                    numeric[i] = False
+                    break
+                elif isinstance(value, float):
+                    # Missing or fractional
+                    floats[i] = True
+            if texts and numeric[i]:
+                strings[i] = True
+                parsed = pd.to_numeric(pd.Series(texts, dtype=object), errors='coerce')
+                if parsed.isna().any():
+                    numeric[i] = False
+                elif parsed.dtype.kind == 'f':
+                    floats[i] = True
+
+    block = []
+    pending_blank = False
+    for row in rows:
+        row = list(row[:width]) + [None] * (width - len(row))
+        if _blank(row):
+            pending_blank = True
+            continue
+        if pending_blank:
+            # A blank row followed by data is a missing value in every column
+            floats = [True] * width
+            pending_blank = False
+        block.append(row)
+        if len(block) >= block_size:
+            check(block)
+            block = []
+    check(block)
+    return {i: 'float64' if floats[i] else 'int64' for i in range(width)
+            if numeric[i] and (floats[i] or strings[i])}
+
+
+def _frames(header, rows, chunk_size, numeric_columns=None):
+    """
+    Group raw rows into DataFrames, dropping trailing blank rows and
+    converting ``numeric_columns`` ({position: dtype})
+    """
+    columns = normalize_header(header)
+    keep = [i for i, name in enumerate(columns) if name is not None]
+    names = [columns[i] for i in keep]
+    dtypes = {columns[i]: dtype for i, dtype in (numeric_columns or {}).items() if columns[i] is not None}
+    width = len(columns)
+
+    chunk = []
+    start = 0
+    # Blank rows only count when data follows them, as with pandas
+    pending_blank = 0
+    for row in rows:
+        row = list(row[:width]) + [None] * (width - len(row))
+        if _blank(row):
+            pending_blank += 1
+            continue
+        for _ in range(pending_blank):
+            chunk.append([None] * width)
+            if len(chunk) >= chunk_size:
+                yield _frame(chunk, keep, names, start, dtypes)
+                start += len(chunk)
+                chunk = []
+        pending_blank = 0
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _frame(chunk, keep, names, start, dtypes)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield _frame(chunk, keep, names, start, dtypes)
+
+
+def _frame(rows, keep, names, start, dtypes):
+    data = [[_cell(row[i]) for i in keep] for row in rows]
+    frame = pd.DataFrame(data, columns=names, index=range(start, start + len(rows)), dtype=object)
+    for name, dtype in dtypes.items():
+        numbers = pd.to_numeric(frame[name])
+        # Python numbers, as in a whole-file read converted to text: 1.0 stays '1.0'
+        frame[name] = (numbers.astype(dtype) if dtype == 'float64' else numbers).astype(object)
+    return frame
+
+
+def _iter_xlsx(filepath, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        numeric_columns = _numeric_columns(header, workbook.active.iter_rows(min_row=2, max_col=len(header),
+                                                                             values_only=True))
+        yield from _frames(header, rows, chunk_size, numeric_columns)
+    finally:
+        workbook.close()
+
+
+def _iter_xlsb(filepath, chunk_size):
+    try:
+        from pyxlsb import open_workbook, convert_date
+    except ImportError:
+        raise ValueError("Reading .xlsb files requires the pyxlsb package")
+
+    with open_workbook(filepath) as workbook:
+        with workbook.get_sheet(1) as sheet:
+            rows = ([cell.v for cell in row] for row in sheet.rows())
+            header = next(rows, None)
+            if header is None:
+                return
+            numeric_columns = _numeric_columns(header, rows)
+        with workbook.get_sheet(1) as sheet:
+            rows = ([cell.v for cell in row] for row in sheet.rows())
+            next(rows)
+            for frame in _frames(header, rows, chunk_size, numeric_columns):
+                # XLSB stores dates as serial numbers without a date type
+                if 'Fecha Nacimiento' in frame.columns:
+                    frame['Fecha Nacimiento'] = frame['Fecha Nacimiento'].map(
+                        lambda value: convert_date(value) if isinstance(value, (int, float)) and value == value else value
+                    )
+                yield frame
+
+
+def _iter_csv(filepath, chunk_size):
+    reader = pd.read_csv(filepath, dtype=object, chunksize=chunk_size, sep=None, engine='python',
+                         encoding='utf-8-sig', encoding_errors='replace')
+    for frame in reader:
+        frame.columns = normalize_header(frame.columns)
+        yield frame.loc[:, [name is not None for name in frame.columns]]
+
+
+def _iter_xls(filepath, chunk_size):
+    # Legacy .xls workbooks have no streaming reader: load and slice them
+    df = pd.read_excel(filepath, header=0)
+    columns = normalize_header(df.columns)
+    df.columns = columns
+    df = df.loc[:, [name is not None for name in columns]]
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def iter_chunks(filepath, chunk_size=None):
+    """Yield the rows of an export as DataFrames of at most ``chunk_size`` rows"""
+    chunk_size = chunk_size or CHUNK_SIZE
+    extension = os.path.splitext(filepath)[1].lower().lstrip('.')
+    if extension in ('xlsx', 'xlsm'):
+        return _iter_xlsx(filepath, chunk_size)
+    if extension == 'xlsb':
+        return _iter_xlsb(filepath, chunk_size)
+    if extension == 'csv':
+        return _iter_csv(filepath, chunk_size)
+    if extension == 'xls':
+        return _iter_xls(filepath, chunk_size)
+    raise ValueError(f"Unsupported file type: .{extension}")
@@ -1,7 +1,11 @@
-from flask import Blueprint, jsonify, request
-from app.models import Student, Status, Career, Course, student_career, student_course, student_status
-from sqlalchemy import func, and_, or_, text, distinct
-from app import db
+from flask import Blueprint, Response, abort, jsonify, request, send_file
+from flask_login import login_required
+from app.search import DEFAULT_PAGE_SIZE, list_students, student_to_dict
+from app.stats import selected_careers
+from app.stats_payload import DEFAULT_COURSE_PAGE_SIZE, course_page, parse_shape, shape_stats
+from app.downloads import STATS_COLUMNS, STUDENT_COLUMNS, download_response, stats_rows, student_batches
+from app import instrumentation, job_queue, result_cache
+from app.http_cache import versioned
 import logging
 import sys
 
@@ -13,193 +17,166 @@ logger = logging.getLogger('api')
 api_bp = Blueprint('api', __name__)
 
 @api_bp.route('/api/student-stats')
+@versioned
 def student_stats():
     """
-    API endpoint to provide student statistics for the dashboard
+    API endpoint to provide student statistics for the dashboard; fields=,
+    top= and encoding=compact shape the payload (app/stats_payload.py)
     """
-    selected_career = request.args.get('career')
-    logger.info(f"API called with career filter: {selected_career}")
-    
-    # Get all careers for the filter dropdown
-    careers = db.session.query(Career.name).distinct().all()
-    all_careers = [career[0] for career in careers]
-    
-    # Status distribution with career filter and distinct student ids
-    def get_student_count(status_name):
-        query = db.session.query(Student.id).distinct()\
-            .join(student_status)\
-            .join(Status)\
-            .filter(Status.name == status_name)
-        
-        if selected_career:
-            query = query.join(student_career)\
-                .join(Career)\
-                .filter(Career.name == selected_career)
-        
-        return query.count()
-    
-    status_counts = {
-        'enrollment': {
-            'active': get_student_count('active'),
-            'inactive': get_student_count('inactive')
-        },
-        'registration': {
-            're-enrolled': get_student_count('re-enrolled'),
-            'incoming': get_student_count('incoming')
-        }
-    }
-    
-    # Log some basic database stats with career filter
-    base_query = db.session.query(Student.id).distinct()
-    course_query = db.session.query(Course.id).distinct()
-    
-    if selected_career:
-        base_query = base_query.join(student_career)\
-            .join(Career)\
-            .filter(Career.name == selected_career)
-        course_query = course_query.join(Career)\
-            .filter(Career.name == selected_career)
-    
-    total_students = base_query.count()
-    total_courses = course_query.count()
-    course_names = [c[0] for c in course_query.with_entities(Course.name).limit(5).all()]
-    
-    logger.info(f"Database stats: {total_students} students, {total_courses} courses")
-    logger.info(f"Sample courses: {course_names}")
-    
-    # Course distribution for re-enrolled and incoming students
-    course_distribution = {
-        're-enrolled': {},
-        'incoming': {}
-    }
-    
-    # Modified method to get course distribution with DISTINCT student count
-    for status_name in ['re-enrolled', 'incoming']:
-        try:
-            # Build query with career info always included and ensuring distinct student counting
-            sql = """
-            SELECT c.id, c.name, ca.name as career_name, COUNT(DISTINCT s.id) as student_count
-            FROM course c
-            JOIN career ca ON c.career_id = ca.id
-            JOIN student_course sc ON c.id = sc.course_id
-            JOIN student s ON sc.student_id = s.id
-            JOIN student_status ss ON s.id = ss.student_id
-            JOIN status st ON ss.status_id = st.id
-            WHERE st.name = :status_name
-            """
-            
-            params = {'status_name': status_name}
-            
-            if selected_career:
-                sql += " AND ca.name = :career_name"
-                params['career_name'] = selected_career
-            
-            sql += """
-            GROUP BY c.id, c.name, ca.name
-            HAVING COUNT(DISTINCT s.id) > 0
-            ORDER BY ca.name, c.name
-            """
-            
-            results = db.session.execute(text(sql), params).fetchall()
-            
-            logger.info(f"SQL query for {status_name} returned {len(results)} courses")
-            
-            # Process results - include career name in the course key
-            for row in results:
-                course_id, course_name, career_name, student_count = row
-                # Create a unique key that includes both course name and career
-                course_key = f"{course_name} [{career_name}]"
-                course_distribution[status_name][course_key] = student_count
-                logger.info(f"Course: {course_name} in career {career_name} (ID: {course_id}) has {student_count} {status_name} students")
-            
-            logger.info(f"Added {len(course_distribution[status_name])} courses to {status_name} distribution")
-            
-        except Exception as e:
-            logger.error(f"Error in course distribution query for {status_name}: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-    
-    # Career distribution for re-enrolled and incoming students (fixed to count distinct students only)
-    career_distribution = {
-        're-enrolled': {},
-        'incoming': {}
-    }
-    
-    # For each status type with fixed distinct student counting
-    for status_name in ['re-enrolled', 'incoming']:
-        try:
-            # Direct SQL approach for more control over the query and distinct counting
-            sql = """
-            SELECT c.name as career_name, COUNT(DISTINCT s.id) as student_count
-            FROM career c
-            JOIN student_career sc ON c.id = sc.career_id
-            JOIN student s ON sc.student_id = s.id
-            JOIN student_status ss ON s.id = ss.student_id
-            JOIN status st ON ss.status_id = st.id
-            WHERE st.name = :status_name
-            """
-            
-            params = {'status_name': status_name}
-            
-            if selected_career:
-                sql += " AND c.name = :career_name"
-                params['career_name'] = selected_career
-            
-            sql += """
-            GROUP BY c.name
-            HAVING COUNT(DISTINCT s.id) > 0
-            ORDER BY c.name
-            """
-            
-            results = db.session.execute(text(sql), params).fetchall()
-            
-            # Process results
-            for row in results:
-                career_name, student_count = row
-                career_distribution[status_name][career_name] = student_count
-                logger.info(f"Career: {career_name} has {student_count} {status_name} students")
-            
-            logger.info(f"Fixed query: Added {len(career_distribution[status_name])} careers to {status_name} distribution")
-            
-        except Exception as e:
-            logger.error(f"Error in career distribution query for {status_name}: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-    
-    # Gender distribution split by status groups with career filter
-    def get_gender_distribution(status_names):
-        gender_query = db.session.query(
-            Student.sexo,
-            func.count(distinct(Student.id)).label('student_count')
-        ).join(student_status)\
-        .join(Status)\
-        .filter(Student.sexo != '')\
-        .filter(Status.name.in_(status_names))
-        
-        if selected_career:
-            gender_query = gender_query.join(student_career)\
-                .join(Career)\
-                .filter(Career.name == selected_career)
-        
-        gender_results = gender_query.group_by(Student.sexo).all()
-        return {
-            gender: count for gender, count in gender_results if gender
-        }
-    
-    gender_distribution = {
-        'enrollment': get_gender_distribution(['active', 'inactive']),
-        'registration': get_gender_distribution(['re-enrolled', 'incoming'])
-    }
-    
-    result = {
-        'status_counts': status_counts,
-        'course_distribution': course_distribution,
-        'career_distribution': career_distribution,
-        'gender_distribution': gender_distribution,
-        'careers': all_careers
-    }
-    
-    # Log the final result for course distribution
-    logger.info(f"Final course distribution: {course_distribution}")
-    
-    return jsonify(result)
\ No newline at end of file
+    # Several careers (career=a&career=b) select the students of any of them
+    careers = selected_careers(request.args.getlist('career'))
+    logger.debug("API called with career filter: %s", careers)
+    try:
+        shape = parse_shape(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    from app.snapshot import snapshot_student_stats
+    stats = result_cache.cached('student-stats', careers, lambda: snapshot_student_stats(careers))
+    if logger.isEnabledFor(logging.DEBUG):
+        for status_name, courses in stats['course_distribution'].items():
+            logger.debug("%d courses and %d careers in the %s distribution", len(courses),
+                         len(stats['career_distribution'][status_name]), status_name)
+    return jsonify(shape_stats(stats, **shape))
+
+@api_bp.route('/api/student-stats/courses')
+@versioned
+def student_stats_courses():
+    """
+    One page of the course distribution of a status, most students first,
+    for drilling down past the top courses
+    """
+    careers = selected_careers(request.args.getlist('career'))
+    status = request.args.get('status', '')
+    from app.snapshot import snapshot_student_stats
+    stats = result_cache.cached('student-stats', careers, lambda: snapshot_student_stats(careers))
+    try:
+        page, next_cursor, total = course_page(
+            stats, status,
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', DEFAULT_COURSE_PAGE_SIZE, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'status': status,
+        'courses': [{'course': key, 'students': count} for key, count in page],
+        'total': total,
+        'next_cursor': next_cursor
+    })
+
+@api_bp.route('/api/student-stats/cube')
+@versioned
+def student_stats_cube():
+    """
+    The statistics of every career selection in one payload, which the
+    dashboard slices client-side as app.snapshot.slice_stats_cube does
+    """
+    from app.snapshot import SNAPSHOT_FORMAT, stats_cube
+    # Cubes cached by a previous release may have another layout
+    return jsonify(result_cache.cached('stats-cube', SNAPSHOT_FORMAT, stats_cube))
+
+@api_bp.route('/api/status-overlap')
+@versioned
+def status_overlap_counts():
+    """
+    Students per status and per combination of statuses (the status matrix)
+    """
+    # numpy loads with the snapshot on first use, not at startup
+    from app.snapshot import snapshot_status_overlap
+    return jsonify(result_cache.cached('status-overlap', None, snapshot_status_overlap))
+
+@api_bp.route('/api/students')
+@login_required
+def students():
+    """
+    API endpoint listing students one page at a time, with search and filters
+    """
+    try:
+        page, next_cursor = list_students(
+            search=request.args.get('q', '').strip() or None,
+            status=request.args.get('status') or None,
+            career=request.args.get('career') or None,
+            sort=request.args.get('sort', 'legajo'),
+            order=request.args.get('order', 'asc'),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'students': [student_to_dict(student) for student in page],
+        'next_cursor': next_cursor
+    })
+
+@api_bp.route('/api/export/students.<fmt>')
+@login_required
+def export_students(fmt):
+    """
+    Download the students matching the /api/students filters, with their
+    statuses, careers and courses, as CSV, XLSX or Parquet
+    """
+    batches = student_batches(
+        search=request.args.get('q', '').strip() or None,
+        status=request.args.get('status') or None,
+        career=request.args.get('career') or None
+    )
+    try:
+        return download_response('students', STUDENT_COLUMNS, batches, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@api_bp.route('/api/export/student-stats.<fmt>')
+@login_required
+def export_student_stats(fmt):
+    """
+    Download the dashboard statistics, one row per count, as CSV, XLSX or Parquet
+    """
+    careers = selected_careers(request.args.getlist('career'))
+    from app.snapshot import snapshot_student_stats
+    stats = result_cache.cached('student-stats', careers, lambda: snapshot_student_stats(careers))
+    rows = stats_rows(stats, status=request.args.get('status') or None)
+    try:
+        return download_response('student-stats', STATS_COLUMNS, [rows], fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@api_bp.route('/api/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """
+    API endpoint reporting the progress of a background upload
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@api_bp.route('/api/jobs/<job_id>/report')
+@login_required
+def job_report(job_id):
+    """
+    Download the validation report (CSV, one row per issue) of an upload
+    """
+    job = job_queue.get(job_id)
+    if job is None or not job.get('report'):
+        abort(404)
+    return send_file(job_queue.report_path(job_id), mimetype='text/csv', as_attachment=True,
+                     download_name=f'validation-report-{job_id}.csv')
+
+@api_bp.route('/api/cache-stats')
+@login_required
+def cache_stats():
+    """
+    API endpoint reporting hit/miss counters of the dashboard result cache
+    """
+    return jsonify(result_cache.stats())
+
+@api_bp.route('/api/metrics')
+def metrics():
+    """
+    Request and SQL metrics in the Prometheus text format, when instrumentation is enabled
+    """
+    if not instrumentation.enabled:
+        abort(404)
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,196 @@
+"""
+Student listing for /api/students: filters, keyset pagination and search.
+
+Pages are addressed by an opaque cursor holding the sort key of the last
+student returned, so fetching page N costs the same as page 1. Search terms
+of three or more characters are matched as substrings of legajo, apellido,
+nombre and documento through the ``student_search`` SQLite FTS5 trigram table
+when the SQLite build provides it; shorter terms, and databases without FTS5,
+use LIKE.
+
+The importer refreshes the search rows of the students it writes
+(``refresh_search``); ``init_search`` creates and fills the table for
+databases that predate it.
+"""
+import base64
+import json
+import logging
+
+from sqlalchemy import bindparam, or_, text, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.bulk import batched
+from app.models import Student, Status, Career, student_status, student_career
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'student_search'
+SEARCH_COLUMNS = ['legajo', 'apellido', 'nombre', 'documento']
+
+# Shortest term the trigram tokenizer can match
+MIN_TRIGRAM_LENGTH = 3
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Sort orders offered by the API; the student id breaks ties so the keyset is
+# unique. Text columns are written as '' rather than NULL by the importer.
+SORT_COLUMNS = {
+    'legajo': [Student.legajo],
+    'apellido': [Student.apellido, Student.nombre],
+    'documento': [Student.documento]
+}
+
+# Whether the search table exists, per database URL
+_search_enabled = {}
+
+
+def search_enabled():
+    """True when the FTS5 search table is available in the current database"""
+    url = str(db.engine.url)
+    if url not in _search_enabled:
+        enabled = False
+        if db.engine.dialect.name == 'sqlite':
+            enabled = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}
+            ).first() is not None
+        _search_enabled[url] = enabled
+    return _search_enabled[url]
+
+
+def init_search():
+    """Create and fill the search table if the database supports it and lacks it"""
+    _search_enabled.pop(str(db.engine.url), None)
+    if db.engine.dialect.name != 'sqlite' or search_enabled():
+        return
+    try:
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='trigram')"
+        ))
+    except OperationalError:
+        db.session.rollback()
+        logger.info("SQLite lacks FTS5 trigram support, student search will use LIKE")
+        return
+    db.session.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+        f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM student"
+    ))
+    db.session.commit()
+    _search_enabled[str(db.engine.url)] = True
+
+
+def refresh_search(student_ids):
+    """Reindex the given students after their rows were written"""
+    if not search_enabled():
+        return
+    delete = text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True))
+    insert = text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+        f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM student WHERE id IN :ids"
+    ).bindparams(bindparam('ids', expanding=True))
+    for chunk in batched(sorted(set(student_ids))):
+        db.session.execute(delete, {'ids': chunk})
+        db.session.execute(insert, {'ids': chunk})
+
+
+def clear_search():
+    if search_enabled():
+        db.session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Sort key encoded by ``encode_cursor``; raises ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _search_filter(search):
+    """Conditions matching every term of ``search`` against the search columns"""
+    conditions = []
+    fts_terms = []
+    for term in search.split():
+        if search_enabled() and len(term) >= MIN_TRIGRAM_LENGTH:
+            fts_terms.append('"' + term.replace('"', '""') + '"')
+        else:
+            conditions.append(or_(*[getattr(Student, name).icontains(term, autoescape=True)
+                                    for name in SEARCH_COLUMNS]))
+    if fts_terms:
+        matches = text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :search_query") \
+            .bindparams(search_query=' AND '.join(fts_terms)) \
+            .columns(db.column('rowid'))
+        conditions.append(Student.id.in_(matches))
+    return conditions
+
+
+def student_filters(search=None, status=None, career=None):
+    """Conditions on ``Student`` for a search, a status name and a career name"""
+    conditions = []
+    if search:
+        conditions += _search_filter(search)
+    if status:
+        conditions.append(Student.id.in_(
+            db.select(student_status.c.student_id).join(Status).where(Status.name == status)
+        ))
+    if career:
+        conditions.append(Student.id.in_(
+            db.select(student_career.c.student_id).join(Career).where(Career.name == career)
+        ))
+    return conditions
+
+
+def list_students(search=None, status=None, career=None, sort='legajo', order='asc', cursor=None,
+                  limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of students and the cursor of the next page (None on the
+    last page). Raises ValueError for an unknown sort, order or a bad cursor.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Unknown order: {order}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = SORT_COLUMNS[sort] + [Student.id]
+
+    query = Student.query.options(selectinload(Student.careers), selectinload(Student.statuses))
+    query = query.filter(*student_filters(search, status, career))
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        key, after = tuple_(*columns), tuple_(*values)
+        query = query.filter(key > after if order == 'asc' else key < after)
+
+    query = query.order_by(*[column.asc() if order == 'asc' else column.desc() for column in columns])
+    # One extra row tells whether another page follows
+    students = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(students) > limit:
+        students = students[:limit]
+        last = students[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return students, next_cursor
+
+
+def student_to_dict(student):
+    return {
+        'id': student.id,
+        'legajo': student.legajo,
+        'apellido': student.apellido,
+        'nombre': student.nombre,
+        'tipo_documento': student.tipo_documento,
+        'documento': student.documento,
+        'sexo': student.sexo,
+        'statuses': sorted(status.name for status in student.statuses),
+        'careers': [{'name': career.name, 'plan': career.plan} for career in student.careers]
+    }
@@ -0,0 +1,447 @@
+"""
+Columnar snapshot of the data behind the dashboard and the home page.
+
+After each import ``refresh_snapshot`` exports the students, their statuses,
+careers and courses as ``.npy`` files, one directory per database and data
+version under ``SNAPSHOT_DIR``:
+
+* ``status_mask`` and ``sexo``, one entry per student (``sexo`` codes index
+  the ``sexos`` of ``meta.json``, -1 when empty); statuses are the bits of
+  the mask (app/status_masks.py);
+* ``career_indptr``/``career_indices``, a CSR matrix of student x career
+  name, and ``course_indptr``/``course_indices``, student x course.
+
+Workers memory-map the files (``np.load(mmap_mode='r')``) so they share one
+copy through the page cache, and load the next directory once the data
+version moves on. ``snapshot_status_overlap`` answers the home page with
+vectorized operations on the arrays.
+
+The dashboard statistics come from the stats cube, built from the arrays in
+one pass per snapshot: the number of students per combination of career
+names, status mask and sexo, plus the counts of every course, told apart by
+id with its career's plan and version. Any selection of
+careers (none for all of them, one, or several, whose students count once)
+is a sum over the cube's cells, so /api/student-stats/cube serves it whole
+for the dashboard to slice client-side and ``snapshot_student_stats``
+slices it for /api/student-stats. Careers are identified by name, so the
+plans of an equally named career are one career, as everywhere in the
+dashboard. ``flask summaries check`` compares both with the reference
+queries. Readers never build a snapshot: until the one of the current data
+version exists (imports, clearing and repairs refresh it once committed, and
+``flask summaries snapshot`` on demand) they query the base tables. The
+summary tables are not maintained alongside the snapshot, so there is a
+single source of truth; ``ANALYTICS_SNAPSHOT=false`` serves them instead.
+
+Directories are named after a random ``database_id`` kept in ``AppState``
+and created with the database, so a database recreated at the same URL,
+whose data versions start over, never picks up the snapshot of its
+predecessor.
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+
+from app import db
+from app.cache import DATA_VERSION
+from app.models import AppState
+from app.stats import STATUS_GROUPS, career_names, compute_index_counts, compute_student_stats, selected_careers
+from app.status_masks import ALL_BITS, STATUS_BITS, overlap_counts, stale_status_masks, status_overlap
+from app.summaries import summary_student_stats
+
+DATABASE_ID = 'database_id'
+
+ARRAYS = ['status_mask', 'sexo', 'career_indptr', 'career_indices', 'course_indptr', 'course_indices']
+
+# Layout of meta.json and the stats cube; snapshots of another format are
+# rebuilt rather than read
+SNAPSHOT_FORMAT = 2
+
+# Root directory -> the Snapshot last loaded from it
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def snapshot_root():
+    return current_app.config.get('SNAPSHOT_DIR') or os.path.join(current_app.instance_path, 'snapshot')
+
+
+def _state():
+    """(database_id, data version) of the database; the id is None until ``init_database_id``"""
+    values = dict(db.session.query(AppState.name, AppState.value)
+                  .filter(AppState.name.in_([DATABASE_ID, DATA_VERSION])))
+    return values.get(DATABASE_ID), values.get(DATA_VERSION) or 0
+
+
+def init_database_id():
+    """Give the database its random ``database_id`` unless it has one; returns it"""
+    database_id, _ = _state()
+    if database_id is None:
+        database_id = random.randrange(1, 2 ** 31)
+        db.session.add(AppState(name=DATABASE_ID, value=database_id))
+        db.session.commit()
+    return database_id
+
+
+def _directory(root, database_id, version):
+    return os.path.join(root, f'{database_id}-v{version}-f{SNAPSHOT_FORMAT}')
+
+
+def _csr(rows, columns, students):
+    """CSR (indptr, indices) of the (row, column) pairs, columns sorted within each row"""
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(students + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=students), out=indptr[1:])
+    return indptr, columns[order].astype(np.int32)
+
+
+def _student_rows(ids, student_ids):
+    """Rows of ``student_ids`` in the sorted ``ids``, and the mask of those found"""
+    rows = np.searchsorted(ids, student_ids)
+    found = rows < len(ids)
+    found[found] = ids[rows[found]] == student_ids[found]
+    return rows, found
+
+
+def _pairs(sql):
+    result = db.session.execute(text(sql)).all()
+    return [np.array(values) for values in zip(*result)] if result else [np.array([], dtype=np.int64)] * 2
+
+
+def snapshot_arrays():
+    """The arrays and ``meta.json`` contents of the current data"""
+    _, version = _state()
+    students = db.session.execute(text("SELECT id, status_mask, sexo FROM student ORDER BY id")).all()
+    ids = np.array([row[0] for row in students], dtype=np.int64)
+    sexos = sorted({row[2] for row in students if row[2]})
+    sexo_codes = {sexo: code for code, sexo in enumerate(sexos)}
+    arrays = {
+        'status_mask': np.array([row[1] for row in students], dtype=np.uint8),
+        'sexo': np.array([sexo_codes.get(row[2], -1) for row in students], dtype=np.int16)
+    }
+
+    careers = career_names()
+    career_codes = {name: code for code, name in enumerate(careers)}
+    # Careers count by name, so a student in two plans of a career counts once
+    student_ids, names = _pairs("""
+        SELECT DISTINCT sca.student_id, ca.name
+        FROM student_career sca
+        JOIN career ca ON ca.id = sca.career_id
+    """)
+    rows, found = _student_rows(ids, student_ids.astype(np.int64))
+    codes = np.array([career_codes[name] for name in names], dtype=np.int32)
+    arrays['career_indptr'], arrays['career_indices'] = _csr(rows[found], codes[found], len(ids))
+
+    # Courses in the order the dashboard resolves equally named ones
+    courses = db.session.execute(text("""
+        SELECT c.id, c.name, ca.name, ca.plan, ca.version
+        FROM course c
+        JOIN career ca ON ca.id = c.career_id
+        ORDER BY ca.name, c.name, c.id
+    """)).all()
+    course_codes = {course_id: code for code, (course_id, *_) in enumerate(courses)}
+    student_ids, course_ids = _pairs("SELECT student_id, course_id FROM student_course")
+    rows, found = _student_rows(ids, student_ids.astype(np.int64))
+    codes = np.array([course_codes.get(course_id, -1) for course_id in course_ids], dtype=np.int32)
+    found &= codes >= 0
+    arrays['course_indptr'], arrays['course_indices'] = _csr(rows[found], codes[found], len(ids))
+
+    meta = {
+        'version': version,
+        'careers': careers,
+        'sexos': sexos,
+        # [course id, name, career name, plan, version] by course code
+        'courses': [list(course) for course in courses],
+        'course_careers': [career_codes[career] for _, _, career, _, _ in courses]
+    }
+    return arrays, meta
+
+
+def build_snapshot(directory):
+    """
+    Export the arrays of the current data version into ``directory``.
+    Returns the version exported, or None when the data changed meanwhile.
+    """
+    arrays, meta = snapshot_arrays()
+    if _state()[1] != meta['version']:
+        return None
+    os.makedirs(directory)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), values)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta['version']
+
+
+@contextmanager
+def _build_lock(root, blocking):
+    """Serialize builds across processes; yields False when not blocking and busy"""
+    try:
+        import fcntl
+    except ImportError:
+        # No flock on Windows, where a single process serves the app
+        yield True
+        return
+    with open(os.path.join(root, 'build.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def refresh_snapshot(blocking=True):
+    """
+    Build the snapshot of the current data version unless it exists, and
+    remove this database's older ones. Returns its directory, or None when
+    it could not be built now.
+    """
+    root = snapshot_root()
+    os.makedirs(root, exist_ok=True)
+    # Databases initialized before the id was created with them get it here
+    database_id = init_database_id()
+    with _build_lock(root, blocking) as acquired:
+        if not acquired:
+            return None
+        directory = _directory(root, database_id, _state()[1])
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            # Written aside and renamed, so readers never see a partial snapshot
+            staging = tempfile.mkdtemp(prefix='.build-', dir=root)
+            try:
+                version = build_snapshot(os.path.join(staging, 'snapshot'))
+                if version is None:
+                    return None
+                directory = _directory(root, database_id, version)
+                shutil.rmtree(directory, ignore_errors=True)
+                os.rename(os.path.join(staging, 'snapshot'), directory)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        # Processes still mapping an older snapshot keep reading the unlinked files
+        for name in os.listdir(root):
+            if name.startswith(f'{database_id}-') and os.path.join(root, name) != directory:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return directory
+
+
+class Snapshot:
+    """The arrays of one snapshot, memory-mapped from its directory or held in memory"""
+
+    def __init__(self, arrays, meta, directory=None):
+        self.directory = directory
+        self.version = meta['version']
+        self.careers = meta['careers']
+        self.sexos = meta['sexos']
+        self.courses = meta['courses']
+        self.course_careers = np.array(meta['course_careers'], dtype=np.int32)
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        # Student row of every matrix entry, expanded once per process
+        self.career_rows = np.repeat(np.arange(len(self.status_mask)), np.diff(self.career_indptr))
+        self.course_rows = np.repeat(np.arange(len(self.status_mask)), np.diff(self.course_indptr))
+        self._cube = None
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(arrays, meta, directory)
+
+    def status_overlap(self):
+        """``status_overlap`` payload"""
+        students = np.bincount(self.status_mask, minlength=ALL_BITS + 1)
+        return overlap_counts({mask: int(count) for mask, count in enumerate(students)})
+
+    def _build_cube(self):
+        masks = np.asarray(self.status_mask).astype(np.int64)
+        # The set of career names of every student as a bitmap, 64 careers a word
+        words = max(1, -(-len(self.careers) // 64))
+        career_sets = np.zeros((len(masks), words), dtype='<u8')
+        np.bitwise_or.at(career_sets, (self.career_rows, self.career_indices // 64),
+                         np.left_shift(np.uint64(1), (self.career_indices % 64).astype(np.uint64)))
+        # Students without any status count nowhere
+        held = masks != 0
+        keys = np.column_stack([career_sets[held].view(np.int64), masks[held],
+                                np.asarray(self.sexo)[held].astype(np.int64)])
+        cells, students = np.unique(keys, axis=0, return_counts=True)
+        members = np.unpackbits(np.ascontiguousarray(cells[:, :words]).view(np.uint8), axis=1, bitorder='little')
+
+        distribution_statuses = STATUS_GROUPS['registration']
+        course_masks = masks[self.course_rows]
+        counts = [np.bincount(self.course_indices[(course_masks & STATUS_BITS[name]) != 0],
+                              minlength=len(self.courses)) for name in distribution_statuses]
+        courses = []
+        for code in np.flatnonzero(sum(counts)):
+            course_id, name, _, plan, version = self.courses[code]
+            courses.append([course_id, name, int(self.course_careers[code]), plan, version,
+                            *(int(c[code]) for c in counts)])
+        return {
+            'version': self.version,
+            'careers': list(self.careers),
+            'sexos': list(self.sexos),
+            'status_bits': STATUS_BITS,
+            'status_groups': STATUS_GROUPS,
+            # [career codes, status mask, sexo code or -1, students] per
+            # combination of career names, statuses and sexo
+            'cells': [[np.flatnonzero(career_set).tolist(), int(mask), int(sexo), int(count)]
+                      for career_set, (mask, sexo), count in zip(members, cells[:, words:], students)],
+            # [course id, course name, career code, plan, version, students
+            # per distribution status], in the order the dashboard resolves
+            # equally named courses
+            'courses': courses
+        }
+
+    def stats_cube(self):
+        """The ``stats_cube`` payload, built once per snapshot"""
+        if self._cube is None:
+            self._cube = self._build_cube()
+        return self._cube
+
+    def student_stats(self, selected_career=None):
+        """/api/student-stats payload, optionally restricted to some career names"""
+        return slice_stats_cube(self.stats_cube(), selected_career)
+
+
+def slice_stats_cube(cube, selected_career=None):
+    """
+    /api/student-stats payload of the students enrolled in any of the
+    selected careers, from a ``stats_cube``; dashboard.html slices the cube
+    the same way.
+    """
+    careers = cube['careers']
+    selection = selected_careers(selected_career)
+    selected = {careers.index(name) for name in selection if name in careers} if selection else None
+    bits = cube['status_bits']
+    groups = cube['status_groups']
+    distribution_statuses = groups['registration']
+
+    status_counts = {group: dict.fromkeys(names, 0) for group, names in groups.items()}
+    gender_distribution = {group: {} for group in groups}
+    career_distribution = {name: {} for name in distribution_statuses}
+    for codes, mask, sexo, students in cube['cells']:
+        if selected is not None and selected.isdisjoint(codes):
+            continue
+        for group, names in groups.items():
+            held = [name for name in names if mask & bits[name]]
+            for name in held:
+                status_counts[group][name] += students
+            # Students without a recorded sexo only count towards status totals
+            if held and sexo >= 0:
+                sexos = gender_distribution[group]
+                sexos[cube['sexos'][sexo]] = sexos.get(cube['sexos'][sexo], 0) + students
+        for name in distribution_statuses:
+            if mask & bits[name]:
+                for code in codes:
+                    if selected is None or code in selected:
+                        counts = career_distribution[name]
+                        counts[careers[code]] = counts.get(careers[code], 0) + students
+
+    # Courses are told apart by id; only the payload keys them by name
+    course_counts = {}
+    for course_id, course, code, plan, version, *counts in cube['courses']:
+        if selected is None or code in selected:
+            course_counts[course_id] = (course, code, counts)
+    course_distribution = {name: {} for name in distribution_statuses}
+    for course, code, counts in course_counts.values():
+        # Equally named courses of equally named careers share a key; the
+        # last one in (career, course) order wins, as in the summary tables
+        key = f"{course} [{careers[code]}]"
+        for name, count in zip(distribution_statuses, counts):
+            if count:
+                course_distribution[name][key] = count
+
+    return {
+        'status_counts': status_counts,
+        'course_distribution': course_distribution,
+        'career_distribution': career_distribution,
+        'gender_distribution': gender_distribution,
+        'careers': list(careers)
+    }
+
+
+def current_snapshot():
+    """The snapshot of the current data version, or None to use the summary tables"""
+    if not current_app.config['ANALYTICS_SNAPSHOT']:
+        return None
+    root = snapshot_root()
+    database_id, version = _state()
+    with _lock:
+        snapshot = _snapshots.get(root)
+    directory = _directory(root, database_id, version)
+    if snapshot is not None and snapshot.directory == directory:
+        return snapshot
+    if database_id is None or not os.path.exists(os.path.join(directory, 'meta.json')):
+        # Not built yet: the writer that moved the data version on refreshes it
+        return None
+    try:
+        snapshot = Snapshot.load(directory)
+    except (OSError, ValueError):
+        # Removed by a newer build in the meantime
+        return None
+    with _lock:
+        _snapshots[root] = snapshot
+    return snapshot
+
+
+def stats_cube():
+    """
+    Stats cube of the current data version: the snapshot's, or without one
+    built from arrays read off the base tables
+    """
+    snapshot = current_snapshot()
+    if snapshot is None:
+        snapshot = Snapshot(*snapshot_arrays())
+    return snapshot.stats_cube()
+
+
+def snapshot_student_stats(selected_career=None):
+    """
+    /api/student-stats payload from the snapshot, or the base tables until it
+    is built; the summary tables with ``ANALYTICS_SNAPSHOT=false``
+    """
+    if not current_app.config['ANALYTICS_SNAPSHOT']:
+        return summary_student_stats(selected_career)
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return compute_student_stats(selected_career)
+    return snapshot.student_stats(selected_career)
+
+
+def snapshot_status_overlap():
+    """Home page counts from the snapshot, or the status masks without one"""
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return status_overlap()
+    return snapshot.status_overlap()
+
+
+def check_snapshot():
+    """Differences between the snapshot payloads and the reference queries"""
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return ["No snapshot of the current data version"]
+    problems = []
+    stale = stale_status_masks()
+    if stale:
+        problems.append(f"{stale} students have a status_mask that differs from their statuses")
+    counts = snapshot.status_overlap()
+    if counts != status_overlap():
+        problems.append("home page counts differ from the status masks")
+    del counts['status_matrix']
+    if counts != compute_index_counts():
+        problems.append("home page counts differ from the base tables")
+    careers = career_names()
+    # Every career on its own, and all of them selected together
+    for career in [None] + careers + [careers]:
+        if snapshot.student_stats(career) != compute_student_stats(career):
+            problems.append(f"student stats differ from the base tables for career {career!r}")
+    return problems
+
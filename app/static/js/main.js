@@ -77,13 +77,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // Export functions
+    // Export functions: download the data behind the page, honoring its career filter
     const exportCSVBtn = document.getElementById('export-csv');
     if (exportCSVBtn) {
         exportCSVBtn.addEventListener('click', function() {
-            // This is a simple example - in a real app, you would make an API call
-            // to get the data in CSV format
-            alert('In a real application, this would download the data as CSV');
+            const params = new URLSearchParams();
+            const careerFilter = document.getElementById('careerFilter');
+            if (careerFilter) {
+                // One career argument per selected career
+                Array.from(careerFilter.selectedOptions)
+                    .filter(option => option.value)
+                    .forEach(option => params.append('career', option.value));
+            }
+            window.location.href = this.dataset.url + (params.toString() ? `?${params}` : '');
         });
     }
 
@@ -0,0 +1,229 @@
+"""
+Dashboard statistics computed from grouped scans.
+
+``compute_student_stats`` builds the /api/student-stats payload from three
+statements: the career list, one grouped scan of student statuses (status and
+gender counts) and one UNION ALL of the course and career distributions.
+
+Both scans first fold each student's statuses into 0/1 flags, one row per
+student, so a student is counted once however many statuses or careers lead to
+them.
+
+A selection of several careers counts the students enrolled in any of them,
+and restricts the course and career distributions to those careers.
+
+These functions read the base tables. The endpoints serve the same figures
+from the summary tables (app/summaries.py) and the status masks
+(app/status_masks.py) and use these as the reference.
+"""
+from sqlalchemy import bindparam, func, text
+
+from app import db
+from app.models import Student, Status, Career, student_status
+
+# Status groups shown side by side in the dashboard
+STATUS_GROUPS = {
+    'enrollment': ['active', 'inactive'],
+    'registration': ['re-enrolled', 'incoming']
+}
+
+# Restricts student ids to those enrolled in a career with one of the selected names
+CAREER_FILTER = """
+    {column} IN (
+        SELECT sca.student_id
+        FROM student_career sca
+        JOIN career cf ON sca.career_id = cf.id
+        WHERE cf.name IN :career_names
+    )
+"""
+
+STATUS_FLAGS = """
+    SELECT ss.student_id AS student_id,
+           MAX(CASE WHEN st.name = 'active' THEN 1 ELSE 0 END) AS is_active,
+           MAX(CASE WHEN st.name = 'inactive' THEN 1 ELSE 0 END) AS is_inactive,
+           MAX(CASE WHEN st.name = 're-enrolled' THEN 1 ELSE 0 END) AS is_reenrolled,
+           MAX(CASE WHEN st.name = 'incoming' THEN 1 ELSE 0 END) AS is_incoming
+    FROM student_status ss
+    JOIN status st ON ss.status_id = st.id
+    {where}
+    GROUP BY ss.student_id
+"""
+
+
+def selected_careers(careers):
+    """
+    Career names of a dashboard filter, sorted and without duplicates: None or
+    '' for every career, one name, or a list of names such as the repeated
+    ``career`` arguments of a request. An empty list means every career.
+    """
+    if not careers:
+        return []
+    if isinstance(careers, str):
+        careers = [careers]
+    return sorted({career for career in careers if career})
+
+
+def _statement(sql, careers):
+    """``sql`` as a statement, expanding the selected career names when filtered"""
+    stmt = text(sql)
+    if careers:
+        stmt = stmt.bindparams(bindparam('career_names', expanding=True))
+    return stmt, {'career_names': careers} if careers else {}
+
+
+def _status_counts(careers):
+    """Count students per status and per (status group, sexo) in one scan"""
+    where = ''
+    if careers:
+        where = 'WHERE ' + CAREER_FILTER.format(column='ss.student_id')
+    sql = f"""
+        SELECT s.sexo, SUM(f.is_active), SUM(f.is_inactive), SUM(f.is_reenrolled), SUM(f.is_incoming),
+               SUM(CASE WHEN f.is_active = 1 OR f.is_inactive = 1 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN f.is_reenrolled = 1 OR f.is_incoming = 1 THEN 1 ELSE 0 END)
+        FROM ({STATUS_FLAGS.format(where=where)}) f
+        JOIN student s ON s.id = f.student_id
+        GROUP BY s.sexo
+    """
+
+    totals = {'active': 0, 'inactive': 0, 're-enrolled': 0, 'incoming': 0}
+    gender_distribution = {'enrollment': {}, 'registration': {}}
+    stmt, params = _statement(sql, careers)
+    for sexo, active, inactive, reenrolled, incoming, enrollment, registration in db.session.execute(stmt, params):
+        totals['active'] += active
+        totals['inactive'] += inactive
+        totals['re-enrolled'] += reenrolled
+        totals['incoming'] += incoming
+        # Students without a recorded sexo only count towards status totals
+        if sexo:
+            if enrollment:
+                gender_distribution['enrollment'][sexo] = enrollment
+            if registration:
+                gender_distribution['registration'][sexo] = registration
+
+    status_counts = {
+        group: {name: totals[name] for name in names}
+        for group, names in STATUS_GROUPS.items()
+    }
+    return status_counts, gender_distribution
+
+
+def _distributions(careers):
+    """Course and career distributions of re-enrolled and incoming students in one statement"""
+    course_filter = "WHERE ca.name IN :career_names" if careers else ""
+    career_filter = "AND ca.name IN :career_names" if careers else ""
+    sql = f"""
+        WITH flags AS ({STATUS_FLAGS.format(where="WHERE st.name IN ('re-enrolled', 'incoming')")})
+        SELECT 'course' AS kind, c.id AS course_id, c.name AS course_name, ca.name AS career_name,
+               per_course.reenrolled, per_course.incoming
+        FROM (
+            -- (student_id, course_id) is the primary key of student_course, so
+            -- each student appears once per course
+            SELECT sc.course_id AS course_id, SUM(f.is_reenrolled) AS reenrolled, SUM(f.is_incoming) AS incoming
+            FROM flags f
+            JOIN student_course sc ON sc.student_id = f.student_id
+            GROUP BY sc.course_id
+        ) per_course
+        JOIN course c ON c.id = per_course.course_id
+        JOIN career ca ON ca.id = c.career_id
+        {course_filter}
+        UNION ALL
+        -- Careers are grouped by name across plans, hence the DISTINCT
+        SELECT 'career' AS kind, NULL, NULL, ca.name,
+               COUNT(DISTINCT CASE WHEN f.is_reenrolled = 1 THEN f.student_id END),
+               COUNT(DISTINCT CASE WHEN f.is_incoming = 1 THEN f.student_id END)
+        FROM flags f
+        JOIN student_career sca ON sca.student_id = f.student_id
+        JOIN career ca ON ca.id = sca.career_id
+        WHERE 1 = 1 {career_filter}
+        GROUP BY ca.name
+        ORDER BY kind, career_name, course_name, course_id
+    """
+    stmt, params = _statement(sql, careers)
+
+    course_distribution = {'re-enrolled': {}, 'incoming': {}}
+    career_distribution = {'re-enrolled': {}, 'incoming': {}}
+    for kind, course_id, course_name, career_name, reenrolled, incoming in db.session.execute(stmt, params):
+        if kind == 'course':
+            # Courses sharing a name within equally named careers (different
+            # plans) share a key; the last one in (career, course) order wins
+            distribution = course_distribution
+            key = f"{course_name} [{career_name}]"
+        else:
+            distribution = career_distribution
+            key = career_name
+        if reenrolled:
+            distribution['re-enrolled'][key] = reenrolled
+        if incoming:
+            distribution['incoming'][key] = incoming
+    return course_distribution, career_distribution
+
+
+def career_names():
+    """Career names for the filter dropdown, in order of first creation"""
+    careers = db.session.query(Career.name).group_by(Career.name).order_by(func.min(Career.id))
+    return [name for name, in careers]
+
+
+def compute_student_stats(selected_career=None):
+    """Statistics shown by the dashboard, optionally restricted to some career names"""
+    all_careers = career_names()
+    careers = selected_careers(selected_career)
+
+    status_counts, gender_distribution = _status_counts(careers)
+    course_distribution, career_distribution = _distributions(careers)
+
+    return {
+        'status_counts': status_counts,
+        'course_distribution': course_distribution,
+        'career_distribution': career_distribution,
+        'gender_distribution': gender_distribution,
+        'careers': all_careers
+    }
+
+
+def compute_index_counts():
+    """Student counts shown on the home page"""
+    # Get unique student counts for each status (distinct by student.id)
+    active_unique = db.session.query(Student).join(student_status).join(Status).filter(
+        Status.name == 'active'
+    ).distinct().count()
+
+    inactive_unique = db.session.query(Student).join(student_status).join(Status).filter(
+        Status.name == 'inactive'
+    ).distinct().count()
+
+    reregistered_unique = db.session.query(Student).join(student_status).join(Status).filter(
+        Status.name == 're-enrolled'
+    ).distinct().count()
+
+    incoming_unique = db.session.query(Student).join(student_status).join(Status).filter(
+        Status.name == 'incoming'
+    ).distinct().count()
+
+    # Get total unique students across all statuses
+    total_unique = db.session.query(Student).count()
+
+    # Get counts of students with multiple statuses
+    active_and_reenrolled = db.session.query(Student).distinct()\
+        .join(student_status).join(Status)\
+        .filter(Status.name.in_(['active', 're-enrolled']))\
+        .group_by(Student.id)\
+        .having(db.func.count(db.distinct(Status.name)) == 2)\
+        .count()
+
+    active_and_incoming = db.session.query(Student).distinct()\
+        .join(student_status).join(Status)\
+        .filter(Status.name.in_(['active', 'incoming']))\
+        .group_by(Student.id)\
+        .having(db.func.count(db.distinct(Status.name)) == 2)\
+        .count()
+
+    return {
+        'active_unique': active_unique,
+        'inactive_unique': inactive_unique,
+        'reregistered_unique': reregistered_unique,
+        'incoming_unique': incoming_unique,
+        'total_unique': total_unique,
+        'active_and_reenrolled': active_and_reenrolled,
+        'active_and_incoming': active_and_incoming
+    }
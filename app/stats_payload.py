@@ -0,0 +1,152 @@
+"""
+Shaping of the /api/student-stats payload.
+
+The full payload lists every course with re-enrolled or incoming students,
+keyed "name [career]", so it grows with the course catalog. Clients can ask
+for less:
+
+* ``fields`` keeps only the named parts of the payload;
+* ``top`` keeps the ``top`` courses with the most students across the
+  distribution statuses, the same courses for every status, and sums the
+  others under ``OTHER``; ``course_totals`` gives the number of courses of
+  each status before the cut;
+* ``encoding=compact`` lists each distribution as ``[key index, students]``
+  pairs, most students first, where the index points into the names listed
+  once under ``keys`` and -1 stands for ``OTHER``.
+
+``course_page`` serves the whole of one course distribution a page at a
+time, most students first, for drill-down, with the opaque cursors of
+/api/students. Everything here works on the cached payload, so the
+statistics are computed once per career selection and data version
+whatever shape is asked for.
+"""
+from bisect import bisect_right
+from collections import Counter
+
+from app.search import decode_cursor, encode_cursor
+
+PAYLOAD_FIELDS = ['status_counts', 'course_distribution', 'career_distribution', 'gender_distribution', 'careers']
+
+DISTRIBUTIONS = ['course_distribution', 'career_distribution']
+
+ENCODINGS = ['full', 'compact']
+
+# Key of the courses summed together by ``top``; course keys always end in "[career]"
+OTHER = 'other'
+
+DEFAULT_COURSE_PAGE_SIZE = 50
+MAX_COURSE_PAGE_SIZE = 500
+
+
+def _ranked(counts):
+    """(key, students) pairs, most students first and ties by key"""
+    return sorted(counts.items(), key=_rank)
+
+
+def _rank(item):
+    return -item[1], item[0]
+
+
+def parse_shape(args):
+    """
+    ``shape_stats`` keyword arguments from request arguments: ``fields``
+    (repeated or comma separated), ``top`` and ``encoding``. Raises
+    ValueError for unknown fields or encodings and a bad ``top``.
+    """
+    fields = [name.strip() for value in args.getlist('fields') for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in PAYLOAD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field: {unknown[0]}")
+
+    top = args.get('top')
+    if top is not None:
+        try:
+            top = int(top)
+        except ValueError:
+            top = 0
+        if top < 1:
+            raise ValueError("top must be a positive integer")
+
+    encoding = args.get('encoding', 'full')
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    return {'fields': [name for name in PAYLOAD_FIELDS if name in fields] or None, 'top': top, 'encoding': encoding}
+
+
+def top_courses(course_distribution, top):
+    """
+    The ``top`` courses with the most students over all statuses of
+    ``course_distribution``, with the students of the others under ``OTHER``
+    """
+    totals = Counter()
+    for counts in course_distribution.values():
+        totals.update(counts)
+    kept = {key for key, _ in sorted(totals.items(), key=_rank)[:top]}
+
+    shaped = {}
+    for status, counts in course_distribution.items():
+        shaped[status] = {key: count for key, count in counts.items() if key in kept}
+        other = sum(count for key, count in counts.items() if key not in kept)
+        if other:
+            shaped[status][OTHER] = other
+    return shaped
+
+
+def _compact(payload):
+    """``payload`` with its distributions as ``[key index, students]`` pairs"""
+    compact = dict(payload, encoding='compact', keys={})
+    for name in DISTRIBUTIONS:
+        if name not in payload:
+            continue
+        # Only course distributions have an OTHER bucket; a career may be called 'other'
+        other = OTHER if name == 'course_distribution' else None
+        keys = sorted({key for counts in payload[name].values() for key in counts if key != other})
+        index = {key: i for i, key in enumerate(keys)}
+        compact['keys'][name] = keys
+        compact[name] = {}
+        for status, counts in payload[name].items():
+            pairs = [[index[key], count] for key, count in _ranked(counts) if key != other]
+            if other in counts:
+                pairs.append([-1, counts[other]])
+            compact[name][status] = pairs
+    return compact
+
+
+def shape_stats(stats, fields=None, top=None, encoding='full'):
+    """The parts of a /api/student-stats payload a client asked for, in its encoding"""
+    payload = {name: stats[name] for name in fields or PAYLOAD_FIELDS}
+    if top is not None and 'course_distribution' in payload:
+        payload['course_totals'] = {status: len(counts) for status, counts in payload['course_distribution'].items()}
+        payload['course_distribution'] = top_courses(payload['course_distribution'], top)
+    if encoding == 'compact':
+        payload = _compact(payload)
+    return payload
+
+
+def course_page(stats, status, cursor=None, limit=DEFAULT_COURSE_PAGE_SIZE):
+    """
+    One page of the ``status`` course distribution, as (key, students) pairs
+    with most students first, the cursor of the next page (None on the last
+    one) and the number of courses. Raises ValueError for an unknown status
+    or a bad cursor.
+    """
+    counts = stats['course_distribution'].get(status)
+    if counts is None:
+        raise ValueError(f"Unknown status: {status}")
+    limit = max(1, min(limit, MAX_COURSE_PAGE_SIZE))
+    entries = _ranked(counts)
+
+    start = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2 or not isinstance(values[0], int) or not isinstance(values[1], str):
+            raise ValueError("Invalid cursor")
+        # The cursor holds the (students, key) of the last course returned
+        start = bisect_right(entries, _rank((values[1], values[0])), key=_rank)
+
+    page = entries[start:start + limit]
+    next_cursor = None
+    if start + limit < len(entries):
+        key, count = page[-1]
+        next_cursor = encode_cursor([count, key])
+    return page, next_cursor, len(entries)
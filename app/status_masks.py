@@ -0,0 +1,114 @@
+"""
+Per-student status bitmask.
+
+``Student.status_mask`` has the bit ``STATUS_BITS[name]`` set for every
+status the student holds, a denormalized copy of ``student_status`` written
+in the same transaction: imports set the bit of the imported status on its
+students, replace and delta imports clear it on the students they drop, and
+``fix_duplicates`` repairs any mask that drifted. Other statuses (such as
+'unknown') have no bit.
+
+Every combination of the four statuses is then counted by one
+``GROUP BY status_mask`` over the student table: ``status_overlap`` returns
+the home page counts and the 16-cell status matrix (the Venn diagram of the
+enrollment and registration statuses) from that single scan.
+"""
+from itertools import combinations
+
+from sqlalchemy import bindparam, func, text
+
+from app import db
+from app.bulk import batched
+from app.models import Student
+from app.stats import STATUS_GROUPS
+
+STATUS_BITS = {'active': 1, 'inactive': 2, 're-enrolled': 4, 'incoming': 8}
+
+ALL_BITS = sum(STATUS_BITS.values())
+
+# The mask of each student recomputed from student_status, as an SQL expression
+MASK_SQL = f"""(
+    SELECT COALESCE(SUM(DISTINCT CASE st.name
+        {' '.join(f"WHEN '{name}' THEN {bit}" for name, bit in STATUS_BITS.items())} ELSE 0 END), 0)
+    FROM student_status ss
+    JOIN status st ON st.id = ss.status_id
+    WHERE ss.student_id = student.id
+)"""
+
+
+def _update_masks(expression, student_ids):
+    stmt = text(f"UPDATE student SET status_mask = {expression} WHERE id IN :ids") \
+        .bindparams(bindparam('ids', expanding=True))
+    for chunk in batched(sorted(set(student_ids))):
+        db.session.execute(stmt, {'ids': chunk})
+
+
+def add_status_bit(student_ids, status_name):
+    """Mark the given students as holding ``status_name``"""
+    bit = STATUS_BITS.get(status_name)
+    if bit:
+        _update_masks(f"status_mask | {bit}", student_ids)
+
+
+def remove_status_bit(student_ids, status_name):
+    """Mark the given students as no longer holding ``status_name``"""
+    bit = STATUS_BITS.get(status_name)
+    if bit:
+        _update_masks(f"status_mask & {ALL_BITS & ~bit}", student_ids)
+
+
+def stale_status_masks():
+    """Number of students whose mask differs from their statuses"""
+    return db.session.execute(text(f"SELECT COUNT(*) FROM student WHERE status_mask != {MASK_SQL}")).scalar()
+
+
+def refresh_status_masks():
+    """Recompute the masks that differ from ``student_status``; returns how many changed"""
+    return db.session.execute(text(f"UPDATE student SET status_mask = {MASK_SQL} WHERE status_mask != {MASK_SQL}")) \
+        .rowcount
+
+
+def _subsets(names):
+    """Every combination of ``names``, from none to all of them"""
+    return [list(subset) for size in range(len(names) + 1) for subset in combinations(names, size)]
+
+
+def _bits(names):
+    return sum(STATUS_BITS[name] for name in names)
+
+
+def overlap_counts(students):
+    """
+    Home page counts and the status matrix from the number of students per
+    mask (``{mask: students}``): students per combination of enrollment
+    statuses (rows) and registration statuses (columns), each combination
+    meaning exactly those statuses within its group.
+    """
+    students = {**dict.fromkeys(range(ALL_BITS + 1), 0), **students}
+
+    def holding(*names):
+        bits = _bits(names)
+        return sum(count for mask, count in students.items() if mask & bits == bits)
+
+    rows = _subsets(STATUS_GROUPS['enrollment'])
+    columns = _subsets(STATUS_GROUPS['registration'])
+    return {
+        'active_unique': holding('active'),
+        'inactive_unique': holding('inactive'),
+        'reregistered_unique': holding('re-enrolled'),
+        'incoming_unique': holding('incoming'),
+        'total_unique': sum(students.values()),
+        'active_and_reenrolled': holding('active', 're-enrolled'),
+        'active_and_incoming': holding('active', 'incoming'),
+        'status_matrix': {
+            'rows': rows,
+            'columns': columns,
+            'students': [[students[_bits(row) | _bits(column)] for column in columns] for row in rows]
+        }
+    }
+
+
+def status_overlap():
+    """``overlap_counts`` of the student table, from one grouped scan"""
+    grouped = db.select(Student.status_mask, func.count()).group_by(Student.status_mask)
+    return overlap_counts(dict(db.session.execute(grouped).all()))
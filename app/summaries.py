@@ -0,0 +1,376 @@
+"""
+Summary tables behind the dashboard.
+
+The ``Summary*`` models hold the counts served by /api/student-stats, so
+reads cost O(#careers + #courses) instead of aggregating the association
+tables. They are maintained incrementally: ``SummaryDelta`` subtracts the
+contribution of every student an import touches before it is written and
+adds it back afterwards, in the import's transaction.
+
+Every student contributes at most 1 to each summary row, so contributions of
+disjoint sets of students add up. A summary is trusted only while the
+``summary_version`` state matches the data version; otherwise (e.g. a
+database created before these tables existed) readers fall back to the base
+tables until ``flask summaries rebuild`` is run.
+
+The tables only serve the dashboard with ``ANALYTICS_SNAPSHOT=false``: with
+the snapshot (app/snapshot.py) writers leave them alone, see
+``maintain_summaries``, and turning the snapshot off later takes a
+``flask summaries rebuild``.
+"""
+import logging
+from collections import Counter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from app import db
+from app.bulk import batched, get_insert
+from app.cache import data_version
+from app.models import AppState, Student, Career, Course, SummaryStatusCount, SummaryCourseCount, SummaryGenderCount
+from app.stats import STATUS_GROUPS, career_names, compute_index_counts, compute_student_stats, selected_careers
+from app.status_masks import stale_status_masks, status_overlap
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_VERSION = 'summary_version'
+
+# Career value of the rows counting over all careers
+ALL_CAREERS = '*'
+
+# Status value of the row counting every student
+ALL_STUDENTS = '*'
+
+SUMMARY_MODELS = {
+    'status': (SummaryStatusCount, ['status', 'career']),
+    'course': (SummaryCourseCount, ['status', 'course_id']),
+    'gender': (SummaryGenderCount, ['status_group', 'sexo', 'career'])
+}
+
+# Temporary table holding the students whose contribution is computed
+SCOPE_TABLE = 'summary_scope'
+
+GROUP_CASE = 'CASE ' + ' '.join(
+    f"WHEN st.name IN ({', '.join(repr(name) for name in names)}) THEN '{group}'"
+    for group, names in STATUS_GROUPS.items()
+) + ' END'
+
+STUDENT_GROUPS = f"""
+    SELECT DISTINCT ss.student_id AS student_id, {GROUP_CASE} AS status_group
+    FROM student_status ss
+    JOIN status st ON ss.status_id = st.id
+    WHERE {{scope}}
+"""
+
+CONTRIBUTION_QUERIES = {
+    'status': [
+        f"""
+        SELECT st.name, '{ALL_CAREERS}', COUNT(*)
+        FROM student_status ss
+        JOIN status st ON ss.status_id = st.id
+        WHERE {{scope}}
+        GROUP BY st.name
+        """,
+        """
+        SELECT st.name, ca.name, COUNT(DISTINCT ss.student_id)
+        FROM student_status ss
+        JOIN status st ON ss.status_id = st.id
+        JOIN student_career sca ON sca.student_id = ss.student_id
+        JOIN career ca ON ca.id = sca.career_id
+        WHERE {scope}
+        GROUP BY st.name, ca.name
+        """,
+        f"""
+        SELECT '{ALL_STUDENTS}', '{ALL_CAREERS}', COUNT(*)
+        FROM (SELECT id AS student_id FROM student) ss
+        WHERE {{scope}}
+        """
+    ],
+    'course': [
+        """
+        SELECT st.name, sc.course_id, COUNT(*)
+        FROM student_status ss
+        JOIN status st ON ss.status_id = st.id
+        JOIN student_course sc ON sc.student_id = ss.student_id
+        WHERE {scope}
+        GROUP BY st.name, sc.course_id
+        """
+    ],
+    'gender': [
+        f"""
+        SELECT g.status_group, COALESCE(s.sexo, ''), '{ALL_CAREERS}', COUNT(*)
+        FROM ({STUDENT_GROUPS}) g
+        JOIN student s ON s.id = g.student_id
+        WHERE g.status_group IS NOT NULL
+        GROUP BY g.status_group, COALESCE(s.sexo, '')
+        """,
+        f"""
+        SELECT g.status_group, COALESCE(s.sexo, ''), ca.name, COUNT(DISTINCT g.student_id)
+        FROM ({STUDENT_GROUPS}) g
+        JOIN student s ON s.id = g.student_id
+        JOIN student_career sca ON sca.student_id = g.student_id
+        JOIN career ca ON ca.id = sca.career_id
+        WHERE g.status_group IS NOT NULL
+        GROUP BY g.status_group, COALESCE(s.sexo, ''), ca.name
+        """
+    ]
+}
+
+
+def _contributions(scoped):
+    """
+    Summary rows contributed by the students in the scope table, or by every
+    student when ``scoped`` is false, as a Counter keyed by (kind, *key).
+    """
+    # The scope drives the lookups through the (student_id, ...) primary keys
+    scope = f'ss.student_id IN (SELECT student_id FROM {SCOPE_TABLE})' if scoped else '1 = 1'
+    counts = Counter()
+    for kind, queries in CONTRIBUTION_QUERIES.items():
+        for sql in queries:
+            for row in db.session.execute(text(sql.format(scope=scope))):
+                *key, count = row
+                if count:
+                    counts[(kind, *key)] += count
+    return counts
+
+
+def _fill_scope(student_ids):
+    """Load ``student_ids`` into the temporary scope table"""
+    db.session.execute(text(f"CREATE TEMPORARY TABLE IF NOT EXISTS {SCOPE_TABLE} (student_id INTEGER PRIMARY KEY)"))
+    db.session.execute(text(f"DELETE FROM {SCOPE_TABLE}"))
+    rows = [{'student_id': student_id} for student_id in student_ids]
+    for chunk in batched(rows):
+        db.session.execute(text(f"INSERT INTO {SCOPE_TABLE} (student_id) VALUES (:student_id)"), chunk)
+
+
+def _scoped_contributions(student_ids):
+    if not student_ids:
+        return Counter()
+    _fill_scope(student_ids)
+    return _contributions(scoped=True)
+
+
+def apply_delta(delta):
+    """Add ``delta`` (a Counter of summary rows) to the summary tables"""
+    for kind, (model, key_columns) in SUMMARY_MODELS.items():
+        rows = [dict(zip(key_columns, key[1:]), count=count)
+                for key, count in delta.items() if key[0] == kind and count]
+        if not rows:
+            continue
+        stmt = get_insert(model.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={'count': model.__table__.c['count'] + stmt.excluded['count']}
+        )
+        for chunk in batched(rows):
+            db.session.execute(stmt, chunk)
+        db.session.execute(model.__table__.delete().where(model.__table__.c['count'] == 0))
+
+
+def summaries_fresh():
+    """True when the summary tables describe the current data version"""
+    value = db.session.query(AppState.value).filter_by(name=SUMMARY_VERSION).scalar()
+    return value is not None and value == data_version()
+
+
+def maintain_summaries():
+    """
+    Whether writers update the summary tables: they serve the dashboard only
+    without the snapshot, and deltas only apply to fresh summaries
+    """
+    return not current_app.config['ANALYTICS_SNAPSHOT'] and summaries_fresh()
+
+
+def init_summaries():
+    """An empty database has trivially consistent summaries"""
+    if db.session.get(AppState, SUMMARY_VERSION) is None and not db.session.query(Student.id).first():
+        mark_summaries_fresh()
+        db.session.commit()
+
+
+def mark_summaries_fresh():
+    """Record that the summaries match the data version; call after bump_data_version()"""
+    db.session.flush()
+    version = data_version()
+    state = db.session.get(AppState, SUMMARY_VERSION)
+    if state is None:
+        db.session.add(AppState(name=SUMMARY_VERSION, value=version))
+    else:
+        state.value = version
+
+
+class SummaryDelta:
+    """
+    Tracks the students an import touches. ``remove`` must see each existing
+    student before any of its rows is written, ``touch`` after; ``apply``
+    writes the net change to the summary tables.
+    """
+
+    def __init__(self):
+        self.delta = Counter()
+        self.touched = set()
+
+    def remove(self, student_ids):
+        """Subtract the current contribution of students not touched yet"""
+        new = set(student_ids) - self.touched
+        self.touched |= new
+        self.delta.subtract(_scoped_contributions(new))
+
+    def touch(self, student_ids):
+        self.touched.update(student_ids)
+
+    def apply(self):
+        self.delta.update(_scoped_contributions(self.touched))
+        apply_delta(self.delta)
+
+
+def clear_summaries():
+    for model, _ in SUMMARY_MODELS.values():
+        db.session.execute(model.__table__.delete())
+
+
+def rebuild_summaries():
+    """Recompute the summary tables from the base tables; the caller commits"""
+    clear_summaries()
+    apply_delta(_contributions(scoped=False))
+
+
+def stored_summaries():
+    """Summary table contents as a Counter keyed like ``_contributions``"""
+    counts = Counter()
+    for kind, (model, key_columns) in SUMMARY_MODELS.items():
+        columns = [model.__table__.c[name] for name in key_columns] + [model.__table__.c['count']]
+        for *key, count in db.session.execute(db.select(*columns)):
+            counts[(kind, *key)] = count
+    return counts
+
+
+def summary_student_stats(selected_career=None):
+    """/api/student-stats payload read from the summary tables"""
+    careers = selected_careers(selected_career)
+    if len(careers) > 1:
+        # The tables count each career on its own; students of several
+        # selected careers only count once in the base tables
+        return compute_student_stats(careers)
+    if not summaries_fresh():
+        logger.warning("Summary tables are stale, reading base tables; run 'flask summaries rebuild'")
+        return compute_student_stats(careers)
+    selected_career = careers[0] if careers else None
+
+    career = selected_career or ALL_CAREERS
+    all_careers = career_names()
+
+    counts = dict(db.session.query(SummaryStatusCount.status, SummaryStatusCount.count)
+                  .filter(SummaryStatusCount.career == career))
+    status_counts = {
+        group: {name: counts.get(name, 0) for name in names}
+        for group, names in STATUS_GROUPS.items()
+    }
+
+    gender_distribution = {group: {} for group in STATUS_GROUPS}
+    genders = db.session.query(SummaryGenderCount.status_group, SummaryGenderCount.sexo, SummaryGenderCount.count) \
+        .filter(SummaryGenderCount.career == career)
+    for group, sexo, count in genders:
+        # Students without a recorded sexo only count towards status totals
+        if sexo and group in gender_distribution:
+            gender_distribution[group][sexo] = count
+
+    distribution_statuses = STATUS_GROUPS['registration']
+    course_distribution = {name: {} for name in distribution_statuses}
+    courses = db.session.query(SummaryCourseCount.status, Course.name, Career.name, SummaryCourseCount.count) \
+        .join(Course, Course.id == SummaryCourseCount.course_id) \
+        .join(Career, Career.id == Course.career_id) \
+        .filter(SummaryCourseCount.status.in_(distribution_statuses))
+    if selected_career:
+        courses = courses.filter(Career.name == selected_career)
+    # Courses sharing a name within equally named careers (different plans)
+    # share a key; the last one in (career, course) order wins
+    for status, course_name, career_name, count in courses.order_by(Career.name, Course.name, Course.id):
+        course_distribution[status][f"{course_name} [{career_name}]"] = count
+
+    career_distribution = {name: {} for name in distribution_statuses}
+    careers = db.session.query(SummaryStatusCount.status, SummaryStatusCount.career, SummaryStatusCount.count) \
+        .filter(SummaryStatusCount.status.in_(distribution_statuses), SummaryStatusCount.career != ALL_CAREERS)
+    if selected_career:
+        careers = careers.filter(SummaryStatusCount.career == selected_career)
+    for status, career_name, count in careers:
+        career_distribution[status][career_name] = count
+
+    return {
+        'status_counts': status_counts,
+        'course_distribution': course_distribution,
+        'career_distribution': career_distribution,
+        'gender_distribution': gender_distribution,
+        'careers': all_careers
+    }
+
+
+def check_summaries():
+    """
+    Compare the summary tables with the base tables. Returns a list of
+    human readable mismatches, empty when they are consistent.
+    """
+    problems = []
+    if not summaries_fresh():
+        problems.append("summary_version does not match the data version")
+
+    expected = _contributions(scoped=False)
+    stored = stored_summaries()
+    for key in sorted(set(expected) | set(stored), key=repr):
+        if expected.get(key, 0) != stored.get(key, 0):
+            problems.append(f"{key}: stored {stored.get(key, 0)}, expected {expected.get(key, 0)}")
+
+    if not problems:
+        # The endpoints must serve what the reference queries compute
+        stale = stale_status_masks()
+        if stale:
+            problems.append(f"{stale} students have a status_mask that differs from their statuses")
+        counts = status_overlap()
+        del counts['status_matrix']
+        if counts != compute_index_counts():
+            problems.append("index counts differ from the base tables")
+        careers = [None] + career_names()
+        for career in careers:
+            if summary_student_stats(career) != compute_student_stats(career):
+                problems.append(f"student stats differ from the base tables for career {career!r}")
+    return problems
+
+
+summaries_cli = AppGroup('summaries', help='Maintain the dashboard summary tables.')
+
+
+@summaries_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the summary tables from the base tables."""
+    rebuild_summaries()
+    mark_summaries_fresh()
+    db.session.commit()
+    click.echo(f"Summary tables rebuilt at data version {data_version()}")
+
+
+@summaries_cli.command('snapshot')
+def snapshot_command():
+    """Export the analytics snapshot of the current data version."""
+    from app.snapshot import refresh_snapshot
+
+    directory = refresh_snapshot()
+    if directory is None:
+        raise click.ClickException("The data changed while exporting, try again")
+    click.echo(f"Snapshot written to {directory}")
+
+
+@summaries_cli.command('check')
+def check_command():
+    """Verify what serves the dashboard, the snapshot or the summary tables, against the base tables."""
+    if current_app.config['ANALYTICS_SNAPSHOT']:
+        from app.snapshot import check_snapshot
+        problems, served = check_snapshot(), 'Analytics snapshot is'
+    else:
+        problems, served = check_summaries(), 'Summary tables are'
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f"{served} consistent")
@@ -0,0 +1,174 @@
+"""
+Validation of SIU exports before their rows are written.
+
+``FileValidator`` checks each chunk of an export with column-wise pandas
+operations and reports per-row issues:
+
+* errors, rows that cannot be imported: missing Legajo or Nombre, a legajo
+  with control characters or surrounding whitespace, students whose first
+  row has no career and, under ``reject``, rows of a legajo whose personal
+  data differs from its first row;
+* warnings, rows imported with a caveat: birth dates that do not parse or
+  fall outside 1900..now (stored empty) and, under ``skip``, rows of a legajo
+  whose personal data differs from its first row (the last row is kept).
+
+Missing required columns reject the file outright, unknown columns are
+reported once. With the ``reject`` policy any error rejects the whole file;
+with ``skip`` the rows with errors are left out and the rest is imported.
+"""
+import pandas as pd
+
+from app.import_options import ERROR_POLICIES
+from app.normalization import REQUIRED_COLUMNS, column, parse_birth_dates, present
+
+KNOWN_COLUMNS = set(REQUIRED_COLUMNS) | {'Apellido', 'Tipo Documento', 'Fecha Nacimiento', 'Domicilio origen',
+                                         'Carrera', 'Plan', 'Version', 'Materia'}
+
+# Personal data that should be the same on every row of a student
+PERSONAL_COLUMNS = ['Nombre', 'Apellido', 'Tipo Documento', 'Documento', 'Nacionalidad', 'Fecha Nacimiento',
+                    'Domicilio', 'Domicilio origen', 'Telefono', 'Correo', 'Cuil', 'Sexo']
+
+# Any text the original importer took, but for control characters and
+# surrounding whitespace, which would make look-alike students
+LEGAJO_PATTERN = r'^[^\x00-\x20\x7f](?:[^\x00-\x1f\x7f]*[^\x00-\x20\x7f])?\Z'
+
+REPORT_FIELDS = ['file', 'row', 'legajo', 'column', 'severity', 'message']
+
+
+class ImportValidationError(Exception):
+    """An export rejected by validation; the issues went to the import's report"""
+
+
+class FileValidator:
+    """Validates the chunks of one export, in order, under an error policy"""
+
+    def __init__(self, source_file, on_error='reject'):
+        if on_error not in ERROR_POLICIES:
+            raise ValueError(f"Unknown error policy: {on_error}")
+        self.source_file = source_file
+        self.on_error = on_error
+        self.errors = 0
+        self.warnings = 0
+        self.skipped = 0
+        self.fatal = False
+        self.first_error = None
+        self._first_error_row = None
+        self._header_checked = False
+        # legajo -> row and personal data hash of its first row
+        self._first_row = {}
+        self._first_hash = {}
+        # legajos whose first imported row has a career
+        self._enrolled = set()
+
+    @property
+    def rejected(self):
+        return self.fatal or (self.on_error == 'reject' and self.errors > 0)
+
+    def _issue(self, row, legajo, column, severity, message):
+        if severity == 'error':
+            self.errors += 1
+            # Errors of a chunk are found check by check: keep the earliest row
+            if self.first_error is None or (row and self._first_error_row and row < self._first_error_row):
+                self.first_error = f"row {row}: {message}" if row else message
+                self._first_error_row = row
+        else:
+            self.warnings += 1
+        return {'file': self.source_file, 'row': row, 'legajo': legajo, 'column': column,
+                'severity': severity, 'message': message}
+
+    def _check_header(self, df):
+        issues = []
+        for name in REQUIRED_COLUMNS:
+            if name not in df.columns:
+                self.fatal = True
+                issues.append(self._issue(None, None, name, 'error', f"Missing required column {name}"))
+        for name in df.columns:
+            if name not in KNOWN_COLUMNS:
+                issues.append(self._issue(None, None, name, 'warning', f"Unknown column {name} is ignored"))
+        return issues
+
+    def check(self, df):
+        """
+        Validate a chunk. Returns its issues and the mask of rows that cannot
+        be imported.
+        """
+        issues = []
+        if not self._header_checked:
+            self._header_checked = True
+            issues += self._check_header(df)
+            if self.fatal:
+                return issues, pd.Series(True, index=df.index).to_numpy()
+
+        # Spreadsheet row numbers: the header is row 1
+        rows = pd.Series(df.index + 2, index=df.index)
+        legajo = column(df, 'Legajo')
+        legajos = legajo.map(str)
+
+        missing = (legajo.isna() | column(df, 'Nombre').isna()).to_numpy()
+        malformed = (~missing & ~legajos.str.match(LEGAJO_PATTERN)).to_numpy()
+        bad = pd.Series(missing | malformed, index=df.index)
+
+        # Rows of a student before its first row with a career
+        candidates = ~bad & ~legajos.isin(self._enrolled)
+        has_career = present(column(df, 'Carrera'))
+        enrolled = has_career[candidates].groupby(legajos[candidates]).cummax()
+        no_career = enrolled.index[~enrolled.to_numpy()]
+        self._enrolled.update(legajos[candidates & has_career])
+        bad[no_career] = True
+
+        for row, value in zip(rows[missing], legajo[missing]):
+            issues.append(self._issue(int(row), None if pd.isna(value) else str(value), 'Legajo/Nombre', 'error',
+                                      "Missing required student data (Legajo or Nombre)"))
+        for row, value in zip(rows[malformed], legajos[malformed]):
+            issues.append(self._issue(int(row), value, 'Legajo', 'error', f"Invalid legajo format: {value!r}"))
+        for row, value in zip(rows[no_career], legajos[no_career]):
+            issues.append(self._issue(int(row), value, 'Carrera', 'error',
+                                      f"Missing or invalid career name for student {value}"))
+
+        if 'Fecha Nacimiento' in df.columns:
+            dates = df['Fecha Nacimiento']
+            invalid = ~bad & present(dates) & parse_birth_dates(dates).isna()
+            for row, value, date in zip(rows[invalid], legajos[invalid], dates[invalid]):
+                issues.append(self._issue(int(row), value, 'Fecha Nacimiento', 'warning',
+                                          f"Birth date {date!s} is not a date between 1900 and today, stored empty"))
+
+        columns = [name for name in PERSONAL_COLUMNS if name in df.columns]
+        good = ~bad
+        first = pd.DataFrame({
+            'legajo': legajos[good],
+            'row': rows[good],
+            'hash': pd.util.hash_pandas_object(df.loc[good, columns].astype(str), index=False)
+        })
+        # Each row is compared with the first row of its legajo, from an
+        # earlier chunk or else from this one
+        new = first[~first['legajo'].isin(self._first_hash)].drop_duplicates('legajo')
+        self._first_row.update(zip(new['legajo'], new['row']))
+        self._first_hash.update(zip(new['legajo'], new['hash']))
+        differs = first['hash'].to_numpy() != first['legajo'].map(self._first_hash).to_numpy()
+        # Under reject a student with conflicting data is an error, under
+        # skip the last row is kept as the original importer did
+        conflict = 'error' if self.on_error == 'reject' else 'warning'
+        for value, row in zip(first['legajo'][differs], first['row'][differs]):
+            message = f"Personal data differs from row {self._first_row[value]} of the same legajo"
+            if conflict == 'warning':
+                message += ", the last row is kept"
+            issues.append(self._issue(int(row), value, None, conflict, message))
+        if conflict == 'error':
+            bad[first.index[differs]] = True
+
+        if self.on_error == 'skip':
+            self.skipped += int(bad.sum())
+        return issues, bad.to_numpy()
+
+    def rejection(self):
+        """Why the file is rejected, or None"""
+        if self.fatal:
+            return f"{self.source_file} rejected: {self.first_error}"
+        if self.rejected:
+            return f"{self.source_file} rejected: {self.errors} rows with errors, first at {self.first_error}"
+        return None
+
+    def raise_if_rejected(self):
+        message = self.rejection()
+        if message:
+            raise ImportValidationError(message)
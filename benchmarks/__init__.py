@@ -0,0 +1,6 @@
+"""
+Benchmarks for the student visualization app.
+
+Each module is runnable with ``python -m benchmarks.<name>`` from the
+repository root and prints its results as JSON.
+"""
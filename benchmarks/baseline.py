@@ -0,0 +1,255 @@
+"""
+The original app's per-row code, kept as the reference for its rewrites.
+
+``legacy_process_file`` is a copy of the original importer, its ORM
+lookups and per-row commits included; ``legacy_normalize`` is its per-row
+field handling without the database writes. ``edge_cases`` are small
+exports exercising its corner cases (blank and 'nan' cells, numeric legajos,
+unparseable and out-of-range dates, padded names, missing optional columns
+and rows the importer rejects). tests/test_ingestion.py asserts
+``process_file`` writes what ``legacy_process_file`` wrote,
+tests/test_normalization.py that the column-wise normalization matches
+``legacy_normalize``, and benchmarks/normalization.py measures both.
+
+Not a benchmark itself: the tests import it, so changes here change what
+they assert.
+"""
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from app import db
+from app.import_options import STATUS_MAPPING
+from app.models import Career, Course, Status, Student
+from app.normalization import normalize_frame, normalize_header
+
+
+def legacy_get_or_create_status(name):
+    """Get existing status or create a new one"""
+    status = Status.query.filter_by(name=name).first()
+    if not status:
+        status = Status(name=name)
+        db.session.add(status)
+        db.session.commit()
+    return status
+
+
+def legacy_process_file(filepath, file_type):
+    """The original importer: one ORM lookup and commit after another, row by row"""
+    df = pd.read_excel(filepath, header=0)
+    status = legacy_get_or_create_status(STATUS_MAPPING.get(file_type, 'unknown'))
+    status.source_row_count = len(df)
+    db.session.commit()
+
+    processed_students = set()
+    for _, row in df.iterrows():
+        try:
+            if pd.isna(row.get('Legajo')) or pd.isna(row.get('Nombre')):
+                raise ValueError("Missing required student data (Legajo or Nombre) for row")
+
+            student = Student.query.filter_by(legajo=str(row['Legajo'])).first()
+
+            fecha_nacimiento = None
+            if 'Fecha Nacimiento' in row and pd.notna(row['Fecha Nacimiento']):
+                try:
+                    date_val = pd.to_datetime(row['Fecha Nacimiento'], errors='coerce')
+                    if date_val and 1900 <= date_val.year <= datetime.now().year:
+                        fecha_nacimiento = date_val.to_pydatetime()
+                except (ValueError, TypeError, pd.errors.OutOfBoundsDatetime):
+                    pass
+
+            student_data = {
+                'legajo': str(row['Legajo']),
+                'nombre': str(row['Nombre']),
+                'apellido': str(row.get('Apellido', '')),
+                'tipo_documento': str(row['Tipo Documento']) if 'Tipo Documento' in row else str(row.get('Tipo documento', '')),
+                'documento': str(row['Documento']),
+                'nacionalidad': str(row['Nacionalidad']),
+                'fecha_nacimiento': fecha_nacimiento,
+                'domicilio': str(row['Domicilio']),
+                'domicilio_origen': str(row['Domicilio origen']) if 'Domicilio origen' in row else str(row.get('Domicilio Origen', '')),
+                'telefono': str(row['Telefono']),
+                'correo': str(row['Correo']),
+                'cuil': str(row['Cuil']),
+                'sexo': str(row['Sexo']),
+                'source_file': os.path.basename(filepath)
+            }
+            for key, value in student_data.items():
+                if value == 'nan':
+                    student_data[key] = ''
+
+            if student:
+                for key, value in student_data.items():
+                    setattr(student, key, value)
+            else:
+                student = Student(**student_data)
+                db.session.add(student)
+            db.session.commit()
+
+            student_key = f"{student.id}_{status.id}"
+            if student_key in processed_students:
+                continue
+            processed_students.add(student_key)
+
+            if pd.isna(row.get('Carrera')) or str(row.get('Carrera')).lower() == 'nan':
+                raise ValueError(f"Missing or invalid career name for student {row['Legajo']}")
+            career_data = {
+                'name': str(row['Carrera']).strip(),
+                'plan': str(row.get('Plan', '')).strip(),
+                'version': str(row.get('Version', '')).strip()
+            }
+            for key, value in career_data.items():
+                if value.lower() == 'nan':
+                    career_data[key] = ''
+
+            career = Career.query.filter_by(**career_data).first()
+            if not career:
+                career = Career(**career_data)
+                db.session.add(career)
+                db.session.commit()
+            if career not in student.careers:
+                student.careers.append(career)
+                db.session.commit()
+
+            materia_col = next((col for col in row.index if col.strip() == 'Materia'), None)
+            if materia_col and pd.notna(row[materia_col]) and str(row[materia_col]).lower() != 'nan':
+                course_name = str(row[materia_col]).strip()
+                course = Course.query.filter_by(name=course_name, career_id=career.id).first()
+                if not course:
+                    course = Course(name=course_name, career_id=career.id)
+                    db.session.add(course)
+                    db.session.commit()
+                if course not in student.courses:
+                    student.courses.append(course)
+                    db.session.commit()
+
+            if status not in student.statuses:
+                student.statuses.append(status)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            legajo = row.get('Legajo', 'Unknown')
+            if isinstance(e, ValueError):
+                raise Exception(f"Error processing student {legajo}: {str(e)}")
+            raise Exception(f"Error processing student {legajo}: {str(e)}\nData: {row.to_dict()}")
+
+
+def legacy_normalize(df, source_file):
+    """
+    The per-row normalization of the original importer. Returns {legajo:
+    student data} and the (legajo, career, plan, version, course) of the
+    first row of each student.
+    """
+    students = {}
+    enrollments = []
+    processed = set()
+    for _, row in df.iterrows():
+        try:
+            if pd.isna(row.get('Legajo')) or pd.isna(row.get('Nombre')):
+                raise ValueError("Missing required student data (Legajo or Nombre) for row")
+
+            fecha_nacimiento = None
+            if 'Fecha Nacimiento' in row and pd.notna(row['Fecha Nacimiento']):
+                try:
+                    date_val = pd.to_datetime(row['Fecha Nacimiento'], errors='coerce')
+                    if date_val and 1900 <= date_val.year <= datetime.now().year:
+                        fecha_nacimiento = date_val.to_pydatetime()
+                except (ValueError, TypeError, pd.errors.OutOfBoundsDatetime):
+                    pass
+
+            student_data = {
+                'legajo': str(row['Legajo']),
+                'nombre': str(row['Nombre']),
+                'apellido': str(row.get('Apellido', '')),
+                'tipo_documento': str(row['Tipo Documento']) if 'Tipo Documento' in row else str(row.get('Tipo documento', '')),
+                'documento': str(row['Documento']),
+                'nacionalidad': str(row['Nacionalidad']),
+                'fecha_nacimiento': fecha_nacimiento,
+                'domicilio': str(row['Domicilio']),
+                'domicilio_origen': str(row['Domicilio origen']) if 'Domicilio origen' in row else str(row.get('Domicilio Origen', '')),
+                'telefono': str(row['Telefono']),
+                'correo': str(row['Correo']),
+                'cuil': str(row['Cuil']),
+                'sexo': str(row['Sexo']),
+                'source_file': source_file
+            }
+            for key, value in student_data.items():
+                if value == 'nan':
+                    student_data[key] = ''
+            students[student_data['legajo']] = student_data
+
+            if student_data['legajo'] in processed:
+                continue
+            processed.add(student_data['legajo'])
+
+            if pd.isna(row.get('Carrera')) or str(row.get('Carrera')).lower() == 'nan':
+                raise ValueError(f"Missing or invalid career name for student {row['Legajo']}")
+            career_data = {
+                'name': str(row['Carrera']).strip(),
+                'plan': str(row.get('Plan', '')).strip(),
+                'version': str(row.get('Version', '')).strip()
+            }
+            for key, value in career_data.items():
+                if value.lower() == 'nan':
+                    career_data[key] = ''
+
+            course_name = None
+            materia_col = next((col for col in row.index if col.strip() == 'Materia'), None)
+            if materia_col and pd.notna(row[materia_col]) and str(row[materia_col]).lower() != 'nan':
+                course_name = str(row[materia_col]).strip()
+            enrollments.append((student_data['legajo'], career_data['name'], career_data['plan'],
+                                career_data['version'], course_name))
+        except Exception as e:
+            legajo = row.get('Legajo', 'Unknown')
+            if isinstance(e, ValueError):
+                raise Exception(f"Error processing student {legajo}: {str(e)}")
+            raise Exception(f"Error processing student {legajo}: {str(e)}\nData: {row.to_dict()}")
+    return students, enrollments
+
+
+def columnar_normalize(chunks, source_file):
+    """``normalize_frame`` over the chunks of a file, in the shape of ``legacy_normalize``"""
+    students = {}
+    enrollments = []
+    seen_legajos = set()
+    for chunk in chunks:
+        chunk_students, chunk_enrollments = normalize_frame(chunk, source_file, seen_legajos)
+        students.update((record['legajo'], record) for record in chunk_students.to_dict('records'))
+        enrollments.extend(
+            (legajo, career, plan, version, course if isinstance(course, str) else None)
+            for legajo, career, plan, version, course in chunk_enrollments.itertuples(index=False)
+        )
+    return students, enrollments
+
+
+def edge_cases():
+    """Small exports exercising the per-row handling's corner cases, as {name: DataFrame}"""
+    nan = float('nan')
+    header = ['Legajo', 'Apellido', 'Nombre', 'Tipo documento', 'Documento', 'Nacionalidad', 'Fecha Nacimiento',
+              'Domicilio', 'Domicilio Origen', 'Telefono', 'Correo', 'Cuil', 'Sexo', 'Carrera', 'Plan', 'Version',
+              ' Materia ']
+    rows = [
+        [1001, 'Perez', 'Ana', 'DNI', 30000001, 'Argentina', '1990-05-01', 'Calle 1', nan, 2944000001,
+         'ana@example.com', 20300000011, 'F', ' Lic. Biologia ', 2010, 1, ' Quimica '],
+        [1001, nan, 'Ana', 'nan', 30000001.0, 'NaN', datetime(1850, 1, 1), 'Calle 2', 'Bariloche', nan,
+         'ana@example.com', nan, 'F', nan, nan, nan, nan],
+        ['A-12', 'Gomez', 'Luis', nan, '30000002', nan, 'not a date', 'Calle 3', nan, '2944000002', nan,
+         '20-30000002-1', 'M', 'Ing. Forestal', 'NAN', nan, 'nan'],
+        [1002.5, 'Diaz', 'Eva', 'DNI', 30000003, 'Chile', '31/12/1999', nan, nan, nan, nan, nan, nan,
+         'Ing. Forestal', '2015', ' 2 ', 'Botanica'],
+        [1003, 'Ruiz', 'Juan', 'DNI', 30000004, 'Bolivia', datetime.now().replace(year=datetime.now().year + 1),
+         'Calle 5', nan, nan, nan, nan, nan, 'Lic. Biologia', '2010', '1', nan],
+    ]
+    base = pd.DataFrame(rows, columns=normalize_header(header), dtype=object)
+    cases = {'values': base}
+    cases['no_optional_columns'] = base.drop(columns=['Apellido', 'Tipo Documento', 'Fecha Nacimiento',
+                                                      'Domicilio origen', 'Plan', 'Version', 'Materia'])
+    missing_name = base.copy()
+    missing_name.loc[3, 'Nombre'] = nan
+    cases['missing_nombre'] = missing_name
+    missing_career = base.copy()
+    missing_career.loc[2, 'Carrera'] = 'nan'
+    cases['missing_career'] = missing_career
+    cases['missing_column'] = base.drop(columns=['Cuil'])
+    return cases
@@ -0,0 +1,189 @@
+"""
+Delta re-import of a weekly export against merge and replace re-imports.
+
+    python -m benchmarks.delta_import --students 5000 --changed 0.02
+
+The active export of ``benchmarks.exports`` is imported, then the next
+week's export is re-imported in every mode into a copy of that database.
+The next week is either the same file ("unchanged") or, for
+"mostly_unchanged", the file with a share ``--changed`` of its students
+edited: half get a new phone number and half move to another career and
+course. As many students leave as that number of new ones join.
+
+Each import reports its wall time, how long it held ``WRITE_LOCK`` (which is
+how long any other import waits), and the database rows it wrote. Reading
+the file takes most of the wall time in every mode. What a delta import saves
+is the writes, and with them most of the time the lock is held. The delta
+and replace imports must leave the database as an import of the next week's
+file alone does.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from openpyxl import Workbook, load_workbook
+from sqlalchemy import text
+
+from app import db
+from app.import_options import WRITE_LOCK
+from app.ingestion import ImportProgress, process_file
+from benchmarks.exports import generate_exports
+from benchmarks.utils import emit, environment, fail, temporary_app
+
+MODES = ['merge', 'replace', 'delta']
+
+# What the imports are compared on, by natural keys so ids may differ, for
+# the students holding a status: those that left keep their rows. Not
+# source_file: a delta import leaves the students it skips as they are
+HOLDING = "s.id IN (SELECT student_id FROM student_status)"
+STATE_QUERIES = {
+    'students': f"SELECT legajo, nombre, apellido, documento, telefono, cuil, sexo, status_mask "
+                f"FROM student s WHERE {HOLDING} ORDER BY legajo",
+    'careers': f"SELECT s.legajo, c.name, c.plan, c.version FROM student_career x "
+               f"JOIN student s ON s.id = x.student_id JOIN career c ON c.id = x.career_id "
+               f"WHERE {HOLDING} ORDER BY 1, 2, 3, 4",
+    'courses': f"SELECT s.legajo, co.name, c.name, c.plan FROM student_course x "
+               f"JOIN student s ON s.id = x.student_id JOIN course co ON co.id = x.course_id "
+               f"JOIN career c ON c.id = co.career_id WHERE {HOLDING} ORDER BY 1, 2, 3, 4",
+    'statuses': "SELECT s.legajo, st.name FROM student_status x JOIN student s ON s.id = x.student_id "
+                "JOIN status st ON st.id = x.status_id ORDER BY 1, 2",
+    'digests': "SELECT s.legajo, d.digest FROM import_digest d JOIN student s ON s.id = d.student_id ORDER BY 1",
+    'row_counts': "SELECT name, source_row_count FROM status ORDER BY name"
+}
+
+
+class WrittenRows(ImportProgress):
+    def __init__(self):
+        self.rows = 0
+
+    def add_written(self, count):
+        self.rows += count
+
+
+def next_week(path, target, share, seed):
+    """Write ``path`` to ``target`` with a ``share`` of its students edited, dropped and added"""
+    workbook = load_workbook(path, read_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    header = list(next(rows))
+    students = {}
+    for row in rows:
+        students.setdefault(row[0], []).append(list(row))
+    workbook.close()
+
+    column = header.index
+    rng = random.Random(seed)
+    legajos = list(students)
+    count = max(2, round(len(legajos) * share))
+    edited = rng.sample(legajos, count)
+    moved = dict(zip(edited[count // 2:], rng.sample(legajos, count - count // 2)))
+    for legajo in edited[:count // 2]:
+        for row in students[legajo]:
+            row[column('Telefono')] = f'011-{rng.randrange(10 ** 6):06d}'
+    for legajo, other in moved.items():
+        career = students[other][0][column('Carrera'):column('Materia') + 1]
+        for row in students[legajo]:
+            row[column('Carrera'):column('Materia') + 1] = career
+    # Students leave, as many join under new legajos
+    leaving = rng.sample([legajo for legajo in legajos if legajo not in edited], count)
+    for number, legajo in enumerate(leaving):
+        joining = [list(row) for row in students.pop(legajo)]
+        for row in joining:
+            row[0] = f'{legajo}{number}'
+        students[f'{legajo}{number}'] = joining
+
+    output = Workbook(write_only=True)
+    sheet = output.create_sheet()
+    sheet.append(header)
+    for student_rows in students.values():
+        for row in student_rows:
+            sheet.append(row)
+    output.save(target)
+    return {'students': len(students), 'edited': count, 'left': count, 'joined': count}
+
+
+def timed_import(app, path, mode):
+    """Import ``path`` in a thread, timing it and the time it held WRITE_LOCK"""
+    progress = WrittenRows()
+    outcome = {}
+
+    def run():
+        with app.app_context():
+            try:
+                outcome['result'] = process_file(path, 'active', progress=progress, mode=mode)
+            except Exception as e:
+                outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    locked = 0.0
+    locked_since = None
+    start = time.perf_counter()
+    thread.start()
+    while thread.is_alive():
+        now = time.perf_counter()
+        if WRITE_LOCK.locked():
+            locked_since = locked_since or now
+        elif locked_since is not None:
+            locked += now - locked_since
+            locked_since = None
+        thread.join(0.001)
+    end = time.perf_counter()
+    if locked_since is not None:
+        locked += end - locked_since
+    if 'error' in outcome:
+        raise outcome['error']
+    counts = {key: value for key, value in outcome['result'].items()
+              if key in ('added', 'changed', 'unchanged', 'removed')}
+    return dict(counts, seconds=round(end - start, 3), locked_seconds=round(locked, 3), rows_written=progress.rows)
+
+
+def database_state():
+    return {name: [tuple(row) for row in db.session.execute(text(sql))] for name, sql in STATE_QUERIES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--changed', type=float, default=0.02, help='share of students edited, left and joined')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path, rows = generate_exports(directory, students=args.students, seed=args.seed)['active']
+        next_path = os.path.join(directory, 'next.xlsx')
+        changes = next_week(path, next_path, args.changed, args.seed)
+        weeks = {'unchanged': (path, None), 'mostly_unchanged': (next_path, changes)}
+
+        base = os.path.join(directory, 'base.db')
+        with temporary_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + base) as app, app.app_context():
+            process_file(path, 'active')
+            db.session.remove()
+
+        results = {'environment': environment(), 'rows': rows}
+        for week, (week_path, changes) in weeks.items():
+            results[week] = {'changes': changes} if changes else {}
+            states = {}
+            for mode in MODES:
+                copy = os.path.join(directory, f'{week}-{mode}.db')
+                shutil.copyfile(base, copy)
+                with temporary_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + copy) as app:
+                    results[week][mode] = timed_import(app, week_path, mode)
+                    with app.app_context():
+                        states[mode] = database_state()
+            # The base database only holds the active export: both must end up as if the week was imported alone
+            with temporary_app() as app, app.app_context():
+                process_file(week_path, 'active')
+                expected = database_state()
+            for mode in ('replace', 'delta'):
+                different = [name for name in STATE_QUERIES if states[mode][name] != expected[name]]
+                if different:
+                    fail(f"The {mode} import of the {week} week differs from importing it alone: {different}")
+        emit(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+End-to-end benchmark: import generated SIU exports and time the web routes.
+
+    python -m benchmarks.end_to_end --students 20000 --output results.json
+
+The four exports written by ``benchmarks.exports`` are imported with
+``process_file`` into a temporary database (rows/s and peak RSS per file)
+and the active export is re-imported in delta mode. Then the dashboard
+routes are requested through Flask's test client, with and without the
+career filter, the student list is downloaded as CSV and ``fix_duplicates``
+is run. The result cache is disabled so every request does its work.
+Results are printed as JSON, tagged with the current commit so runs of
+different commits can be compared.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from app import db
+from app.ingestion import process_file
+from app.models import Career, User
+from benchmarks.exports import generate_exports
+from benchmarks.utils import emit, environment, fail, peak_rss_mb, temporary_app, time_calls
+
+
+def import_exports(exports):
+    """Import every export in order and report its throughput"""
+    results = {}
+    for file_type, (path, rows) in exports.items():
+        start = time.perf_counter()
+        process_file(path, file_type)
+        seconds = time.perf_counter() - start
+        results[file_type] = {
+            'rows': rows,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds),
+            'peak_rss_mb': peak_rss_mb()
+        }
+    return results
+
+
+def delta_reimport(exports):
+    """Re-import the unchanged active export in delta mode"""
+    path, rows = exports['active']
+    start = time.perf_counter()
+    result = process_file(path, 'active', mode='delta')
+    seconds = time.perf_counter() - start
+    return dict(result, seconds=round(seconds, 3), rows_per_second=round(rows / seconds))
+
+
+def database_mb(path):
+    """Size of the SQLite database including its write-ahead log, in MiB"""
+    size = sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+    return round(size / (1024 * 1024), 1)
+
+
+def time_request(client, path, repeat, method='GET', **kwargs):
+    """Time ``repeat`` requests of ``path``, failing on any error response"""
+    def request():
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code >= 400:
+            fail(f"{method} {path} returned {response.status_code}")
+    return time_calls(request, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--careers', type=int, default=30)
+    parser.add_argument('--courses-per-student', type=int, default=3)
+    parser.add_argument('--overlap', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    # Info logging goes to stdout and would interleave with the JSON output
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        exports = generate_exports(directory, students=args.students, careers=args.careers,
+                                   courses_per_student=args.courses_per_student, overlap=args.overlap,
+                                   seed=args.seed)
+        generation_seconds = round(time.perf_counter() - start, 3)
+
+        with temporary_app(RESULT_CACHE_BACKEND='null') as app, app.app_context():
+            imports = import_exports(exports)
+            imports['active_delta'] = delta_reimport(exports)
+            career = db.session.query(Career.name).order_by(Career.id).limit(1).scalar()
+            admin = User.query.filter_by(is_admin=True).first()
+
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(admin.id)
+                session['_fresh'] = True
+
+            routes = {}
+            for label, query in [('all_careers', {}), ('one_career', {'career': career})]:
+                routes[label] = {
+                    'student_stats': time_request(client, '/api/student-stats', args.repeat, query_string=query),
+                    'students_api': time_request(client, '/api/students', args.repeat, query_string=query)
+                }
+            routes['export_students_csv'] = time_request(client, '/api/export/students.csv', 1)
+            routes['index'] = time_request(client, '/', args.repeat)
+            routes['students_page'] = time_request(client, '/students', args.repeat)
+            routes['fix_duplicates'] = time_request(client, '/fix-duplicates', 1, method='POST')
+
+            results = {
+                'environment': environment(),
+                'parameters': {
+                    'students': args.students, 'careers': args.careers,
+                    'courses_per_student': args.courses_per_student, 'overlap': args.overlap,
+                    'seed': args.seed, 'repeat': args.repeat
+                },
+                'career_filter': career,
+                'generation_seconds': generation_seconds,
+                'database_mb': database_mb(db.engine.url.database),
+                'imports': imports,
+                'routes': routes,
+                'peak_rss_mb': peak_rss_mb()
+            }
+    emit(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
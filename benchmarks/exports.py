@@ -0,0 +1,117 @@
+"""
+Deterministic SIU-style ``.xlsx`` exports for the four import file types.
+
+    python -m benchmarks.exports /tmp/exports --students 20000
+
+Students get one row per course they take, as in the SIU exports, with the
+header variants and blank cells found in real files. ``overlap`` is the share
+of active students that also appear in the re-enrollment export, and the
+share of incoming students that are also listed as active.
+"""
+import argparse
+import os
+import random
+from datetime import datetime
+
+from openpyxl import Workbook
+
+from benchmarks.synthetic import CAREER_NAMES
+
+HEADER = ['Legajo', 'Apellido', 'Nombre', 'Tipo Documento', 'Documento', 'Nacionalidad', 'Fecha Nacimiento',
+          'Domicilio', 'Domicilio origen', 'Telefono', 'Correo', 'Cuil', 'Sexo', 'Carrera', 'Plan', 'Version',
+          'Materia']
+
+# Some SIU exports spell these columns differently
+HEADER_VARIANTS = {'Tipo Documento': 'Tipo documento', 'Domicilio origen': 'Domicilio Origen'}
+
+SEXES = ['F', 'M', 'X', None]
+NATIONALITIES = ['Argentina', 'Argentina', 'Argentina', 'Chile', 'Bolivia', None]
+
+FILE_TYPES = ['active', 'inactive', 'reregistered', 'incoming']
+
+
+def _careers(count):
+    return [(CAREER_NAMES[i % len(CAREER_NAMES)], str(2000 + i // len(CAREER_NAMES) * 5), '1')
+            for i in range(count)]
+
+
+def _student_rows(seed, number, career, courses_per_career, courses_per_student):
+    """
+    The rows of one student: personal data repeated for each course. A
+    student has the same rows in every export that lists it.
+    """
+    rng = random.Random(seed * 1000003 + number)
+    legajo = 100000 + number
+    personal = [
+        legajo, f'Apellido{number}', f'Nombre{number}', 'DNI', 30000000 + number, rng.choice(NATIONALITIES),
+        datetime(1970 + rng.randrange(35), 1 + rng.randrange(12), 1 + rng.randrange(28)),
+        f'Calle {number % 500} {number}', rng.choice([f'Localidad {number % 40}', None]),
+        2944000000 + number, f'alumno{number}@example.com', 20000000000 + number * 10, rng.choice(SEXES)
+    ]
+    courses = rng.sample(range(courses_per_career), min(courses_per_student, courses_per_career))
+    return [personal + list(career) + [f'Materia {k + 1}'] for k in courses]
+
+
+def generate_exports(directory, students=10000, careers=30, courses_per_career=25, courses_per_student=3,
+                     overlap=0.5, seed=42):
+    """
+    Write ``<file_type>.xlsx`` for every import file type into ``directory``.
+
+    Returns {file_type: (path, rows)}; the same arguments always produce the
+    same files.
+    """
+    rng = random.Random(seed)
+    career_list = _careers(careers)
+    incoming_count = students // 10
+    # The newest students are the incoming ones
+    enrolled = {number: rng.choice(career_list) for number in range(students)}
+    active, inactive, reregistered, incoming = [], [], [], []
+    for number in range(students - incoming_count):
+        if rng.random() < 0.7:
+            active.append(number)
+            if rng.random() < overlap:
+                reregistered.append(number)
+        else:
+            inactive.append(number)
+    for number in range(students - incoming_count, students):
+        incoming.append(number)
+        if rng.random() < overlap:
+            active.append(number)
+
+    os.makedirs(directory, exist_ok=True)
+    exports = {}
+    for file_type, numbers in zip(FILE_TYPES, [active, inactive, reregistered, incoming]):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        header = HEADER if file_type != 'inactive' else [HEADER_VARIANTS.get(name, name) for name in HEADER]
+        sheet.append(header)
+        rows = 0
+        for number in numbers:
+            for row in _student_rows(seed, number, enrolled[number], courses_per_career, courses_per_student):
+                sheet.append(row)
+                rows += 1
+        path = os.path.join(directory, f'{file_type}.xlsx')
+        workbook.save(path)
+        exports[file_type] = (path, rows)
+    return exports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--careers', type=int, default=30)
+    parser.add_argument('--courses-per-student', type=int, default=3)
+    parser.add_argument('--overlap', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    exports = generate_exports(args.directory, students=args.students, careers=args.careers,
+                               courses_per_student=args.courses_per_student, overlap=args.overlap,
+                               seed=args.seed)
+    for file_type, (path, rows) in exports.items():
+        print(f"{file_type:<13} {rows:>8} rows  {path}")
+
+
+if __name__ == '__main__':
+    main()
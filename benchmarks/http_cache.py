@@ -0,0 +1,101 @@
+"""
+Bytes and latency of a first and a repeat dashboard visit, with the HTTP
+validators, hashed static URLs and compression of app/http_cache.py.
+
+    python -m benchmarks.http_cache --students 100000
+
+A visit fetches the stylesheet, main.js, the stats cube and the status
+counts. "first_visit" sends no Accept-Encoding, as before compression, and
+"first_visit_gzip" (and "first_visit_br" when brotli is installed) accepts
+compressed bodies. "repeat_visit" is what a browser then sends: nothing for
+the static files, which are cached as immutable under their hashed URLs,
+and the API calls with the ETag it got, answered 304. For each scenario the
+bytes of the bodies, the requests made, the SQL statements they ran and the
+median latency of each resource are reported. Compressed bodies are checked
+to decode to the identity ones.
+"""
+import argparse
+import gzip
+
+from flask import url_for
+
+from app import db
+from app.http_cache import _brotli
+from app.snapshot import refresh_snapshot
+from benchmarks.synthetic import populate_database
+from benchmarks.utils import QueryCounter, emit, environment, fail, temporary_app, time_calls
+
+API_URLS = ['/api/student-stats/cube', '/api/status-overlap']
+
+
+def visit(client, urls, headers, repeat):
+    """Fetch ``urls`` with ``headers`` (a dict per URL); returns the responses and figures"""
+    responses = {}
+    resources = {}
+    with QueryCounter(db.engine) as counter:
+        for url in urls:
+            responses[url] = client.get(url, headers=headers.get(url, {}))
+    for url in urls:
+        response = responses[url]
+        timings = time_calls(lambda: client.get(url, headers=headers.get(url, {})), repeat)
+        resources[url] = {'status': response.status_code, 'bytes': len(response.data),
+                          'encoding': response.headers.get('Content-Encoding'), 'median_ms': timings['median_ms']}
+    return responses, {
+        'requests': len(urls),
+        'bytes': sum(resource['bytes'] for resource in resources.values()),
+        'queries': counter.count,
+        'resources': resources
+    }
+
+
+def decoded(response):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(response.data)
+    if encoding == 'br':
+        return _brotli().decompress(response.data)
+    return response.data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_app() as app, app.app_context():
+        rows = populate_database(students=args.students)
+        refresh_snapshot()
+        with app.test_request_context():
+            static_urls = [url_for('static', filename='css/style.css'), url_for('static', filename='js/main.js')]
+        urls = static_urls + API_URLS
+        client = app.test_client()
+        # Warm the result cache and the snapshot, as any earlier visitor would
+        for url in API_URLS:
+            client.get(url)
+
+        results = {'environment': environment(), 'database': rows}
+        identity, results['first_visit'] = visit(client, urls, {}, args.repeat)
+        encodings = ['gzip'] + (['br'] if _brotli() is not None else [])
+        for encoding in encodings:
+            headers = {url: {'Accept-Encoding': encoding} for url in urls}
+            compressed, results[f'first_visit_{encoding}'] = visit(client, urls, headers, args.repeat)
+            for url in urls:
+                if decoded(compressed[url]) != identity[url].data:
+                    fail(f"The {encoding} body of {url} differs from the identity one")
+
+        headers = {url: {'Accept-Encoding': encodings[-1], 'If-None-Match': identity[url].headers['ETag']}
+                   for url in API_URLS}
+        revalidated, results['repeat_visit'] = visit(client, API_URLS, headers, args.repeat)
+        for url, response in revalidated.items():
+            if response.status_code != 304:
+                fail(f"{url} answered {response.status_code} to a current ETag")
+        results['repeat_visit']['cached_static'] = {
+            url: identity[url].headers.get('Cache-Control') for url in static_urls
+        }
+        emit(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
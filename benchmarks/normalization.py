@@ -0,0 +1,77 @@
+"""
+Equivalence and speed of the column-wise normalization against the original
+per-row handling.
+
+    python -m benchmarks.normalization --students 20000
+
+Both versions normalize the generated exports and the edge cases of
+benchmarks/baseline.py, which holds the per-row reference, and must
+produce the same students and enrollments, or fail with the same error.
+tests/test_normalization.py asserts the same on exports as the original
+importer read them.
+"""
+import argparse
+import os
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+from app.readers import iter_chunks
+from benchmarks.exports import generate_exports
+from benchmarks.utils import emit, fail
+from benchmarks.baseline import columnar_normalize, edge_cases, legacy_normalize
+
+
+def _outcome(normalize):
+    try:
+        return normalize()
+    except Exception as e:
+        return str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    # pd.to_datetime warns about every day-first date the per-row version parses
+    warnings.simplefilter('ignore', UserWarning)
+
+    results = {'edge_cases': {}, 'exports': {}}
+    for name, frame in edge_cases().items():
+        legacy = _outcome(lambda: legacy_normalize(frame, 'edge.xlsx'))
+        columnar = _outcome(lambda: columnar_normalize([frame], 'edge.xlsx'))
+        if legacy != columnar:
+            fail(f"Column-wise normalization differs from the per-row handling ({name})")
+        results['edge_cases'][name] = 'error' if isinstance(legacy, str) else 'ok'
+
+    with tempfile.TemporaryDirectory() as directory:
+        exports = generate_exports(directory, students=args.students, seed=args.seed)
+        for file_type, (path, rows) in exports.items():
+            chunks = list(iter_chunks(path))
+            source_file = os.path.basename(path)
+
+            start = time.perf_counter()
+            legacy = legacy_normalize(pd.concat(chunks), source_file)
+            legacy_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            columnar = columnar_normalize(chunks, source_file)
+            columnar_seconds = time.perf_counter() - start
+
+            if legacy != columnar:
+                fail(f"Column-wise normalization differs from the per-row handling ({file_type})")
+            results['exports'][file_type] = {
+                'rows': rows,
+                'per_row_rows_per_second': round(rows / legacy_seconds),
+                'column_wise_rows_per_second': round(rows / columnar_seconds),
+                'speedup': round(legacy_seconds / columnar_seconds, 1)
+            }
+    emit(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
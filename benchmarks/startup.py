@@ -0,0 +1,101 @@
+"""
+Startup benchmark: time a fresh process importing the app, creating it and
+answering its first request.
+
+    python -m benchmarks.startup --repeat 10 --output startup.json
+
+Every boot runs in a new interpreter against a temporary SQLite database, in
+three scenarios: the first boot of an empty database (``AUTO_INIT_DB``
+creates it), a boot against an initialized database (only the readiness
+check runs) and one with ``AUTO_INIT_DB`` off, as after ``flask schema
+init``. For each the import, ``create_app`` and first request (the login
+page) times, the whole process wall time and peak RSS are summarized, and
+the heavy modules loaded by then are listed; pandas, numpy and openpyxl
+should only load once an import runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import emit, environment, fail
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'pyarrow']
+
+# Runs in the fresh interpreter and prints its timings as JSON
+PROBE = f"""
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({{'TESTING': True}})
+created = time.perf_counter()
+status = application.test_client().get('/login').status_code
+answered = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+    'status': status,
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+}}))
+"""
+
+
+def boot(database, auto_init=True):
+    """Boot the app in a new process; returns its timings"""
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database, AUTO_INIT_DB='1' if auto_init else '0')
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if completed.returncode:
+        fail(completed.stderr)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if result['status'] != 200:
+        fail(f"The first request answered {result['status']}")
+    result['process_ms'] = wall_ms
+    return result
+
+
+def summarize(boots):
+    """Median and max of each timing of repeated boots"""
+    summary = {}
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms'):
+        values = [result[key] for result in boots]
+        summary[key] = {'median': round(statistics.median(values), 1), 'max': round(max(values), 1)}
+    summary['peak_rss_mb'] = round(max(result['peak_rss_kb'] for result in boots) / 1024, 1)
+    summary['heavy_modules'] = sorted({name for result in boots for name in result['heavy_modules']})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        first_boots = [boot(os.path.join(directory, f'first-{i}.db')) for i in range(args.repeat)]
+        database = os.path.join(directory, 'startup.db')
+        boot(database)
+        warm_boots = [boot(database) for _ in range(args.repeat)]
+        no_init_boots = [boot(database, auto_init=False) for _ in range(args.repeat)]
+
+    emit({
+        'environment': environment(),
+        'repeat': args.repeat,
+        'first_boot': summarize(first_boots),
+        'initialized': summarize(warm_boots),
+        'no_auto_init': summarize(no_init_boots)
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
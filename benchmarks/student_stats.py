@@ -0,0 +1,178 @@
+"""
+Query count and latency of /api/student-stats before and after the
+single-pass aggregation, on a synthetic database.
+
+    python -m benchmarks.student_stats --students 100000
+
+The "before" numbers come from ``legacy_student_stats``, a copy of the
+per-status query implementation the endpoint used to run, "after" from the
+grouped base-table queries, "summary" from the summary tables and
+"snapshot" from the stats cube of the memory-mapped analytics snapshot the
+endpoint now slices. All versions are checked to return the same statistics.
+The size and build time of the cube /api/student-stats/cube serves to the
+dashboard are reported too, and its slices are checked for a selection of
+several careers, as are the JSON sizes of the full payload and of the top
+courses in the compact encoding.
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import func, text, distinct
+
+from app import db
+from app.models import Student, Status, Career, Course, student_career, student_status
+from app.snapshot import Snapshot, current_snapshot, refresh_snapshot, slice_stats_cube, snapshot_student_stats
+from app.stats import career_names, compute_student_stats
+from app.stats_payload import shape_stats
+from app.summaries import mark_summaries_fresh, rebuild_summaries, summary_student_stats
+from benchmarks.synthetic import populate_database
+from benchmarks.utils import QueryCounter, emit, fail, temporary_app, time_calls
+
+
+def legacy_student_stats(selected_career=None):
+    """The per-status, per-distribution queries the endpoint used to run"""
+    # The endpoint used DISTINCT, whose order followed the (then unindexed)
+    # career table; the career index would now return names sorted
+    all_careers = career_names()
+
+    def get_student_count(status_name):
+        query = db.session.query(Student.id).distinct().join(student_status).join(Status) \
+            .filter(Status.name == status_name)
+        if selected_career:
+            query = query.join(student_career).join(Career).filter(Career.name == selected_career)
+        return query.count()
+
+    status_counts = {
+        'enrollment': {'active': get_student_count('active'), 'inactive': get_student_count('inactive')},
+        'registration': {'re-enrolled': get_student_count('re-enrolled'), 'incoming': get_student_count('incoming')}
+    }
+
+    # Statistics the endpoint only logged
+    base_query = db.session.query(Student.id).distinct()
+    course_query = db.session.query(Course.id).distinct()
+    if selected_career:
+        base_query = base_query.join(student_career).join(Career).filter(Career.name == selected_career)
+        course_query = course_query.join(Career).filter(Career.name == selected_career)
+    base_query.count()
+    course_query.count()
+    course_query.with_entities(Course.name).limit(5).all()
+
+    course_distribution = {'re-enrolled': {}, 'incoming': {}}
+    for status_name in ['re-enrolled', 'incoming']:
+        sql = """
+        SELECT c.id, c.name, ca.name as career_name, COUNT(DISTINCT s.id) as student_count
+        FROM course c
+        JOIN career ca ON c.career_id = ca.id
+        JOIN student_course sc ON c.id = sc.course_id
+        JOIN student s ON sc.student_id = s.id
+        JOIN student_status ss ON s.id = ss.student_id
+        JOIN status st ON ss.status_id = st.id
+        WHERE st.name = :status_name
+        """
+        params = {'status_name': status_name}
+        if selected_career:
+            sql += " AND ca.name = :career_name"
+            params['career_name'] = selected_career
+        sql += " GROUP BY c.id, c.name, ca.name HAVING COUNT(DISTINCT s.id) > 0 ORDER BY ca.name, c.name"
+        for course_id, course_name, career_name, student_count in db.session.execute(text(sql), params):
+            course_distribution[status_name][f"{course_name} [{career_name}]"] = student_count
+
+    career_distribution = {'re-enrolled': {}, 'incoming': {}}
+    for status_name in ['re-enrolled', 'incoming']:
+        sql = """
+        SELECT c.name as career_name, COUNT(DISTINCT s.id) as student_count
+        FROM career c
+        JOIN student_career sc ON c.id = sc.career_id
+        JOIN student s ON sc.student_id = s.id
+        JOIN student_status ss ON s.id = ss.student_id
+        JOIN status st ON ss.status_id = st.id
+        WHERE st.name = :status_name
+        """
+        params = {'status_name': status_name}
+        if selected_career:
+            sql += " AND c.name = :career_name"
+            params['career_name'] = selected_career
+        sql += " GROUP BY c.name HAVING COUNT(DISTINCT s.id) > 0 ORDER BY c.name"
+        for career_name, student_count in db.session.execute(text(sql), params):
+            career_distribution[status_name][career_name] = student_count
+
+    def get_gender_distribution(status_names):
+        gender_query = db.session.query(Student.sexo, func.count(distinct(Student.id))) \
+            .join(student_status).join(Status) \
+            .filter(Student.sexo != '').filter(Status.name.in_(status_names))
+        if selected_career:
+            gender_query = gender_query.join(student_career).join(Career).filter(Career.name == selected_career)
+        return {gender: count for gender, count in gender_query.group_by(Student.sexo).all() if gender}
+
+    return {
+        'status_counts': status_counts,
+        'course_distribution': course_distribution,
+        'career_distribution': career_distribution,
+        'gender_distribution': {
+            'enrollment': get_gender_distribution(['active', 'inactive']),
+            'registration': get_gender_distribution(['re-enrolled', 'incoming'])
+        },
+        'careers': all_careers
+    }
+
+
+def measure(implementation, selected_career, repeat):
+    with QueryCounter(db.engine) as counter:
+        implementation(selected_career)
+    timings = time_calls(lambda: implementation(selected_career), repeat)
+    return dict(queries=counter.count, **timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_app() as app, app.app_context():
+        rows = populate_database(students=args.students)
+        rebuild_summaries()
+        mark_summaries_fresh()
+        db.session.commit()
+        refresh_snapshot()
+        current_snapshot()
+        career = db.session.query(Career.name).order_by(Career.id).first()[0]
+
+        results = {'database': rows, 'career_filter': career, 'runs': {}}
+        for label, selected_career in [('all_careers', None), ('one_career', career)]:
+            if legacy_student_stats(selected_career) != compute_student_stats(selected_career):
+                fail(f"Legacy and single-pass statistics differ ({label})")
+            if summary_student_stats(selected_career) != compute_student_stats(selected_career):
+                fail(f"Summary and base table statistics differ ({label})")
+            if snapshot_student_stats(selected_career) != compute_student_stats(selected_career):
+                fail(f"Snapshot and base table statistics differ ({label})")
+            results['runs'][label] = {
+                'before': measure(legacy_student_stats, selected_career, args.repeat),
+                'after': measure(compute_student_stats, selected_career, args.repeat),
+                'summary': measure(summary_student_stats, selected_career, args.repeat),
+                'snapshot': measure(snapshot_student_stats, selected_career, args.repeat)
+            }
+
+        careers = career_names()[:3]
+        cube = current_snapshot().stats_cube()
+        if slice_stats_cube(cube, careers) != compute_student_stats(careers):
+            fail("Stats cube and base table statistics differ (three careers)")
+        start = time.perf_counter()
+        Snapshot.load(current_snapshot().directory).stats_cube()
+        results['cube'] = {
+            'build_ms': round((time.perf_counter() - start) * 1000, 1),
+            'cells': len(cube['cells']),
+            'json_bytes': len(json.dumps(cube))
+        }
+        stats = snapshot_student_stats()
+        results['payload_bytes'] = {
+            'full': len(json.dumps(stats)),
+            'top_20_compact': len(json.dumps(shape_stats(stats, top=20, encoding='compact')))
+        }
+        emit(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
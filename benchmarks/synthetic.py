@@ -0,0 +1,89 @@
+"""
+Synthetic student databases written straight into the tables.
+
+The distributions loosely follow the SIU exports: careers come in several
+plans sharing a name, most students are active, re-enrolled and incoming
+students overlap with active ones and each student takes a few courses of
+their career.
+"""
+import random
+
+from app import db
+from app.models import Student, Career, Course, Status, student_career, student_course, student_status
+from app.status_masks import refresh_status_masks
+
+CAREER_NAMES = [
+    'Licenciatura en Biología', 'Profesorado en Biología', 'Licenciatura en Ciencias Biológicas',
+    'Ingeniería Electrónica', 'Profesorado en Matemática', 'Licenciatura en Historia',
+    'Profesorado en Historia', 'Licenciatura en Enfermería', 'Tecnicatura en Hidrocarburos',
+    'Profesorado en Educación Física', 'Licenciatura en Psicología', 'Profesorado en Química',
+    'Licenciatura en Turismo', 'Profesorado en Geografía', 'Licenciatura en Administración'
+]
+
+SEXES = ['F', 'M', 'X', '']
+
+BATCH_SIZE = 5000
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def populate_database(students=100000, careers=30, courses_per_career=25, courses_per_student=3, seed=42):
+    """
+    Fill the current app's database with synthetic students.
+
+    Returns the number of rows written per table.
+    """
+    rng = random.Random(seed)
+    Status.initialize_default_statuses()
+    status_ids = {status.name: status.id for status in Status.query}
+
+    career_rows = [
+        {'id': i + 1, 'name': CAREER_NAMES[i % len(CAREER_NAMES)], 'plan': str(2000 + i // len(CAREER_NAMES) * 5),
+         'version': '1'}
+        for i in range(careers)
+    ]
+    course_rows = [
+        {'id': career['id'] * 1000 + k, 'name': f'Materia {k + 1}', 'career_id': career['id']}
+        for career in career_rows for k in range(courses_per_career)
+    ]
+
+    student_rows, status_links, career_links, course_links = [], [], [], []
+    for i in range(students):
+        student_id = i + 1
+        student_rows.append({
+            'id': student_id, 'legajo': str(100000 + i), 'nombre': f'Nombre{i}', 'apellido': f'Apellido{i}',
+            'tipo_documento': 'DNI', 'documento': str(30000000 + i), 'sexo': rng.choice(SEXES),
+            'source_file': 'synthetic.xlsx'
+        })
+
+        active = rng.random() < 0.7
+        statuses = ['active'] if active else (['inactive'] if rng.random() < 0.8 else [])
+        if active and rng.random() < 0.5:
+            statuses.append('re-enrolled')
+        if rng.random() < 0.12:
+            statuses.append('incoming')
+        status_links.extend({'student_id': student_id, 'status_id': status_ids[name]} for name in statuses)
+
+        enrolled = rng.sample(career_rows, 2 if rng.random() < 0.1 else 1)
+        for career in enrolled:
+            career_links.append({'student_id': student_id, 'career_id': career['id']})
+            ks = rng.sample(range(courses_per_career), min(courses_per_student, courses_per_career))
+            course_links.extend({'student_id': student_id, 'course_id': career['id'] * 1000 + k} for k in ks)
+
+    _insert(Career.__table__, career_rows)
+    _insert(Course.__table__, course_rows)
+    _insert(Student.__table__, student_rows)
+    _insert(student_status, status_links)
+    _insert(student_career, career_links)
+    _insert(student_course, course_links)
+    refresh_status_masks()
+    db.session.commit()
+
+    return {
+        'students': len(student_rows), 'careers': len(career_rows), 'courses': len(course_rows),
+        'student_status': len(status_links), 'student_career': len(career_links),
+        'student_course': len(course_links)
+    }
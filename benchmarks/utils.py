@@ -0,0 +1,103 @@
+"""Helpers shared by the benchmarks."""
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Counts the SQL statements executed on an engine while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def time_calls(func, repeat):
+    """Call ``func`` ``repeat`` times and summarize the wall times in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(timings), 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'max_ms': round(max(timings), 2)
+    }
+
+
+@contextmanager
+def temporary_app(**config):
+    """
+    Yield an app bound to a throwaway SQLite database, with its uploads,
+    analytics snapshots and result cache files in the same temporary directory
+    """
+    from app import create_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'benchmark.db'),
+            'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+            'SNAPSHOT_DIR': os.path.join(directory, 'snapshot'),
+            'RESULT_CACHE_DIR': os.path.join(directory, 'cache'),
+            'RESULT_CACHE_PATH': os.path.join(directory, 'cache.db'),
+            'TESTING': True
+        }
+        settings.update(config)
+        app = create_app(settings)
+        yield app
+        with app.app_context():
+            from app import db
+            db.engine.dispose()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def environment():
+    """The commit and versions the results were measured with"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version}
+
+
+def emit(results, output=None):
+    """Print results as JSON, also writing them to ``output`` when given"""
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+
+def fail(message):
+    print(message, file=sys.stderr)
+    sys.exit(1)
@@ -1,6 +1,9 @@
 from app import create_app
 
-app = create_app()
+# The processes parsing batch uploads are spawned and import the main module
+# again as __mp_main__: they must not build an app of their own
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
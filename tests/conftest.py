@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from app import create_app, db
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    Create apps bound to throwaway SQLite databases under ``tmp_path``, with
+    their uploads and snapshots next to them; ``config`` overrides settings
+    """
+    apps = []
+
+    def make(name='app', **config):
+        directory = os.path.join(tmp_path, name)
+        os.makedirs(directory, exist_ok=True)
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'students.db'),
+            'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+            'SNAPSHOT_DIR': os.path.join(directory, 'snapshot'),
+            'TESTING': True
+        }
+        settings.update(config)
+        app = create_app(settings)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    """An app with an initialized, empty database, its context pushed"""
+    app = make_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
@@ -0,0 +1,54 @@
+"""Database contents compared by the tests."""
+from sqlalchemy import text
+
+from app import db
+from app.normalization import STUDENT_FIELDS
+
+# What the student, student_status, student_career and student_course tables
+# say about each student, by natural key rather than by id
+STUDENT_TABLES = {
+    'student': f"SELECT {', '.join('s.' + name for name in STUDENT_FIELDS)} FROM student s",
+    'student_status': """
+        SELECT s.legajo, st.name
+        FROM student_status ss JOIN student s ON s.id = ss.student_id JOIN status st ON st.id = ss.status_id
+    """,
+    'student_career': """
+        SELECT s.legajo, ca.name, ca.plan, ca.version
+        FROM student_career sca JOIN student s ON s.id = sca.student_id JOIN career ca ON ca.id = sca.career_id
+    """,
+    'student_course': """
+        SELECT s.legajo, c.name, ca.name, ca.plan, ca.version
+        FROM student_course sc JOIN student s ON s.id = sc.student_id JOIN course c ON c.id = sc.course_id
+        JOIN career ca ON ca.id = c.career_id
+    """
+}
+
+
+def student_tables(with_status=True):
+    """
+    Sorted rows of ``STUDENT_TABLES``; ``with_status`` leaves out students
+    holding no status, whose rows imports keep
+    """
+    tables = {}
+    for name, sql in STUDENT_TABLES.items():
+        if with_status:
+            sql += f" {'AND' if 'WHERE' in sql else 'WHERE'} s.id IN (SELECT student_id FROM student_status)"
+        tables[name] = sorted(tuple(row) for row in db.session.execute(text(sql)))
+    return tables
+
+
+def statuses_by_legajo():
+    """{legajo: set of status names} of the students holding any"""
+    statuses = {}
+    for legajo, name in student_tables()['student_status']:
+        statuses.setdefault(legajo, set()).add(name)
+    return statuses
+
+
+def dump_database():
+    """Every table's schema and rows, as SQL statements, from a connection of its own"""
+    connection = db.engine.raw_connection()
+    try:
+        return list(connection.driver_connection.iterdump())
+    finally:
+        connection.close()
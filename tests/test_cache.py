@@ -0,0 +1,59 @@
+"""
+Cached results are copies, the same whichever backend holds them, and a
+data version bump makes them unreachable.
+"""
+import pytest
+
+from app import db, result_cache
+from app.cache import bump_data_version
+from app.ingestion import process_file
+from app.snapshot import snapshot_status_overlap, snapshot_student_stats, stats_cube
+from tests.workbooks import write_exports
+
+BACKENDS = ['memory', 'filesystem', 'sqlite']
+
+
+@pytest.fixture(params=BACKENDS)
+def cache_app(make_app, tmp_path, request):
+    app = make_app(RESULT_CACHE_BACKEND=request.param, RESULT_CACHE_DIR=str(tmp_path / 'cache'),
+                   RESULT_CACHE_PATH=str(tmp_path / 'cache.db'))
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_hits_are_copies(cache_app):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'counts': {'active': [1, 2]}}
+
+    value = result_cache.cached('endpoint', None, compute)
+    value['counts']['active'].append(3)
+    hit = result_cache.cached('endpoint', None, compute)
+    assert hit == {'counts': {'active': [1, 2]}}
+    hit['counts'].clear()
+    assert result_cache.cached('endpoint', None, compute) == {'counts': {'active': [1, 2]}}
+    assert len(calls) == 1
+    assert result_cache.stats()['hits'] == 2
+
+
+def test_bump_invalidates(cache_app):
+    values = iter([1, 2])
+    assert result_cache.cached('endpoint', ['a'], lambda: next(values)) == 1
+    assert result_cache.cached('endpoint', ['a'], lambda: next(values)) == 1
+    bump_data_version()
+    db.session.commit()
+    assert result_cache.cached('endpoint', ['a'], lambda: next(values)) == 2
+    assert result_cache.stats()['misses'] == 2
+
+
+def test_hits_equal_misses(cache_app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=50).items():
+        process_file(path, file_type)
+    # The results of the dashboard endpoints read back as they were computed
+    for endpoint, compute in (('student-stats', snapshot_student_stats), ('stats-cube', stats_cube),
+                              ('status-overlap', snapshot_status_overlap)):
+        computed = result_cache.cached(endpoint, None, compute)
+        assert result_cache.cached(endpoint, None, compute) == computed, endpoint
@@ -0,0 +1,56 @@
+"""
+A delta import writes only the students whose row digest changed, yet must
+leave the database as an import of the new file alone does.
+"""
+from app.ingestion import process_file
+from tests.database import statuses_by_legajo, student_tables
+from tests.workbooks import CAREERS, student_row, write_workbook
+
+
+def _rows(numbers, edits=None):
+    """Two rows per student; ``edits`` maps a number to the columns its first row changes"""
+    edits = edits or {}
+    rows = []
+    for number in numbers:
+        changes = edits.get(number, {})
+        rows.append(student_row(number, course=f'Materia {number % 3 + 1}', **changes))
+        rows.append(student_row(number, course='Materia 9', **{name: value for name, value in changes.items()
+                                                                 if name != 'Materia'}))
+    return rows
+
+
+def test_delta_reimport(make_app, tmp_path):
+    first = write_workbook(tmp_path / 'first.xlsx', _rows(range(10)))
+    career = dict(zip(['Carrera', 'Plan', 'Version'], CAREERS[1]))
+    # 8 and 9 leave, 10 and 11 join; 2 moves, 3 changes career, 4 changes course
+    second = write_workbook(tmp_path / 'second.xlsx', _rows([*range(8), 10, 11], {
+        2: {'Domicilio': 'Otra calle 2', 'Telefono': 2944999999},
+        3: career,
+        4: {'Materia': 'Materia 7'}
+    }))
+
+    with make_app('delta').app_context():
+        result = process_file(first, 'active', mode='delta')
+        assert (result['added'], result['changed'], result['unchanged'], result['removed']) == (10, 0, 0, 0)
+
+        result = process_file(second, 'active', mode='delta')
+        assert result['students'] == 10
+        assert (result['added'], result['changed'], result['unchanged'], result['removed']) == (2, 3, 5, 2)
+        delta = student_tables()
+        assert '100008' not in statuses_by_legajo() and '100009' not in statuses_by_legajo()
+
+        # Uploading the same file again changes nothing
+        result = process_file(second, 'active', mode='delta')
+        assert (result['added'], result['changed'], result['unchanged'], result['removed']) == (0, 0, 10, 0)
+        assert student_tables() == delta
+
+    with make_app('fresh').app_context():
+        process_file(second, 'active')
+        fresh = student_tables()
+
+    # Source files differ by name only; a delta import keeps the name of the file that wrote a student
+    for tables in (delta, fresh):
+        tables['student'] = [row[:-1] for row in tables['student']]
+    assert delta == fresh
+    assert ('100003', *CAREERS[0]) not in delta['student_career']
+    assert ('100004', 'Materia 2', *CAREERS[0]) not in delta['student_course']
@@ -0,0 +1,83 @@
+"""
+Downloads hold the students ``/api/students`` lists for the same filters,
+with the same values, and XLSX files are sent batch by batch.
+"""
+import csv
+import io
+
+from openpyxl import load_workbook
+
+from app import db
+from app.downloads import STUDENT_COLUMNS, _xlsx_chunks, student_batches
+from app.ingestion import process_file
+from app.models import Student
+from tests.workbooks import CAREERS, write_exports
+
+FILTERS = {'status': 'active', 'career': CAREERS[0][0], 'q': 'Apellido1'}
+
+NAMES = [name for name, _ in STUDENT_COLUMNS]
+
+
+def _login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def _listed(client, **filters):
+    """Every student of /api/students for ``filters``, following its cursors"""
+    students, cursor = [], None
+    while True:
+        page = client.get('/api/students', query_string={**filters, 'limit': 7, 'cursor': cursor or ''}).get_json()
+        students += page['students']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return students
+
+
+def _csv_rows(data):
+    rows = list(csv.reader(io.StringIO(data.decode('utf-8-sig'))))
+    return rows[0], [dict(zip(rows[0], row)) for row in rows[1:]]
+
+
+def _xlsx_rows(data):
+    rows = list(load_workbook(io.BytesIO(data), read_only=True).active.iter_rows(values_only=True))
+    return list(rows[0]), [dict(zip(rows[0], row)) for row in rows[1:]]
+
+
+def _expected(student):
+    return {
+        'legajo': student['legajo'],
+        'apellido': student['apellido'],
+        'statuses': '; '.join(student['statuses']),
+        'careers': '; '.join(sorted(f"{career['name']} ({career['plan']})" for career in student['careers']))
+    }
+
+
+def test_downloads_match_student_list(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=200).items():
+        process_file(path, file_type)
+    client = _login(app)
+    students = _listed(client, **FILTERS)
+    assert len(students) > 7
+    expected = [_expected(student) for student in students]
+
+    for fmt, read in (('csv', _csv_rows), ('xlsx', _xlsx_rows)):
+        response = client.get(f'/api/export/students.{fmt}', query_string=FILTERS)
+        assert response.status_code == 200
+        header, rows = read(response.get_data())
+        assert header == NAMES
+        assert set(students[0]) - {'id', 'careers'} <= set(header)
+        assert [{name: row[name] or '' for name in expected[0]} for row in rows] == expected, fmt
+
+
+def test_xlsx_streamed_by_batch(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=50).items():
+        process_file(path, file_type)
+    chunks = list(_xlsx_chunks(STUDENT_COLUMNS, student_batches(batch_size=10)))
+    # A chunk per batch of students and the end of the package
+    assert len(chunks) == 6
+    header, rows = _xlsx_rows(b''.join(chunks))
+    assert header == NAMES
+    students = db.session.query(Student.legajo, Student.fecha_nacimiento).order_by(Student.legajo).all()
+    assert [(row['legajo'], row['fecha_nacimiento']) for row in rows] == [tuple(student) for student in students]
@@ -0,0 +1,53 @@
+"""
+Versioned API responses are revalidated with their ETag, which imports
+change, and compressed for clients that accept it.
+"""
+import gzip
+
+from app.ingestion import process_file
+from tests.workbooks import CAREERS, student_row, write_exports, write_workbook
+
+URL = '/api/student-stats'
+
+
+def test_not_modified(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=50).items():
+        process_file(path, file_type)
+    client = app.test_client()
+    response = client.get(URL)
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag.startswith('W/')
+    assert response.headers['Last-Modified']
+
+    again = client.get(URL, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+
+    # Another request of the same data version gets its own, equal tag
+    assert client.get(URL, query_string={'fields': 'careers'}, headers={'If-None-Match': etag}).status_code == 304
+
+    process_file(write_workbook(tmp_path / 'new.xlsx', [student_row(900, CAREERS[1])]), 'reregistered')
+    changed = client.get(URL, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['status_counts'] != response.get_json()['status_counts']
+
+
+def test_gzip(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=50).items():
+        process_file(path, file_type)
+    client = app.test_client()
+    plain = client.get(URL)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    compressed = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.status_code == 200
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    assert len(compressed.get_data()) < len(plain.get_data())
+    # Revalidation works whatever the encoding
+    assert client.get(URL, headers={'Accept-Encoding': 'gzip',
+                                    'If-None-Match': compressed.headers['ETag']}).status_code == 304
@@ -0,0 +1,125 @@
+"""
+``process_file`` must write the rows the original per-row importer wrote
+through the ORM, and report as errors the rows it failed on.
+"""
+import csv
+import re
+import warnings
+
+import pytest
+from sqlalchemy import text
+
+from app import db, job_queue
+from app.ingestion import process_file
+from app.normalization import STUDENT_FIELDS
+from app.validation import ImportValidationError
+from benchmarks.baseline import legacy_process_file
+from tests.database import dump_database, student_tables
+from tests.workbooks import CAREERS, HEADER, student_row, write_workbook
+
+# Every row the importers write, by natural key
+TABLES = {
+    'career': "SELECT name, plan, version FROM career",
+    'course': "SELECT c.name, ca.name, ca.plan, ca.version FROM course c JOIN career ca ON ca.id = c.career_id"
+}
+
+ROWS = [
+    # Blank numeric cells make their whole column a float column
+    student_row(0, Documento=None, Telefono=None),
+    # A repeated legajo keeps the personal data of its last row, the career and course of its first
+    student_row(1),
+    student_row(1, CAREERS[1], 'Materia 2', Apellido='Otro', Domicilio='Otra calle'),
+    student_row(2, CAREERS[2], course=None, Sexo=None),
+    student_row(3, CAREERS[2], 'Materia 3', Version=None, **{'Fecha Nacimiento': None}),
+    student_row(1, course='Materia 4'),
+]
+
+# Rows the original importer failed on, appended to ``ROWS``: (row, its
+# error without the "Error processing student <legajo>: " prefix)
+FAILING = {
+    'missing_nombre': (student_row(4, Nombre=None), "Missing required student data (Legajo or Nombre) for row"),
+    'missing_legajo': (student_row(5, Legajo=None), "Missing required student data (Legajo or Nombre) for row"),
+    'missing_career': (student_row(6, Carrera=None), "Missing or invalid career name for student 100006"),
+}
+
+
+def _tables():
+    # The original left the student of a row without career holding no status
+    tables = student_tables()
+    for name, sql in TABLES.items():
+        tables[name] = sorted(tuple(row) for row in db.session.execute(text(sql)))
+    return tables
+
+
+def _legacy_import(path, file_type='active'):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        legacy_process_file(path, file_type)
+
+
+def test_same_rows_as_original(make_app, tmp_path):
+    first = write_workbook(tmp_path / 'first.xlsx', ROWS)
+    second = write_workbook(tmp_path / 'second.xlsx', [student_row(1, CAREERS[3], Correo=None), student_row(7)])
+    with make_app('original').app_context():
+        _legacy_import(first)
+        _legacy_import(second, 'inactive')
+        original = _tables()
+    # Under reject the changed personal data of legajo 100001 is an error; skip
+    # keeps its last row like the original
+    with make_app('rewrite').app_context():
+        process_file(first, 'active', on_error='skip')
+        process_file(second, 'inactive', on_error='skip')
+        rewrite = _tables()
+
+    assert rewrite == original
+    students = {row[0]: dict(zip(STUDENT_FIELDS, row)) for row in rewrite['student']}
+    assert students['100000']['documento'] == ''
+    assert students['100003']['documento'] == '30000003.0'
+    assert students['100003']['telefono'] == '2944000003.0'
+    assert students['100001']['apellido'] == 'Apellido1'
+    # A blank Version makes the column float: '1' was stored as '1.0'
+    assert ('100001', 'Materia 1', 'Lic. Biologia', '2010', '1.0') in rewrite['student_course']
+    assert ('100001', *CAREERS[1]) not in rewrite['student_career']
+
+
+@pytest.mark.parametrize('name', sorted(FAILING))
+def test_failing_rows(make_app, tmp_path, name):
+    row, message = FAILING[name]
+    path = write_workbook(tmp_path / 'failing.xlsx', ROWS + [row])
+    # The original committed the rows before the one it failed on, read with
+    # the column types of the whole file
+    with make_app('original').app_context():
+        with pytest.raises(Exception, match='^Error processing student [^:]+: ' + re.escape(message)):
+            _legacy_import(path)
+        original = _tables()
+
+    # The rewrite reports that row, after the changed personal data of row
+    # 4, and writes nothing...
+    with make_app('rejected').app_context():
+        before = dump_database()
+        job = job_queue.new_job('failing.xlsx', 'active')
+        with pytest.raises(ImportValidationError, match='2 rows with errors, first at row 4:'):
+            process_file(path, 'active', progress=job)
+        assert dump_database() == before
+        with open(job_queue.report_path(job.id), newline='') as f:
+            errors = sorted(issue['row'] for issue in csv.DictReader(f) if issue['severity'] == 'error')
+        assert errors == ['4', str(len(ROWS) + 2)]
+
+    # ...or, skipping it, writes the rows before
+    with make_app('skipped').app_context():
+        process_file(path, 'active', on_error='skip')
+        assert _tables() == original
+
+
+def test_missing_column(make_app, tmp_path):
+    header = [name for name in HEADER if name != 'Cuil']
+    rows = [[value for name, value in zip(HEADER, row) if name != 'Cuil'] for row in ROWS]
+    path = write_workbook(tmp_path / 'no_cuil.xlsx', rows, header)
+    with make_app('original').app_context():
+        with pytest.raises(Exception, match="^Error processing student 100000: 'Cuil'\nData: "):
+            _legacy_import(path)
+    with make_app('rewrite').app_context():
+        before = dump_database()
+        with pytest.raises(ImportValidationError, match='Missing required column Cuil'):
+            process_file(path, 'active', on_error='skip')
+        assert dump_database() == before
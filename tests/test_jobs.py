@@ -0,0 +1,101 @@
+"""
+Uploads run as background jobs whose state is served by ``/api/jobs/<id>``,
+by the app that accepted them, and are swept once old.
+"""
+import csv
+import io
+import os
+import time
+
+from sqlalchemy import text
+
+from app import db, job_queue
+from tests.workbooks import CAREERS, student_row, write_workbook
+
+ROWS = [
+    student_row(0),
+    student_row(1, CAREERS[1], **{'Fecha Nacimiento': 'no es fecha'}),
+    student_row(2, CAREERS[2], 'Materia 2'),
+]
+
+
+def _login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def _upload(client, path, timeout=30):
+    """Upload ``path`` and poll its job until it is done; returns its state"""
+    with open(path, 'rb') as f:
+        response = client.post('/upload', data={'file': (f, os.path.basename(path)), 'file_type': 'active'},
+                               headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in ('finished', 'failed') and job['finished_at']:
+            return job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.05)
+
+
+def _students(app):
+    with app.app_context():
+        return db.session.execute(text("SELECT legajo FROM student ORDER BY legajo")).scalars().all()
+
+
+def test_upload_job(make_app, tmp_path):
+    app = make_app()
+    client = _login(app)
+    job = _upload(client, write_workbook(tmp_path / 'activos.xlsx', ROWS))
+
+    assert job['status'] == 'finished', job['errors']
+    assert job['phase'] == 'done'
+    assert job['rows_parsed'] == 3
+    assert job['rows_written'] > 0
+    assert job['result'] == {'rows': 3, 'students': 3, 'skipped': 0, 'warnings': 1}
+    assert job['issue_counts'] == {'error': 0, 'warning': 1}
+    assert _students(app) == ['100000', '100001', '100002']
+
+    response = client.get(f"/api/jobs/{job['id']}/report")
+    assert response.status_code == 200
+    issues = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(issue['row'], issue['legajo'], issue['column'], issue['severity']) for issue in issues] == \
+        [('3', '100001', 'Fecha Nacimiento', 'warning')]
+    # Only the report is left of the upload
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], job['id'])) == ['validation-report.csv']
+
+
+def test_jobs_per_app(make_app, tmp_path):
+    first, second = make_app('first'), make_app('second')
+    path = write_workbook(tmp_path / 'activos.xlsx', ROWS[:1])
+    first_job = _upload(_login(first), path)
+    second_job = _upload(_login(second), write_workbook(tmp_path / 'otros.xlsx', ROWS[1:]))
+
+    assert first_job['status'] == second_job['status'] == 'finished'
+    # Each app imports into its own database and knows only its own jobs
+    assert _students(first) == ['100000']
+    assert _students(second) == ['100001', '100002']
+    assert _login(first).get(f"/api/jobs/{second_job['id']}").status_code == 404
+    with second.app_context():
+        assert job_queue.get(second_job['id'])['id'] == second_job['id']
+
+
+def test_sweep(make_app, tmp_path):
+    app = make_app(JOB_RETENTION=3600)
+    client = _login(app)
+    old = _upload(client, write_workbook(tmp_path / 'activos.xlsx', ROWS))
+    recent = _upload(client, write_workbook(tmp_path / 'otros.xlsx', ROWS))
+    folder = app.config['JOBS_FOLDER']
+    stale = time.time() - 2 * 3600
+    os.utime(os.path.join(folder, f"{old['id']}.json"), (stale, stale))
+
+    with app.app_context():
+        assert job_queue.sweep() == 1
+        assert job_queue.get(old['id']) is None
+        assert job_queue.get(recent['id'])['status'] == 'finished'
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], old['id']))
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], recent['id'], 'validation-report.csv'))
+    assert client.get(f"/api/jobs/{old['id']}/report").status_code == 404
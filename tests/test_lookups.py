@@ -0,0 +1,67 @@
+"""
+The cached identity maps must be dropped or reloaded whenever careers and
+courses change, and cached users rebuilt for every request.
+"""
+from sqlalchemy import text
+
+from app import db
+from app.ingestion import process_file
+from app.lookups import identity_maps, load_identity_maps, load_user
+from app.models import User
+from tests.workbooks import CAREERS, student_row, write_workbook
+
+
+def _login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def _maps():
+    maps = identity_maps()
+    return maps.careers, maps.courses
+
+
+def _expected_maps():
+    maps = load_identity_maps()
+    return maps.careers, maps.courses
+
+
+def test_identity_maps_after_clear_data(app, tmp_path):
+    process_file(write_workbook(tmp_path / 'active.xlsx', [student_row(0), student_row(1, CAREERS[1])]), 'active')
+    assert _maps() == _expected_maps() and _maps()[0]
+
+    _login(app).post('/clear-data')
+    db.session.remove()
+    assert _maps() == ({}, {})
+
+
+def test_identity_maps_after_fix_duplicates(app, tmp_path):
+    process_file(write_workbook(tmp_path / 'active.xlsx', [student_row(0), student_row(1, CAREERS[1], 'Suelta')]),
+                 'active')
+    # A course left without its career, as databases of the original app have
+    # them, which the maps of the import still hold
+    db.session.execute(text("UPDATE course SET career_id = NULL WHERE name = 'Suelta'"))
+    db.session.commit()
+    orphan = db.session.execute(text("SELECT id FROM course WHERE name = 'Suelta'")).scalar()
+    assert orphan in _maps()[1].values()
+
+    _login(app).post('/fix-duplicates')
+    db.session.remove()
+    assert orphan not in _maps()[1].values()
+    assert _maps() == _expected_maps()
+
+
+def test_load_user(app):
+    admin = User.query.filter_by(username='admin').one()
+    first, second = load_user(admin.id), load_user(admin.id)
+    assert first is not second
+    assert (first.username, first.is_admin) == (second.username, second.is_admin) == ('admin', True)
+
+    # Writing the user drops it from this process' cache
+    admin.is_admin = False
+    db.session.commit()
+    assert load_user(admin.id).is_admin is False
+    db.session.delete(admin)
+    db.session.commit()
+    assert load_user(admin.id) is None
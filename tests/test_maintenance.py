@@ -0,0 +1,118 @@
+"""
+The set-based ``fix_duplicates`` must change what the original per-row
+/fix-duplicates route changed, and nothing at all in a dry run.
+"""
+from collections import Counter
+
+from sqlalchemy import text
+
+from app import db
+from app.maintenance import ASSOCIATIONS, fix_duplicates
+from app.models import Status
+from app.status_masks import STATUS_BITS, stale_status_masks
+from tests.database import dump_database
+
+CAREERS = [(1, 'Lic. Biologia'), (2, 'Prof. Biologia')]
+
+# (id, name, career_id)
+COURSES = [(1, 'Materia 1', 1), (2, 'Materia 1', 2), (3, 'Materia 2', 2), (4, 'Materia suelta', None)]
+
+STUDENT_CAREERS = [
+    (1, 1), (1, 1),  # duplicate
+    (2, 1),
+    (3, 1)
+]
+
+# (student_id, career_id, course_id) the last active import gave each student
+DIGESTS = [(1, 1, 2), (2, 1, 3), (3, 1, 4)]
+
+STUDENT_COURSES = [
+    (1, 1), (1, 1),  # duplicate
+    (1, 2),  # career 2 is not student 1's, which has 'Materia 1' in career 1
+    (2, 3),  # career 2 is not student 2's, which has no 'Materia 2' elsewhere
+    (3, 4)   # course without a career
+]
+
+
+def _seed():
+    """Association tables without their primary keys, as old databases had them, holding the cases above"""
+    for table, first, second in ASSOCIATIONS:
+        db.session.execute(text(f"DROP TABLE {table}"))
+        db.session.execute(text(f"CREATE TABLE {table} ({first} INTEGER, {second} INTEGER)"))
+    active = Status.query.filter_by(name='active').one().id
+    for id, name in CAREERS:
+        db.session.execute(text("INSERT INTO career (id, name, plan, version) VALUES (:id, :name, '1', '1')"),
+                           {'id': id, 'name': name})
+    for id, name, career_id in COURSES:
+        db.session.execute(text("INSERT INTO course (id, name, career_id) VALUES (:id, :name, :career_id)"),
+                           {'id': id, 'name': name, 'career_id': career_id})
+    # Student 1's mask is stale
+    for id, mask in [(1, 0), (2, STATUS_BITS['active']), (3, STATUS_BITS['active'])]:
+        db.session.execute(text("INSERT INTO student (id, legajo, nombre, status_mask) VALUES (:id, :id, 'X', :mask)"),
+                           {'id': id, 'mask': mask})
+    rows = {
+        'student_status': [(1, active), (1, active), (2, active), (3, active)],
+        'student_career': STUDENT_CAREERS,
+        'student_course': STUDENT_COURSES
+    }
+    for table, first, second in ASSOCIATIONS:
+        db.session.execute(text(f"INSERT INTO {table} ({first}, {second}) VALUES (:first, :second)"),
+                           [{'first': a, 'second': b} for a, b in rows[table]])
+    db.session.execute(text("INSERT INTO import_digest (status_id, student_id, digest, career_id, course_id) "
+                            "VALUES (:status_id, :student_id, 'x', :career_id, :course_id)"),
+                       [{'status_id': active, 'student_id': student_id, 'career_id': career_id, 'course_id': course_id}
+                        for student_id, career_id, course_id in DIGESTS])
+    db.session.commit()
+
+
+def _tables():
+    tables = {table: Counter(tuple(row) for row in db.session.execute(text(f"SELECT {first}, {second} FROM {table}")))
+              for table, first, second in ASSOCIATIONS}
+    tables['course'] = Counter(tuple(row) for row in db.session.execute(text("SELECT id, name, career_id FROM course")))
+    return tables
+
+
+def baseline_fix_duplicates(tables):
+    """The original route's per-row repair, on ``_tables()``"""
+    fixed = {table: Counter(dict.fromkeys(rows, 1)) for table, rows in tables.items()}
+    courses = {id: (name, career_id) for id, name, career_id in fixed['course']}
+    careers, enrollments = fixed['student_career'], fixed['student_course']
+
+    misassigned = [(student_id, course_id) for student_id, course_id in enrollments
+                   if courses[course_id][1] is not None and (student_id, courses[course_id][1]) not in careers]
+    for student_id, course_id in misassigned:
+        name, career_id = courses[course_id]
+        alternate = any(other_name == name and (student_id, other_career) in careers
+                        for other_name, other_career in courses.values())
+        if alternate:
+            del enrollments[(student_id, course_id)]
+        else:
+            careers[(student_id, career_id)] = 1
+
+    for id, (name, career_id) in courses.items():
+        if career_id is None:
+            for student_id, course_id in list(enrollments):
+                if course_id == id:
+                    del enrollments[(student_id, course_id)]
+            del fixed['course'][(id, name, career_id)]
+    return fixed
+
+
+def test_fix_duplicates(app):
+    _seed()
+    before = dump_database()
+
+    report = fix_duplicates(dry_run=True)
+    # One row per duplicate, the dropped enrollment and the added career, the
+    # orphan course and its enrollment, and student 1's mask
+    assert report['rows'] == 3 + 2 + 2 + 1
+    assert dump_database() == before
+
+    expected = baseline_fix_duplicates(_tables())
+    assert fix_duplicates()['rows'] == report['rows']
+    assert _tables() == expected
+    assert stale_status_masks() == 0
+    # The dropped enrollment and the orphan course are gone from the digests too
+    digests = db.session.execute(text("SELECT student_id, career_id, course_id FROM import_digest")).all()
+    assert sorted(map(tuple, digests)) == [(1, 1, None), (2, 1, 3), (3, 1, None)]
+    assert fix_duplicates()['rows'] == 0
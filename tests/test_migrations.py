@@ -0,0 +1,88 @@
+"""
+Upgrading a database created by the original app: its duplicate careers and
+courses are merged before the unique indexes are created.
+"""
+from sqlalchemy import inspect, text
+
+from app import db
+from app.migrations import MIGRATIONS, ensure_database, schema_version
+from app.summaries import check_summaries
+
+# The tables db.create_all() made from the original models
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL, username VARCHAR(64) NOT NULL, password_hash VARCHAR(128), is_admin BOOLEAN,
+        created_at DATETIME, PRIMARY KEY (id), UNIQUE (username)
+    )""",
+    """CREATE TABLE student (
+        id INTEGER NOT NULL, legajo VARCHAR(20) NOT NULL, nombre VARCHAR(100), apellido VARCHAR(100),
+        tipo_documento VARCHAR(20), documento VARCHAR(20), nacionalidad VARCHAR(50), fecha_nacimiento DATETIME,
+        domicilio VARCHAR(200), domicilio_origen VARCHAR(200), telefono VARCHAR(20), correo VARCHAR(100),
+        cuil VARCHAR(20), sexo VARCHAR(10), created_at DATETIME, updated_at DATETIME, source_file VARCHAR(100),
+        PRIMARY KEY (id), UNIQUE (legajo)
+    )""",
+    """CREATE TABLE status (
+        id INTEGER NOT NULL, name VARCHAR(20) NOT NULL, description VARCHAR(200), source_row_count INTEGER,
+        PRIMARY KEY (id), UNIQUE (name)
+    )""",
+    """CREATE TABLE career (
+        id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, plan VARCHAR(20), version VARCHAR(20), PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE course (
+        id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, career_id INTEGER, PRIMARY KEY (id),
+        FOREIGN KEY(career_id) REFERENCES career (id)
+    )""",
+    """CREATE TABLE student_career (
+        student_id INTEGER NOT NULL, career_id INTEGER NOT NULL, PRIMARY KEY (student_id, career_id),
+        FOREIGN KEY(student_id) REFERENCES student (id), FOREIGN KEY(career_id) REFERENCES career (id)
+    )""",
+    """CREATE TABLE student_course (
+        student_id INTEGER NOT NULL, course_id INTEGER NOT NULL, PRIMARY KEY (student_id, course_id),
+        FOREIGN KEY(student_id) REFERENCES student (id), FOREIGN KEY(course_id) REFERENCES course (id)
+    )""",
+    """CREATE TABLE student_status (
+        student_id INTEGER NOT NULL, status_id INTEGER NOT NULL, PRIMARY KEY (student_id, status_id),
+        FOREIGN KEY(student_id) REFERENCES student (id), FOREIGN KEY(status_id) REFERENCES status (id)
+    )"""
+]
+
+BASELINE_DATA = [
+    "INSERT INTO status (id, name, source_row_count) VALUES (1, 'active', 2), (2, 'inactive', 1)",
+    "INSERT INTO student (id, legajo, nombre, sexo) VALUES (1, '1001', 'Ana', 'F'), (2, '1002', 'Luis', 'M'), "
+    "(3, '1003', 'Eva', 'F')",
+    # Careers 1 and 2 are the same, as are their 'Materia 1' once merged
+    "INSERT INTO career (id, name, plan, version) VALUES (1, 'Lic. Biologia', '2010', '1'), "
+    "(2, 'Lic. Biologia', '2010', '1'), (3, 'Ing. Forestal', '2015', '1')",
+    "INSERT INTO course (id, name, career_id) VALUES (1, 'Materia 1', 1), (2, 'Materia 1', 2), (3, 'Materia 2', 2), "
+    "(4, 'Materia 1', 3)",
+    "INSERT INTO student_status VALUES (1, 1), (2, 1), (3, 2)",
+    "INSERT INTO student_career VALUES (1, 1), (1, 2), (2, 2), (3, 3)",
+    "INSERT INTO student_course VALUES (1, 1), (1, 2), (2, 2), (2, 3), (3, 4)"
+]
+
+
+def _rows(sql):
+    return sorted(tuple(row) for row in db.session.execute(text(sql)))
+
+
+def test_upgrade_baseline_database(make_app):
+    with make_app('baseline', AUTO_INIT_DB=False).app_context():
+        for statement in BASELINE_SCHEMA + BASELINE_DATA:
+            db.session.execute(text(statement))
+        db.session.commit()
+
+        assert ensure_database()
+
+        assert _rows("SELECT id, name FROM career") == [(1, 'Lic. Biologia'), (3, 'Ing. Forestal')]
+        assert _rows("SELECT id, name, career_id FROM course") == [(1, 'Materia 1', 1), (3, 'Materia 2', 1),
+                                                                   (4, 'Materia 1', 3)]
+        assert _rows("SELECT student_id, career_id FROM student_career") == [(1, 1), (2, 1), (3, 3)]
+        assert _rows("SELECT student_id, course_id FROM student_course") == [(1, 1), (2, 1), (2, 3), (3, 4)]
+
+        indexes = {index['name']: index for table in ('career', 'course')
+                   for index in inspect(db.engine).get_indexes(table)}
+        assert indexes['ux_career_name_plan_version']['unique']
+        assert indexes['ux_course_name_career_id']['unique']
+        assert schema_version() == MIGRATIONS[-1][0] == 5
+        assert check_summaries() == []
+        assert not ensure_database()
@@ -0,0 +1,90 @@
+"""
+The column-wise normalization of app/normalization.py, fed by the streaming
+readers, must store what the original per-row importer stored from
+``pd.read_excel``: the same students and enrollments, or the same error.
+"""
+import warnings
+
+import pandas as pd
+import pytest
+
+from app.readers import iter_chunks
+from benchmarks.baseline import columnar_normalize, edge_cases, legacy_normalize
+from tests.workbooks import FILE_TYPES, HEADER, write_exports, write_workbook
+
+
+def _outcome(normalize):
+    try:
+        return normalize()
+    except Exception as e:
+        return str(e)
+
+
+def _assert_same_import(path, chunk_size):
+    """The original importer's reading and normalization of ``path`` against the streaming one"""
+    with warnings.catch_warnings():
+        # pd.to_datetime warns about every day-first date the per-row version parses
+        warnings.simplefilter('ignore', UserWarning)
+        legacy = _outcome(lambda: legacy_normalize(pd.read_excel(path, header=0), 'export.xlsx'))
+        columnar = _outcome(lambda: columnar_normalize(iter_chunks(path, chunk_size), 'export.xlsx'))
+    assert columnar == legacy
+    return columnar
+
+
+@pytest.mark.parametrize('name', sorted(edge_cases()))
+def test_edge_cases(name):
+    frame = edge_cases()[name]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        legacy = _outcome(lambda: legacy_normalize(frame, 'edge.xlsx'))
+        columnar = _outcome(lambda: columnar_normalize([frame], 'edge.xlsx'))
+    assert columnar == legacy
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    return write_exports(str(tmp_path_factory.mktemp('exports')), students=400)
+
+
+@pytest.mark.parametrize('file_type', FILE_TYPES)
+def test_exports(exports, file_type):
+    path = exports[file_type]
+    # Small chunks, so students and blank cells fall across chunk boundaries
+    students, enrollments = _assert_same_import(path, chunk_size=97)
+    assert students and enrollments
+
+
+def test_numeric_columns_with_blanks(tmp_path):
+    # pandas reads numeric columns with blanks as floats: their numbers were stored as '30000001.0'
+    rows = [
+        [1001, 'Perez', 'Ana', 'DNI', 30000001, 'Argentina', None, 'Calle 1', None, 2944000001, 'ana@example.com',
+         20300000011, 'F', 'Lic. Biologia', 2010, 1, 'Quimica'],
+        [1002, 'Gomez', 'Luis', 'DNI', 30000002, 'Chile', None, 'Calle 2', None, 2944000002, None,
+         20300000021, 'M', 'Lic. Biologia', 2010, 1, 'Botanica'],
+        [1003, 'Diaz', 'Eva', 'DNI', None, 'Chile', None, 'Calle 3', None, None, None,
+         20300000031, 'F', 'Ing. Forestal', 2015, 2.5, None],
+    ]
+    path = write_workbook(tmp_path / 'blanks.xlsx', rows)
+    # The blanks only show up in the second chunk
+    students, enrollments = _assert_same_import(path, chunk_size=2)
+    assert students['1001']['documento'] == '30000001.0'
+    assert students['1001']['telefono'] == '2944000001.0'
+    assert students['1003']['documento'] == ''
+    # Columns without blanks keep reading as integers
+    assert students['1001']['cuil'] == '20300000011'
+    assert ('1001', 'Lic. Biologia', '2010', '1.0', 'Quimica') in enrollments
+
+
+def test_blank_row_between_students(tmp_path):
+    # A blank row followed by data makes every column of the sheet a float column
+    rows = [
+        [1001, 'Perez', 'Ana', 'DNI', 30000001, 'Argentina', None, 'Calle 1', None, 2944000001, 'ana@example.com',
+         20300000011, 'F', 'Lic. Biologia', 2010, 1, 'Quimica'],
+        [None] * len(HEADER),
+        [1002, 'Gomez', 'Luis', 'DNI', 30000002, 'Chile', None, 'Calle 2', None, 2944000002, None,
+         20300000021, 'M', 'Lic. Biologia', 2010, 1, 'Botanica'],
+    ]
+    path = write_workbook(tmp_path / 'blank_row.xlsx', rows)
+    outcome = _assert_same_import(path, chunk_size=2)
+    assert isinstance(outcome, str)
+
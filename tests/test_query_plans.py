@@ -0,0 +1,35 @@
+"""
+Every query of the web routes must use an index, except for the whole-table
+reads listed in ``DELIBERATE_SCANS``.
+"""
+import sqlite3
+
+from sqlalchemy import text
+
+from app import db
+from app.ingestion import process_file
+from app.query_plans import check_route_plans, copy_database, full_scans
+from tests.workbooks import write_exports
+
+
+def test_route_plans(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=100).items():
+        process_file(path, file_type)
+    assert check_route_plans(db.engine.url.database) == []
+
+
+def test_copy_database(app, tmp_path):
+    process_file(write_exports(tmp_path / 'exports', students=20)['active'], 'active')
+    copy = str(tmp_path / 'copy.db')
+    copy_database(db.engine.url.database, copy)
+    with sqlite3.connect(copy) as connection:
+        copied = connection.execute("SELECT COUNT(*) FROM student").fetchone()[0]
+    assert copied == db.session.execute(text("SELECT COUNT(*) FROM student")).scalar() > 0
+
+
+def test_full_scans(app):
+    assert full_scans("SELECT * FROM student WHERE nombre = ?", ('Ana',)) == ['SCAN student']
+    # Whole-table aggregates are reported too, unless listed as deliberate
+    assert full_scans("SELECT s.nacionalidad, COUNT(*) FROM student s GROUP BY s.nacionalidad", ()) == ['SCAN s']
+    assert full_scans("SELECT * FROM student WHERE legajo = ?", ('1',)) == []
+    assert full_scans("SELECT student_id, course_id FROM student_course", ()) == []
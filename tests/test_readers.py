@@ -0,0 +1,52 @@
+"""
+Chunks read by ``iter_chunks`` must hold the values a whole-file
+``pd.read_excel`` gives, whatever the chunk size.
+"""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from app.readers import iter_chunks
+from tests.workbooks import write_workbook
+
+HEADER = ['Legajo', 'Documento', 'Version', 'Plan', 'Codigo', 'Nombre', 'Fecha Nacimiento', 'Mixta']
+
+ROWS = [
+    # Documento: numbers with a blank; Version: text numbers with a blank;
+    # Plan: text numbers; Codigo: leading zeros; Mixta: numbers and text
+    ['1001', 30000001, '1', '2010', '007', 'Ana', datetime(1990, 5, 1), 1],
+    [1002, None, None, '2015', '008', 'Luis', None, 'uno'],
+    [1003, 30000003, '2', 2005, '009', None, datetime(1985, 1, 31), 2.5],
+]
+
+
+def _as_text(frame):
+    # Missing dates are NaT rather than NaN in a whole-file read, and normalized alike
+    return [['nan' if pd.isna(value) else str(value) for value in row] for row in frame.itertuples(index=False)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 10])
+def test_same_values_as_read_excel(tmp_path, chunk_size):
+    path = write_workbook(tmp_path / 'export.xlsx', ROWS, HEADER)
+    chunks = list(iter_chunks(path, chunk_size))
+    assert [len(chunk) for chunk in chunks] == [min(chunk_size, 3 - start) for start in range(0, 3, chunk_size)]
+    assert _as_text(pd.concat(chunks)) == _as_text(pd.read_excel(path, header=0))
+
+
+def test_numeric_text(tmp_path):
+    path = write_workbook(tmp_path / 'export.xlsx', ROWS, HEADER)
+    # The blank only shows up in the second chunk
+    first = next(iter_chunks(path, 1)).iloc[0]
+    assert [str(first[name]) for name in ('Legajo', 'Documento', 'Version', 'Plan', 'Codigo', 'Mixta')] == \
+        ['1001', '30000001.0', '1.0', '2010', '7', '1']
+
+
+def test_trailing_and_inner_blank_rows(tmp_path):
+    rows = [ROWS[0], [None] * len(HEADER), ROWS[2], [None] * len(HEADER), [None] * len(HEADER)]
+    path = write_workbook(tmp_path / 'export.xlsx', rows, HEADER)
+    chunks = list(iter_chunks(path, 2))
+    assert _as_text(pd.concat(chunks)) == _as_text(pd.read_excel(path, header=0))
+    # The inner blank row makes every numeric column float, the trailing ones are dropped
+    assert str(chunks[0]['Plan'].iloc[0]) == '2010.0'
+    assert sum(len(chunk) for chunk in chunks) == 3
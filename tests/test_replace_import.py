@@ -0,0 +1,56 @@
+"""
+A replace import makes its file the status' whole student set, removing only
+that status from the students missing from it, or changes nothing at all.
+"""
+import pytest
+
+from app.ingestion import process_file
+from app.status_masks import stale_status_masks
+from app.validation import ImportValidationError
+from tests.database import dump_database, statuses_by_legajo, student_tables
+from tests.workbooks import CAREERS, student_row, write_workbook
+
+
+def test_replace_removes_only_the_status(app, tmp_path):
+    process_file(write_workbook(tmp_path / 'active.xlsx', [student_row(number) for number in range(6)]),
+                 'active')
+    process_file(write_workbook(tmp_path / 'reregistered.xlsx', [student_row(number) for number in (1, 2)]),
+                 'reregistered')
+    process_file(write_workbook(tmp_path / 'inactive.xlsx', [student_row(6, CAREERS[1])]), 'inactive')
+
+    # 2 and 5 are missing from the new active export, 7 joins, 1 and 3 change careers
+    replacement = write_workbook(tmp_path / 'active2.xlsx', [
+        student_row(0), student_row(1, CAREERS[1]), student_row(3, CAREERS[1]), student_row(4), student_row(7)
+    ])
+    result = process_file(replacement, 'active', mode='replace')
+    assert result['removed'] == 2
+
+    assert statuses_by_legajo() == {
+        '100000': {'active'},
+        '100001': {'active', 're-enrolled'},
+        '100002': {'re-enrolled'},
+        '100003': {'active'},
+        '100004': {'active'},
+        '100006': {'inactive'},
+        '100007': {'active'}
+    }
+    assert stale_status_masks() == 0
+    careers = student_tables()['student_career']
+    # The student left with another status keeps its enrollment
+    assert ('100002', *CAREERS[0]) in careers
+    # A changed career replaces the old one, unless the file of another status gave it
+    assert ('100003', *CAREERS[0]) not in careers and ('100003', *CAREERS[1]) in careers
+    assert ('100001', *CAREERS[0]) in careers and ('100001', *CAREERS[1]) in careers
+
+
+def test_rejected_replace_changes_nothing(app, tmp_path):
+    process_file(write_workbook(tmp_path / 'active.xlsx', [student_row(number) for number in range(4)]),
+                 'active')
+    before = dump_database()
+
+    # Would drop 2 and 3, but one row has no Nombre
+    replacement = write_workbook(tmp_path / 'active2.xlsx', [student_row(0), student_row(1, Nombre=None),
+                                                             student_row(4)])
+    with pytest.raises(ImportValidationError):
+        process_file(replacement, 'active', mode='replace', on_error='reject')
+    assert dump_database() == before
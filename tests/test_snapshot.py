@@ -0,0 +1,76 @@
+"""
+The snapshot is the single source of the dashboard's statistics: its
+answers must be what the reference queries compute from the base tables,
+and the summary tables are left alone while it serves them.
+"""
+from app.ingestion import process_file
+from app.snapshot import (check_snapshot, current_snapshot, refresh_snapshot, slice_stats_cube,
+                          snapshot_status_overlap, snapshot_student_stats, stats_cube)
+from app.stats import career_names, compute_index_counts, compute_student_stats
+from app.summaries import check_summaries, summaries_fresh
+from tests.workbooks import CAREERS, student_row, write_exports, write_workbook
+
+
+def _import(directory):
+    for file_type, path in write_exports(directory, students=200).items():
+        process_file(path, file_type)
+
+
+def _selections():
+    careers = career_names()
+    # Every career on its own, none and several selected together
+    return [None, *careers, careers[:2], careers]
+
+
+def test_snapshot_answers(app, tmp_path):
+    _import(tmp_path / 'exports')
+    # Until it is built the answers come from the base tables
+    assert current_snapshot() is None
+    assert snapshot_student_stats() == compute_student_stats()
+
+    refresh_snapshot()
+    assert current_snapshot() is not None
+    for selection in _selections():
+        expected = compute_student_stats(selection)
+        assert snapshot_student_stats(selection) == expected
+        assert slice_stats_cube(stats_cube(), selection) == expected
+    counts = snapshot_status_overlap()
+    del counts['status_matrix']
+    assert counts == compute_index_counts()
+    assert check_snapshot() == []
+
+    # Imports do not maintain the summary tables alongside the snapshot
+    assert not summaries_fresh()
+
+
+def test_courses_of_equally_named_careers(app, tmp_path):
+    _import(tmp_path / 'exports')
+    # A second plan of the first career, with courses named like the first plan's
+    name, plan, version = CAREERS[0]
+    other_plan = (name, '2020', version)
+    rows = [student_row(number, other_plan, f'Materia {1 + number % 3}') for number in range(500, 530)]
+    for file_type in ('reregistered', 'incoming'):
+        process_file(write_workbook(tmp_path / f'{file_type}.xlsx', rows[::2] if file_type == 'incoming' else rows),
+                     file_type)
+
+    for built in (False, True):
+        if built:
+            refresh_snapshot()
+        cube = stats_cube()
+        code = cube['careers'].index(name)
+        # The cube keeps the courses of both plans apart
+        plans = {plan for _, course, career, plan, _, *_ in cube['courses']
+                 if course == 'Materia 1' and career == code}
+        assert plans == {'2010', '2020'}
+        assert len({course[0] for course in cube['courses']}) == len(cube['courses'])
+        for selection in (None, name, [name, CAREERS[1][0]]):
+            assert slice_stats_cube(cube, selection) == compute_student_stats(selection)
+
+
+def test_summaries_without_snapshot(make_app, tmp_path):
+    with make_app(ANALYTICS_SNAPSHOT=False).app_context():
+        _import(tmp_path / 'exports')
+        assert summaries_fresh()
+        assert check_summaries() == []
+        for selection in _selections():
+            assert snapshot_student_stats(selection) == compute_student_stats(selection)
@@ -0,0 +1,109 @@
+"""
+The shapes of /api/student-stats (fields=, top=, encoding=compact) and the
+course pages of /api/student-stats/courses hold the full payload's numbers.
+"""
+import pytest
+
+from app.ingestion import process_file
+from app.stats_payload import OTHER, PAYLOAD_FIELDS
+from tests.workbooks import CAREERS, write_exports
+
+STATUSES = ['re-enrolled', 'incoming']
+
+
+@pytest.fixture
+def client(app, tmp_path):
+    for file_type, path in write_exports(tmp_path / 'exports', students=300).items():
+        process_file(path, file_type)
+    return app.test_client()
+
+
+def _stats(client, **args):
+    response = client.get('/api/student-stats', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _decoded(payload):
+    """A compact payload back in the full encoding"""
+    payload = dict(payload)
+    keys = payload.pop('keys')
+    assert payload.pop('encoding') == 'compact'
+    for name, names in keys.items():
+        distribution = {}
+        for status, pairs in payload[name].items():
+            counts = [count for index, count in pairs if index >= 0]
+            # Most students first, OTHER last
+            assert counts == sorted(counts, reverse=True)
+            distribution[status] = {names[index] if index >= 0 else OTHER: count for index, count in pairs}
+        payload[name] = distribution
+    return payload
+
+
+def test_fields(client):
+    full = _stats(client)
+    assert sorted(full) == sorted(PAYLOAD_FIELDS)
+    assert _stats(client, fields='careers,status_counts') == \
+        {'status_counts': full['status_counts'], 'careers': full['careers']}
+    assert _stats(client, fields=['gender_distribution', 'career_distribution']) == \
+        {name: full[name] for name in ('career_distribution', 'gender_distribution')}
+    assert client.get('/api/student-stats', query_string={'fields': 'careers,nope'}).status_code == 400
+
+
+@pytest.mark.parametrize('career', [None, CAREERS[0][0]])
+def test_top(client, career):
+    args = {'career': career} if career else {}
+    full = _stats(client, **args)['course_distribution']
+    shaped = _stats(client, top=3, **args)
+    courses = shaped['course_distribution']
+    assert shaped['course_totals'] == {status: len(full[status]) for status in STATUSES}
+
+    # The same three courses for every status, the most students over all of them
+    totals = {}
+    for status in STATUSES:
+        for key, count in full[status].items():
+            totals[key] = totals.get(key, 0) + count
+    kept = sorted(totals, key=lambda key: (-totals[key], key))[:3]
+    for status in STATUSES:
+        assert set(courses[status]) - {OTHER} <= set(kept)
+        assert {key: count for key, count in courses[status].items() if key != OTHER} == \
+            {key: count for key, count in full[status].items() if key in kept}
+        assert sum(courses[status].values()) == sum(full[status].values())
+        assert OTHER in courses[status]
+    assert client.get('/api/student-stats', query_string={'top': '0'}).status_code == 400
+    assert client.get('/api/student-stats', query_string={'top': 'x'}).status_code == 400
+
+
+def test_compact(client):
+    full = _stats(client)
+    assert _decoded(_stats(client, encoding='compact')) == full
+    shaped = _stats(client, top=4, fields='course_distribution')
+    assert _decoded(_stats(client, top=4, fields='course_distribution', encoding='compact')) == shaped
+    assert client.get('/api/student-stats', query_string={'encoding': 'zip'}).status_code == 400
+
+
+@pytest.mark.parametrize('career', [None, CAREERS[1][0]])
+def test_course_pages(client, career):
+    args = {'career': career} if career else {}
+    full = _stats(client, **args)['course_distribution']
+    for status in STATUSES:
+        pages, cursor = [], None
+        while True:
+            response = client.get('/api/student-stats/courses',
+                                  query_string={**args, 'status': status, 'limit': 4, 'cursor': cursor or ''})
+            assert response.status_code == 200
+            page = response.get_json()
+            assert page['total'] == len(full[status])
+            assert len(page['courses']) <= 4
+            pages.append(page['courses'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert len(pages) > 1
+        entries = [(course['course'], course['students']) for page in pages for course in page]
+        assert entries == sorted(full[status].items(), key=lambda item: (-item[1], item[0]))
+        assert dict(entries) == full[status]
+
+    assert client.get('/api/student-stats/courses', query_string={'status': 'active'}).status_code == 400
+    assert client.get('/api/student-stats/courses',
+                      query_string={'status': 'incoming', 'cursor': 'bad'}).status_code == 400
@@ -0,0 +1,75 @@
+"""
+``Student.status_mask`` must say what ``student_status`` says after every
+kind of import and after ``fix_duplicates``.
+"""
+from collections import Counter
+
+from sqlalchemy import text
+
+from app import db
+from app.ingestion import process_file
+from app.maintenance import fix_duplicates
+from app.stats import compute_index_counts
+from app.status_masks import MASK_SQL, STATUS_BITS, stale_status_masks, status_overlap
+from tests.workbooks import CAREERS, student_row, write_exports, write_workbook
+
+
+def _joined_masks():
+    """{mask: students} with the masks built in Python from student_status joined to status"""
+    masks = dict.fromkeys(db.session.execute(text("SELECT id FROM student")).scalars(), 0)
+    rows = db.session.execute(text("""
+        SELECT ss.student_id, st.name FROM student_status ss JOIN status st ON st.id = ss.status_id
+    """))
+    for student_id, name in rows:
+        masks[student_id] |= STATUS_BITS.get(name, 0)
+    return Counter(masks.values())
+
+
+def _check():
+    assert stale_status_masks() == 0
+    stored = dict(db.session.execute(text("SELECT status_mask, COUNT(*) FROM student GROUP BY status_mask")).all())
+    derived = dict(db.session.execute(text(f"SELECT {MASK_SQL} AS mask, COUNT(*) FROM student GROUP BY mask")).all())
+    assert stored == derived == _joined_masks()
+    for name, bit in STATUS_BITS.items():
+        by_mask = db.session.execute(text(f"SELECT COUNT(*) FROM student WHERE status_mask & {bit}")).scalar()
+        joined = db.session.execute(text("""
+            SELECT COUNT(DISTINCT ss.student_id) FROM student_status ss
+            JOIN status st ON st.id = ss.status_id WHERE st.name = :name
+        """), {'name': name}).scalar()
+        assert by_mask == joined, name
+    counts = status_overlap()
+    del counts['status_matrix']
+    assert counts == compute_index_counts()
+
+
+def test_masks_follow_statuses(app, tmp_path):
+    exports = write_exports(tmp_path / 'exports', students=120)
+    for file_type, path in exports.items():
+        process_file(path, file_type)
+    _check()
+
+    # Merge: students of other files gain a status, new ones join
+    rows = [student_row(number, CAREERS[number % 5]) for number in [*range(0, 120, 4), *range(200, 210)]]
+    process_file(write_workbook(tmp_path / 'merge.xlsx', rows), 'reregistered')
+    _check()
+
+    # Delta: the active students not listed lose their status, twice over
+    for name, numbers in (('delta1.xlsx', range(0, 80)), ('delta2.xlsx', [*range(40, 120), 210, 211])):
+        rows = [student_row(number, CAREERS[number % 5]) for number in numbers]
+        result = process_file(write_workbook(tmp_path / name, rows), 'active', mode='delta')
+        assert result['removed'] > 0
+        _check()
+
+    # Replace: the inactive status moves to a new set of students
+    rows = [student_row(number, CAREERS[number % 5]) for number in range(100, 140)]
+    result = process_file(write_workbook(tmp_path / 'replace.xlsx', rows), 'inactive', mode='replace')
+    assert result['removed'] > 0
+    _check()
+
+    # fix_duplicates repairs masks that drifted
+    db.session.execute(text("UPDATE student SET status_mask = 15 - status_mask WHERE id % 3 = 0"))
+    db.session.commit()
+    assert stale_status_masks() > 0
+    report = fix_duplicates()
+    assert {phase['name']: phase['rows'] for phase in report['phases']}['status_masks'] > 0
+    _check()
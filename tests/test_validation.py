@@ -0,0 +1,75 @@
+"""
+Files with bad rows are either rejected whole or imported without those
+rows, and every issue lands in the job's row report.
+"""
+import csv
+
+import pytest
+
+from app import db, job_queue
+from app.ingestion import process_file
+from app.models import Student
+from app.validation import ImportValidationError
+from tests.database import dump_database
+from tests.workbooks import student_row, write_workbook
+
+# Spreadsheet rows (the header is row 1): 3 and 7 are errors, 4 a warning
+# and 6, a student whose personal data changes, an error under reject and a
+# warning under skip
+ROWS = [
+    student_row(0),
+    student_row(9, Legajo=None),
+    student_row(1, **{'Fecha Nacimiento': 'not a date'}),
+    student_row(2),
+    student_row(2, Apellido='Otro'),
+    student_row(3, Legajo='bad\tlegajo'),
+]
+
+ISSUES = [
+    ('3', '', 'Legajo/Nombre', 'error'),
+    ('4', '100001', 'Fecha Nacimiento', 'warning'),
+    ('6', '100002', '', 'warning'),
+    ('7', 'bad\tlegajo', 'Legajo', 'error'),
+]
+
+REJECT_ISSUES = [issue if issue[0] != '6' else issue[:3] + ('error',) for issue in ISSUES]
+
+
+def _report(job):
+    """(row, legajo, column, severity) of the issues in a job's report CSV"""
+    with open(job_queue.report_path(job.id), newline='') as f:
+        return sorted((row['row'], row['legajo'], row['column'], row['severity']) for row in csv.DictReader(f))
+
+
+def test_reject_writes_nothing(app, tmp_path):
+    path = write_workbook(tmp_path / 'active.xlsx', ROWS)
+    before = dump_database()
+    job = job_queue.new_job('active.xlsx', 'active', on_error='reject')
+    with pytest.raises(ImportValidationError, match='3 rows with errors, first at row 3'):
+        process_file(path, 'active', progress=job, on_error='reject')
+    assert dump_database() == before
+    assert _report(job) == REJECT_ISSUES
+
+
+def test_skip_writes_the_good_rows(app, tmp_path):
+    path = write_workbook(tmp_path / 'active.xlsx', ROWS)
+    job = job_queue.new_job('active.xlsx', 'active', on_error='skip')
+    result = process_file(path, 'active', progress=job, on_error='skip')
+    assert (result['skipped'], result['warnings']) == (2, 2)
+    assert _report(job) == ISSUES
+
+    students = {student.legajo: student for student in db.session.query(Student)}
+    assert sorted(students) == ['100000', '100001', '100002']
+    assert students['100001'].fecha_nacimiento is None
+    # The last row of a legajo is kept
+    assert students['100002'].apellido == 'Otro'
+
+
+def test_legajos_of_the_original(app, tmp_path):
+    # Spaces, punctuation and more than 20 characters, as the original importer took them
+    legajos = ['LEG 2024/000123-ABCDEFGHIJ', 'año 2010 #7']
+    rows = [student_row(number, Legajo=legajo) for number, legajo in enumerate(legajos)]
+    path = write_workbook(tmp_path / 'active.xlsx', rows)
+    result = process_file(path, 'active', on_error='reject')
+    assert result['skipped'] == 0
+    assert sorted(legajo for legajo, in db.session.query(Student.legajo)) == sorted(legajos)
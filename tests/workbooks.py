@@ -0,0 +1,76 @@
+"""
+SIU-style ``.xlsx`` exports written by the tests.
+
+Students get one row per course they take, with the header variants and
+blank cells found in real files, as benchmarks/exports.py generates them at
+scale.
+"""
+import os
+import random
+from datetime import datetime
+
+from openpyxl import Workbook
+
+HEADER = ['Legajo', 'Apellido', 'Nombre', 'Tipo Documento', 'Documento', 'Nacionalidad', 'Fecha Nacimiento',
+          'Domicilio', 'Domicilio origen', 'Telefono', 'Correo', 'Cuil', 'Sexo', 'Carrera', 'Plan', 'Version',
+          'Materia']
+
+# Some SIU exports spell these columns differently
+HEADER_VARIANTS = {'Tipo Documento': 'Tipo documento', 'Domicilio origen': 'Domicilio Origen'}
+
+FILE_TYPES = ['active', 'inactive', 'reregistered', 'incoming']
+
+CAREERS = [('Lic. Biologia', '2010', '1'), ('Prof. Biologia', '2005', '2'), ('Ing. Electronica', '2012', '1'),
+           ('Lic. Historia', '1999', '3'), ('Ing. Forestal', '2015', '1')]
+
+
+def write_workbook(path, rows, header=HEADER):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def student_row(number, career=CAREERS[0], course='Materia 1', **changes):
+    """
+    One row of student ``number``: personal data followed by ``career`` and
+    ``course``. ``changes`` override columns by header name.
+    """
+    values = dict(zip(HEADER, [
+        100000 + number, f'Apellido{number}', f'Nombre{number}', 'DNI', 30000000 + number, 'Argentina',
+        datetime(1980 + number % 20, 1 + number % 12, 1 + number % 28), f'Calle {number}', None,
+        2944000000 + number, f'alumno{number}@example.com', 20000000000 + number * 10, 'FM'[number % 2],
+        *career, course
+    ]))
+    values.update(changes)
+    return [values[name] for name in HEADER]
+
+
+def write_exports(directory, students=400, seed=42):
+    """
+    Write ``<file_type>.xlsx`` for every import file type into ``directory``,
+    the inactive one with the header variants. Returns {file_type: path}.
+    """
+    rng = random.Random(seed)
+    numbers = {file_type: [] for file_type in FILE_TYPES}
+    for number in range(students):
+        file_type = rng.choice(FILE_TYPES)
+        numbers[file_type].append(number)
+        if file_type == 'reregistered' or (file_type == 'incoming' and rng.random() < 0.5):
+            numbers['active'].append(number)
+
+    os.makedirs(directory, exist_ok=True)
+    exports = {}
+    for file_type in FILE_TYPES:
+        rows = []
+        for number in sorted(numbers[file_type]):
+            career = CAREERS[number % len(CAREERS)]
+            blanks = {name: None for name in ('Nacionalidad', 'Sexo', 'Correo') if rng.random() < 0.1}
+            for course in rng.sample(range(1, 11), 3):
+                rows.append(student_row(number, career, f'Materia {course}', **blanks))
+        header = HEADER if file_type != 'inactive' else [HEADER_VARIANTS.get(name, name) for name in HEADER]
+        exports[file_type] = write_workbook(os.path.join(directory, f'{file_type}.xlsx'), rows, header)
+    return exports